@@ -3,17 +3,215 @@
 # Stockholm University
 # DA2005 Programming techniques VT24
 
+# used for importing the modules below the first time they are needed, so starting
+# the studio or running help does not wait for PIL, asyncio and the worker pools
+import importlib
+
+# used for timing script commands and the stages of a render
+import time
+
+# use for error handling of the files
+import os
+
+# used for writing the ascii art to the console or a file
+import sys
+
+# used for identifying images by their content
+import hashlib
+
+# used for the compact session files
+import struct
+import zlib
+
+# used for mapping decoded images from the decode cache without copying them
+import mmap
+
+# used for the least recently used render cache, the latencies of the server and
+# counting colors
+from collections import Counter, OrderedDict, deque
+
+# used for timing the stages of a render
+from contextlib import contextmanager, redirect_stdout
+
+# used for sharing the lookup table of a character ramp between all images
+from functools import lru_cache
+
+# used for releasing the shared decoded image when the last image using it is gone
+import weakref
+
+
+class LazyModule:
+    """
+    A stand-in for a module that imports it when one of its attributes is first used.
+    """
+
+    def __init__(self, name):
+        """
+        Initialize a stand-in for a module without importing it.
+
+        Args:
+            name (str): The full name of the module, e.g. PIL.Image.
+        """
+        self.name = name
+        self.module = None
+
+    def __getattr__(self, attribute):
+        if self.module is None:
+            self.module = importlib.import_module(self.name)
+        return getattr(self.module, attribute)
+
+
 # used for image processing
-from PIL import Image as PILImage, ImageEnhance
+PILImage = LazyModule("PIL.Image")
+ImageEnhance = LazyModule("PIL.ImageEnhance")
+ImageSequence = LazyModule("PIL.ImageSequence")
+ImageChops = LazyModule("PIL.ImageChops")
+ImageFilter = LazyModule("PIL.ImageFilter")
 
 # used for saving the states of the objects to files
-import pickle
+pickle = LazyModule("pickle")
 
 # use for saving and parsing commands entered by user
-import shlex
-
-# use for error handling of the files
-import os
+shlex = LazyModule("shlex")
+
+# used for the command line options
+argparse = LazyModule("argparse")
+
+# used for the compact session files and the decode cache index
+json = LazyModule("json")
+
+# used for converting several images at once
+futures = LazyModule("concurrent.futures")
+
+# used for converting the frames of an animation ahead of playing them
+queue = LazyModule("queue")
+threading = LazyModule("threading")
+
+# used for finding the images of a directory
+glob = LazyModule("glob")
+
+# used for exporting ASCII art to files
+gzip = LazyModule("gzip")
+html = LazyModule("html")
+io = LazyModule("io")
+re = LazyModule("re")
+
+# used for the render server
+asyncio = LazyModule("asyncio")
+http = LazyModule("http")
+shutil = LazyModule("shutil")
+tempfile = LazyModule("tempfile")
+urllib_parse = LazyModule("urllib.parse")
+
+# used for the peak memory of the process, it is not available on Windows
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# characters used for the conversion, from the darkest to the lightest pixel
+ASCII_CHARS = " .:-=+*#%@"[::-1]
+
+# named character ramps for set <alias> charset, also from the darkest to the lightest
+CHARSETS = {
+    "short": ASCII_CHARS,
+    "long": "$@B%8&WM#*oahkbdpqwmZO0QLCJUYXzcvunxrjft/\\|()1{}[]?-_+~<>i!lI;:,\"^`'. ",
+    "blocks": "\u2588\u2593\u2592\u2591 ",
+}
+
+# the image pyramid stops halving before a level gets smaller than this, or once it
+# has this many levels, which keeps it below a third of the loaded image in memory
+PYRAMID_MIN_SIZE = 16
+PYRAMID_MAX_LEVELS = 8
+
+# frames taller than this many rows are split into bands of this height when an
+# image is converted with more than one worker
+BAND_HEIGHT = 128
+
+# rendered rows are written to the output this many at a time
+WRITE_CHUNK_ROWS = 64
+
+# session files start with these bytes and a version number, followed by the
+# session as zlib compressed json
+SESSION_MAGIC = b"AASS"
+SESSION_VERSION = 1
+
+# where decoded images are kept between sessions, unless AAS_CACHE_DIR is set
+DECODE_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "ascii_art_studio")
+# the decode cache writes its index of file hashes after this many new hashes, or
+# when it is saved
+HASH_INDEX_BATCH = 16
+
+# escape codes that clear the terminal and move the cursor to the top left corner
+ANSI_CLEAR = "\x1b[2J"
+ANSI_HOME = "\x1b[H"
+ANSI_RESET = "\x1b[0m"
+ANSI_CLEAR_LINE = "\x1b[K"
+
+# the color modes of set <alias> color, see ColorEncoder
+COLOR_MODES = ("256", "truecolor")
+
+# the red, green and blue levels of the 6x6x6 color cube of 256-color terminals,
+# which starts at color 16
+COLOR_CUBE_LEVELS = (0, 95, 135, 175, 215, 255)
+
+# truecolor channels are rounded to multiples of this, which is too little to see but
+# lets far more neighbouring characters share one escape
+TRUECOLOR_STEP = 8
+
+# the render modes of set <alias> mode, see ASCIIConverter. plain maps every pixel to
+# its nearest character, floyd and bayer dither between neighbouring characters, and
+# edges draws strong edges with EDGE_GLYPHS
+RENDER_MODES = ("plain", "floyd", "bayer", "edges")
+
+# the thresholds (0-63) of ordered dithering, repeated over the frame
+BAYER_MATRIX = (
+    (0, 32, 8, 40, 2, 34, 10, 42),
+    (48, 16, 56, 24, 50, 18, 58, 26),
+    (12, 44, 4, 36, 14, 46, 6, 38),
+    (60, 28, 52, 20, 62, 30, 54, 22),
+    (3, 35, 11, 43, 1, 33, 9, 41),
+    (51, 19, 59, 27, 49, 17, 57, 25),
+    (15, 47, 7, 39, 13, 45, 5, 37),
+    (63, 31, 55, 23, 61, 29, 53, 21),
+)
+
+# the Sobel kernels as PIL's Kernel filter takes them, so that the gradient is
+# positive towards brighter pixels to the right and below
+SOBEL_X = (-1, 0, 1, -2, 0, 2, -1, 0, 1)
+SOBEL_Y = (1, 2, 1, 0, 0, 0, -1, -2, -1)
+
+# the characters of edges mode for horizontal, vertical and the two diagonal edges,
+# and the difference in gray levels across a cell that makes it an edge
+EDGE_GLYPHS = "-|/\\"
+EDGE_MIN_STEP = 64
+
+# a delta render that would be at least this share of a full redraw redraws instead
+DELTA_FULL_RATIO = 0.5
+
+# the render server refuses new conversions while this many are running, uploads
+# larger than this many bytes, and ASCII art of more than this many characters
+SERVER_MAX_PENDING = 64
+SERVER_MAX_UPLOAD_BYTES = 32 * 1024 * 1024
+SERVER_MAX_CELLS = 1000 * 1000
+# a client that sends nothing for this many seconds while its request is read is
+# answered with 408 and disconnected
+SERVER_READ_TIMEOUT = 10.0
+# the number of recent request latencies the server keeps for its metrics
+SERVER_LATENCY_SAMPLES = 1000
+
+# export writes files through buffers of this many bytes, and keeps what it exported
+# for each alias in this file of the export directory
+EXPORT_BUFFER_BYTES = 1024 * 1024
+EXPORT_MANIFEST = ".aas_export.json"
+EXPORT_FORMATS = {"txt": ".txt", "html": ".html", "ansi": ".ans"}
+
+# load dir picks these files when it is not given a pattern
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tif", ".tiff", ".webp")
+
+# callables that are called as hook(name, stage, seconds, size) after every stage
+# of a render, see add_profile_hook()
+PROFILE_HOOKS = []
 
 
 class ASCIIArtStudio:
@@ -25,6 +223,37 @@ class ASCIIArtStudio:
         """Initialize the ASCII Art Studio with no images."""
         self.images = {}
         self.current_image = None
+        self.render_cache = RenderCache()
+        self.decode_cache = DecodeCache()
+        self.delta_writer = DeltaWriter()
+        self.verbose = True
+        self.errors = 0
+
+    def log(self, message):
+        """
+        Print a status message, unless the studio is quiet.
+
+        Args:
+            message (str): The message to print.
+        """
+        if self.verbose:
+            print(message)
+
+    def save_hashes(self):
+        """Write the file hashes the decode cache has not saved yet, if it has any."""
+        if self.decode_cache is not None:
+            self.decode_cache.save_hashes()
+
+    def error(self, message):
+        """
+        Print why a command failed and count it. A quiet studio prints it to stderr,
+        so that it is not mixed into the ASCII art on stdout.
+
+        Args:
+            message (str): The message to print.
+        """
+        self.errors += 1
+        print(message, file=sys.stdout if self.verbose else sys.stderr)
 
     def add_image_to_studio(
         self, filename, target_width=50, target_height=None, alias=None
@@ -41,31 +270,129 @@ class ASCIIArtStudio:
                 If None, the filename is used. Defaults to None.
         """
         if alias:
-            print(f"Attempting to add '{alias}' in ascii art studio")
+            self.log(f"Attempting to add '{alias}' in ascii art studio")
             try:
 
                 if alias in self.images:
-                    print(f"Image with alias '{alias}' already exists.")
+                    self.error(f"Image with alias '{alias}' already exists.")
                     return
-                new_image = ASCIIImage(filename, target_width, target_height, alias)
+                new_image = ASCIIImage(
+                    filename, target_width, target_height, alias, self.decode_cache
+                )
                 self.images[alias] = new_image
                 self.current_image = new_image
-                print(f"Added: {alias}")
+                self.log(f"Added: {alias}")
             except Exception as error:
-                print("Please try again.")
+                self.error("Please try again.")
 
         else:
-            print(f"Attempting to add '{filename}' in ascii art studio")
+            self.log(f"Attempting to add '{filename}' in ascii art studio")
             try:
                 if filename in self.images:
-                    print(f"Image with file name '{filename}' already exists.")
+                    self.error(f"Image with file name '{filename}' already exists.")
                     return
-                new_image = ASCIIImage(filename, target_width)
+                new_image = ASCIIImage(
+                    filename, target_width, decode_cache=self.decode_cache
+                )
                 self.images[filename] = new_image
                 self.current_image = new_image
-                print(f"Added: {filename}")
+                self.log(f"Added: {filename}")
             except Exception as error:
-                print("Please try again.")
+                self.error("Please try again.")
+
+    def add_directory_to_studio(self, path, pattern=None, workers=None):
+        """
+        Add every image of a directory to the studio, decoding them on a worker pool.
+
+        Aliases are made from the file names, and files that cannot be loaded are
+        listed together at the end instead of one message each.
+
+        Args:
+            path (str): The directory.
+            pattern (str, optional): A glob pattern for the files, relative to the
+                directory, e.g. *.png or **/*.jpg. Defaults to every file with one of
+                IMAGE_EXTENSIONS.
+            workers (int, optional): The number of workers. Defaults to the number
+                of processors.
+
+        Returns:
+            list[str]: The aliases of the added images.
+        """
+        if not os.path.isdir(path):
+            self.error(f"Directory {path} not found.")
+            return []
+        if pattern is None:
+            filenames = [
+                os.path.join(path, name)
+                for name in os.listdir(path)
+                if name.lower().endswith(IMAGE_EXTENSIONS)
+            ]
+        else:
+            filenames = glob.glob(os.path.join(path, pattern), recursive=True)
+        filenames = sorted(f for f in filenames if os.path.isfile(f))
+        if not filenames:
+            self.error(f"No images found in {path}.")
+            return []
+
+        self.log(f"Loading {len(filenames)} images from {path}")
+        loaded = {}
+        failed = {}
+        start = time.perf_counter()
+        step = max(1, len(filenames) // 10)
+        with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            jobs = {
+                executor.submit(ingest_image, filename, self.decode_cache): filename
+                for filename in filenames
+            }
+            for done, job in enumerate(futures.as_completed(jobs), 1):
+                filename = jobs[job]
+                try:
+                    loaded[filename] = job.result()
+                except Exception as error:
+                    failed[filename] = error
+                if done % step == 0 and done < len(filenames):
+                    elapsed = time.perf_counter() - start
+                    self.log(
+                        f"  {done}/{len(filenames)} images, "
+                        f"{done / elapsed:.1f} images/s"
+                    )
+
+        aliases = []
+        for filename in filenames:
+            if filename not in loaded:
+                continue
+            alias = self.unique_alias(filename)
+            image = loaded[filename]
+            image.alias = alias
+            image.stats.name = alias
+            self.images[alias] = image
+            self.current_image = image
+            aliases.append(alias)
+
+        elapsed = time.perf_counter() - start
+        self.log(
+            f"Loaded {len(aliases)} images in {elapsed:.2f} s "
+            f"({len(aliases) / elapsed:.1f} images/s)."
+        )
+        if failed:
+            lines = [f"{len(failed)} of {len(filenames)} images could not be loaded:"]
+            lines += [f"  {filename}: {error}" for filename, error in failed.items()]
+            self.error("\n".join(lines))
+        return aliases
+
+    def unique_alias(self, filename):
+        """
+        Return an alias for an image file that is not taken, made from its name
+        without the extension, e.g. hus or hus_2.
+        """
+        stem = os.path.splitext(os.path.basename(filename))[0]
+        base = "_".join(stem.split()) or "image"
+        alias = base
+        number = 2
+        while alias in self.images:
+            alias = f"{base}_{number}"
+            number += 1
+        return alias
 
     def set_image_width(self, alias, new_width):
         """
@@ -76,13 +403,14 @@ class ASCIIArtStudio:
             new_width (int): The new target width for the ASCII conversion.
         """
         if alias not in self.images:
-            print(f"Image with alias '{alias}' does not exist.")
+            self.error(f"Image with alias '{alias}' does not exist.")
             return
 
         image = self.images[alias]
+        self.invalidate_render_cache(image)
         image.set_width(new_width)
         self.current_image = image
-        print(f"Width of image '{alias}' set to {new_width}.")
+        self.log(f"Width of image '{alias}' set to {new_width}.")
 
     def set_image_height(self, alias, new_height):
         """
@@ -93,13 +421,14 @@ class ASCIIArtStudio:
             new_height (int): The new target height for the ASCII conversion.
         """
         if alias not in self.images:
-            print(f"Image with alias '{alias}' does not exist.")
+            self.error(f"Image with alias '{alias}' does not exist.")
             return
 
         image = self.images[alias]
+        self.invalidate_render_cache(image)
         image.set_height(new_height)
         self.current_image = image
-        print(f"Height of image '{alias}' set to {new_height}.")
+        self.log(f"Height of image '{alias}' set to {new_height}.")
 
     def set_image_brightness(self, alias, new_brightness):
         """
@@ -110,13 +439,14 @@ class ASCIIArtStudio:
             new_brightness (float): The new brightness level. Must be a positive number.
         """
         if alias not in self.images:
-            print(f"Image with name '{alias}' does not exist.")
+            self.error(f"Image with name '{alias}' does not exist.")
             return
 
         image = self.images[alias]
+        self.invalidate_render_cache(image)
         image.set_brightness(new_brightness)
         self.current_image = image
-        print(f"'{alias}' set to {new_brightness}.")
+        self.log(f"'{alias}' set to {new_brightness}.")
 
     def set_image_contrast(self, alias, new_contrast):
         """
@@ -127,13 +457,138 @@ class ASCIIArtStudio:
             new_contrast (float): The new contrast level. Must be a positive number.
         """
         if alias not in self.images:
-            print(f"Image with name '{alias}' does not exist.")
+            self.error(f"Image with name '{alias}' does not exist.")
             return
 
         image = self.images[alias]
+        self.invalidate_render_cache(image)
         image.set_contrast(new_contrast)
         self.current_image = image
-        print(f"'{alias}' set to {new_contrast}.")
+        self.log(f"'{alias}' set to {new_contrast}.")
+
+    def set_image_charset(self, alias, new_charset):
+        """
+        Set the characters an image is drawn with.
+
+        Args:
+            alias (str): The alias of the image to modify.
+            new_charset (str): The name of a ramp in CHARSETS, or the characters to
+                use from the darkest to the lightest pixel.
+
+        Raises:
+            ValueError: If the charset is empty or has more than 256 characters.
+        """
+        if alias not in self.images:
+            self.error(f"Image with name '{alias}' does not exist.")
+            return
+
+        image = self.images[alias]
+        self.invalidate_render_cache(image)
+        image.set_charset(new_charset)
+        self.current_image = image
+        self.log(f"Charset of image '{alias}' set to '{image.charset}'.")
+
+    def set_image_color(self, alias, new_color):
+        """
+        Set whether an image is drawn in color, and with which terminal colors.
+
+        Args:
+            alias (str): The alias of the image to modify.
+            new_color (str): One of COLOR_MODES, or off.
+
+        Raises:
+            ValueError: If the color mode is unknown.
+        """
+        if alias not in self.images:
+            self.error(f"Image with name '{alias}' does not exist.")
+            return
+
+        image = self.images[alias]
+        self.invalidate_render_cache(image)
+        image.set_color(new_color)
+        self.current_image = image
+        self.log(f"Color of image '{alias}' set to {image.color or 'off'}.")
+
+    def set_image_mode(self, alias, new_mode):
+        """
+        Set how the pixels of an image are turned into characters.
+
+        Args:
+            alias (str): The alias of the image to modify.
+            new_mode (str): One of RENDER_MODES.
+
+        Raises:
+            ValueError: If the render mode is unknown.
+        """
+        if alias not in self.images:
+            self.error(f"Image with name '{alias}' does not exist.")
+            return
+
+        image = self.images[alias]
+        self.invalidate_render_cache(image)
+        image.set_mode(new_mode)
+        self.current_image = image
+        self.log(f"Render mode of image '{alias}' set to {image.mode}.")
+
+    def set_image_workers(self, alias, new_workers):
+        """
+        Set how many workers convert the bands of a large image at the same time.
+
+        Args:
+            alias (str): The alias of the image to modify.
+            new_workers (int): The number of workers. 1 converts the image in one go.
+        """
+        if alias not in self.images:
+            self.error(f"Image with name '{alias}' does not exist.")
+            return
+
+        image = self.images[alias]
+        image.workers = max(1, new_workers)
+        self.current_image = image
+        self.log(f"Workers of image '{alias}' set to {image.workers}.")
+
+    def set_image_band_height(self, alias, new_band_height):
+        """
+        Set the number of rows in each band when an image is converted by several workers.
+
+        Args:
+            alias (str): The alias of the image to modify.
+            new_band_height (int): The number of rows in each band. Only frames taller
+                than this are split.
+        """
+        if alias not in self.images:
+            self.error(f"Image with name '{alias}' does not exist.")
+            return
+
+        image = self.images[alias]
+        image.band_height = max(1, new_band_height)
+        self.current_image = image
+        self.log(f"Band height of image '{alias}' set to {image.band_height}.")
+
+    def decode_cache_info(self):
+        """Print the size and counters of the decode cache."""
+        print(self.decode_cache)
+
+    def clear_decode_cache(self):
+        """Remove every decoded image from the decode cache."""
+        removed = self.decode_cache.clear()
+        self.log(f"Removed {removed} decoded images from the cache.")
+
+    def invalidate_render_cache(self, image):
+        """
+        Remove the cached render of an image before its settings change.
+
+        The entry is kept if another image in the studio still renders to it,
+        e.g. the same file loaded under two aliases with the same settings.
+
+        Args:
+            image (ASCIIImage): The image that is about to change.
+        """
+        key = image.render_key()
+        for other in self.images.values():
+            if other is not image and other.render_key() == key:
+                return
+        self.render_cache.discard(key)
 
     def studio_info(self):
         """Print information about all images in the studio, including the current image."""
@@ -145,14 +600,40 @@ class ASCIIArtStudio:
         print("ALL IMAGES:")
         for item in self.images.values():
             print(item)
+        # aliases of the same file share one source, so it is counted once
+        sources = {item.source_hash: item.source for item in self.images.values()}
+        pyramid_bytes = sum(source.pyramid_bytes() for source in sources.values())
+        print(f"Image pyramids: {pyramid_bytes} bytes")
+        resident_bytes = sum(
+            source.resident_bytes() for source in sources.values()
+        ) + sum(item.frame_bytes() for item in self.images.values())
+        decoded = sum(source.image is not None for source in sources.values())
+        print(
+            f"Resident image memory: {resident_bytes} bytes, "
+            f"{decoded} decoded images for {len(self.images)} aliases"
+        )
+        print(self.render_cache)
+        print(self.decode_cache)
+        for item in self.images.values():
+            print(item.stats.summary())
+
+    def studio_stats(self):
+        """Print how long each stage of rendering took for every image in the studio."""
+        print("=== Render stats ===")
+        if not self.images:
+            print("No Images Loaded")
+        for item in self.images.values():
+            print(item.stats)
 
-    def render_ascii_art(self, name):
+    def render_ascii_art(self, name, delta=False):
         """
         Render the ASCII art of the specified image or the current image.
 
         Args:
             alias (str, optional): The alias of the image to render.
                 If None, renders the current image. Defaults to None.
+            delta (bool, optional): Only redraw what changed since the last delta
+                render, see DeltaWriter. Defaults to False.
         """
         if name and name in self.images:
             img_obj = self.images[name]
@@ -161,43 +642,396 @@ class ASCIIArtStudio:
         elif self.current_image:
             img_obj = self.current_image
         else:
-            print("No current image selected.")
+            self.error("No current image selected.")
+            return
+        self.current_image = img_obj
+
+        key = img_obj.render_key()
+        ascii = self.render_cache.get(key)
+        if delta:
+            self.render_delta(img_obj, ascii)
+            return
+        # the art is printed below whatever is on the screen, which moves its rows
+        self.delta_writer.forget()
+        if ascii is None:
+            # very large renders are only streamed, they would push out the cache
+            width, height = img_obj.target_size()
+            keep = width * height <= self.render_cache.max_cells
+            img_obj.render(keep=keep, show_size=self.verbose)
+            if keep:
+                self.render_cache.put(img_obj.render_key(), img_obj.ascii)
+            if img_obj.color_report:
+                written, naive = img_obj.color_report
+                self.log(
+                    f"Color output: {written} bytes, {naive} bytes with an escape "
+                    f"for every character ({naive / max(written, 1):.1f}x)."
+                )
+        else:
+            img_obj.render(ascii, show_size=self.verbose)
+
+    def render_delta(self, img_obj, ascii=None):
+        """
+        Draw the ASCII art of an image over the frame it last drew, rewriting only the
+        parts that changed, and report how many bytes that saved.
+
+        Args:
+            img_obj (ASCIIImage): The image to render.
+            ascii (list[str], optional): Already converted ASCII art, e.g. from the
+                render cache. If None, the image is converted. Defaults to None.
+        """
+        if ascii is None:
+            ascii = img_obj.convert_to_ascii()
+            width, height = img_obj.target_size()
+            if width * height <= self.render_cache.max_cells:
+                self.render_cache.put(img_obj.render_key(), ascii)
+        img_obj.ascii = ascii
+
+        start = time.perf_counter()
+        written, full = self.delta_writer.write(ascii)
+        img_obj.stats.record("write", time.perf_counter() - start)
+        self.log(f"Wrote {written} bytes, a full redraw is {full} bytes.")
+
+    def play_animation(self, name, fps=None, loops=1):
+        """
+        Play an animated image (GIF, APNG or multi-frame TIFF) as ASCII art.
+
+        Args:
+            name (str): The alias of the image to play. If None, plays the current image.
+            fps (float, optional): The frame rate to play at. If None, the frame
+                durations stored in the file are used. Defaults to None.
+            loops (int, optional): How many times to play the animation. Defaults to 1.
+        """
+        if name and name in self.images:
+            img_obj = self.images[name]
+        elif not name and self.current_image:
+            img_obj = self.current_image
+        else:
+            self.error(f"Image with alias '{name}' does not exist.")
             return
         self.current_image = img_obj
-        img_obj.render()
 
-    def save_session(self, pickle_name):
+        player = AnimationPlayer(img_obj, fps, loops)
+        try:
+            report = player.play()
+        except KeyboardInterrupt:
+            player.stop()
+            report = player.report()
+        # the player cleared the screen, so nothing drawn before is on it any more
+        self.delta_writer.forget()
+        self.log(
+            f"Played {report['shown']} of {report['frames']} frames in "
+            f"{report['seconds']:.2f} s, dropped {report['dropped']}."
+        )
+
+    def render_batch(self, names, workers=None, use_processes=False):
+        """
+        Render several images, converting them at the same time on a worker pool.
+
+        The images are printed in the order they were given, whatever order the
+        workers finish in.
+
+        Args:
+            names (list[str]): The aliases to render, or ["all"] for every image.
+            workers (int, optional): The number of workers. If None, the pool
+                decides based on the number of CPUs. Defaults to None.
+            use_processes (bool, optional): Use processes instead of threads.
+                Defaults to False.
+        """
+        if names == ["all"] and "all" not in self.images:
+            names = list(self.images)
+
+        images = []
+        for name in names:
+            if name in self.images:
+                images.append(self.images[name])
+            else:
+                self.error(f"Image with alias '{name}' does not exist.")
+        if not images:
+            self.error("No images to render.")
+            return
+
+        converted = self.convert_batch(images, workers, use_processes)
+        self.delta_writer.forget()
+        for image, ascii in zip(images, converted):
+            image.render(ascii, show_size=self.verbose)
+        self.current_image = images[-1]
+
+    def export_images(self, names, directory, fmt="txt", compress=False, workers=None):
+        """
+        Write the ASCII art of images to files, converting and writing them on a
+        worker pool.
+
+        Each image is written to a file named after its alias, see
+        export_filenames(). Images whose settings, source content, format and
+        compression are the same as when they were last exported to the directory
+        are skipped, so exporting all images again only writes the ones that
+        changed.
+
+        Args:
+            names (list[str]): The aliases to export, or ["all"] for every image.
+            directory (str): Where to write the files, created if it does not exist.
+            fmt (str, optional): txt, html or ansi, see EXPORT_FORMATS. txt has no
+                colors, ansi keeps the color escapes and html turns them into
+                colored spans. Defaults to txt.
+            compress (bool, optional): Compress the files with gzip. Defaults to False.
+            workers (int, optional): The number of workers. Defaults to None.
+
+        Returns:
+            tuple: The names that were exported and the names that were skipped.
+        """
+        if fmt not in EXPORT_FORMATS:
+            self.error(f"Unknown export format: {fmt}")
+            return [], []
+        if names == ["all"] and "all" not in self.images:
+            names = list(self.images)
+        missing = [name for name in names if name not in self.images]
+        for name in missing:
+            self.error(f"Image with alias '{name}' does not exist.")
+        names = [name for name in names if name in self.images]
+        if not names:
+            self.error("No images to export.")
+            return [], []
+
+        os.makedirs(directory, exist_ok=True)
+        manifest_path = os.path.join(directory, EXPORT_MANIFEST)
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
+
+        start = time.perf_counter()
+        filenames = self.export_filenames(fmt, compress)
+        jobs = {}
+        skipped = []
+        for name in names:
+            image = self.images[name]
+            filename = filenames[name]
+            fingerprint = json.dumps(list(image.render_key()) + [fmt, compress])
+            exports = manifest.get(name)
+            if (
+                isinstance(exports, dict)
+                and exports.get(filename) == fingerprint
+                and os.path.exists(os.path.join(directory, filename))
+            ):
+                skipped.append(name)
+            else:
+                jobs[name] = (filename, fingerprint)
+
+        exported = list(jobs)
+        written = 0
+        if jobs:
+            images = [self.images[name] for name in exported]
+            converted = self.convert_batch(images, workers)
+            with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                sizes = executor.map(
+                    lambda job: export_file(*job),
+                    [
+                        (
+                            os.path.join(directory, jobs[name][0]),
+                            ascii,
+                            fmt,
+                            compress,
+                            name,
+                        )
+                        for name, ascii in zip(exported, converted)
+                    ],
+                )
+                written = sum(sizes)
+            for name, (filename, fingerprint) in jobs.items():
+                exports = manifest.get(name)
+                if not isinstance(exports, dict):
+                    exports = manifest[name] = {}
+                exports[filename] = fingerprint
+            DecodeCache.write_atomically(manifest_path, json.dumps(manifest).encode())
+
+        elapsed = time.perf_counter() - start
+        self.log(
+            f"Exported {len(exported)} images ({written} bytes) to {directory} in "
+            f"{elapsed:.2f} s, {len(skipped)} unchanged images skipped."
+        )
+        return exported, skipped
+
+    def export_filenames(self, fmt, compress=False):
+        """
+        Return the file name every image in the studio is exported to, made from its
+        whole alias so that e.g. d1/a.jpg and d2/a.jpg do not overwrite each other.
+
+        Characters that are not safe in a file name become _, and an alias whose
+        name is taken, also on a filesystem that ignores case, gets a suffix like
+        _2. The names are given in the order of the studio, so they stay the same
+        between exports.
+
+        Args:
+            fmt (str): txt, html or ansi, see EXPORT_FORMATS.
+            compress (bool, optional): The files are compressed with gzip.
+                Defaults to False.
+
+        Returns:
+            dict: The file name of each alias.
+        """
+        extension = EXPORT_FORMATS[fmt] + (".gz" if compress else "")
+        filenames = {}
+        taken = set()
+        for name in self.images:
+            base = re.sub(r"[^\w.-]+", "_", name).strip("_") or "image"
+            filename = base + extension
+            count = 2
+            while filename.lower() in taken:
+                filename = f"{base}_{count}{extension}"
+                count += 1
+            taken.add(filename.lower())
+            filenames[name] = filename
+        return filenames
+
+    def convert_batch(self, images, workers=None, use_processes=False):
+        """
+        Convert several images to ASCII art on a worker pool, using the render cache.
+
+        Args:
+            images (list[ASCIIImage]): The images to convert.
+            workers (int, optional): The number of workers. Defaults to None.
+            use_processes (bool, optional): Use processes instead of threads.
+                Defaults to False.
+
+        Returns:
+            list[list[str]]: The ASCII art of each image, in the same order.
+        """
+        keys = [image.render_key() for image in images]
+        results = {}
+        missing = {}
+        for key, image in zip(keys, images):
+            if key in results or key in missing:
+                continue
+            ascii = self.render_cache.get(key)
+            if ascii is None:
+                missing[key] = image
+            else:
+                results[key] = ascii
+
+        if missing:
+            executor_class = (
+                futures.ProcessPoolExecutor
+                if use_processes
+                else futures.ThreadPoolExecutor
+            )
+            with executor_class(max_workers=workers) as executor:
+                converted = executor.map(convert_image, missing.values())
+                for key, ascii in zip(missing, converted):
+                    self.render_cache.put(key, ascii)
+                    results[key] = ascii
+
+        return [results[key] for key in keys]
+
+    def save_session(self, pickle_name, include_ascii=False):
         """
         Save the current session to a file.
 
+        Only the file name and content hash of each image are saved together with its
+        settings, not the decoded image, so the file stays small.
+
         Args:
             pickle_name (str): The name of the file to save the session to.
+            include_ascii (bool, optional): Also save the last rendered ASCII art of
+                each image. Defaults to False.
         """
+        current = None
+        records = []
+        for key, image in self.images.items():
+            if image is self.current_image:
+                current = key
+            records.append(image.to_record(key, include_ascii))
+        session = {"current": current, "images": records}
+
+        payload = zlib.compress(json.dumps(session, separators=(",", ":")).encode())
         with open(pickle_name, "wb") as f:
-            pickle.dump(self, f)
-        print(f"Session saved as {pickle_name}")
+            f.write(SESSION_MAGIC + struct.pack(">H", SESSION_VERSION) + payload)
+        self.log(f"Session saved as {pickle_name}")
 
     def load_session(self, filename):
         """
         Load a session from a file.
 
+        The images are not decoded until they are rendered. Sessions saved as a
+        pickle by older versions can still be loaded.
+
         Args:
             filename (str): The name of the file to load the session from.
         """
         with open(filename, "rb") as f:
-            studio = pickle.load(f)
-        self.__dict__.update(studio.__dict__)
+            data = f.read()
+
+        if not data.startswith(SESSION_MAGIC):
+            studio = pickle.loads(data)
+            self.__dict__.update(studio.__dict__)
+            self.log(f"Session loaded from {filename}")
+            return
+
+        header_size = len(SESSION_MAGIC) + 2
+        (version,) = struct.unpack(">H", data[len(SESSION_MAGIC) : header_size])
+        if version > SESSION_VERSION:
+            raise ValueError(
+                f"{filename} was saved by a newer version (session version {version})"
+            )
+        session = json.loads(zlib.decompress(data[header_size:]))
+
+        self.images = {}
+        for record in session["images"]:
+            image = ASCIIImage.from_record(record)
+            image.decode_cache = self.decode_cache
+            self.images[record["key"]] = image
+            if image.ascii:
+                self.render_cache.put(image.render_key(), image.ascii)
+        self.current_image = self.images.get(session["current"])
 
-        print(f"Session loaded from {filename}")
+        self.log(f"Session loaded from {filename}")
 
 
 class ASCIIImage:
     """
     A class to represent an ASCII image, including its original image,
     ASCII conversion, and properties like size, or brightness, and contrast.
+
+    An image is a small record of render settings. The decoded image and its
+    pyramid are kept in SOURCE_STORE by the content hash of the file, so every
+    alias of the same file shares one decoded image.
     """
 
-    def __init__(self, filename, target_width=50, target_height=None, alias=None):
+    __slots__ = (
+        "filename",
+        "alias",
+        "target_width",
+        "target_height",
+        "charset",
+        "brightness",
+        "contrast",
+        "color",
+        "mode",
+        "workers",
+        "band_height",
+        "decode_cache",
+        "source_size",
+        "source_hash",
+        "source_checked",
+        "source",
+        "frame",
+        "frame_source",
+        "color_frame",
+        "color_report",
+        "stats",
+        "ascii",
+        "_finalizer",
+        "__weakref__",
+    )
+
+    def __init__(
+        self,
+        filename,
+        target_width=50,
+        target_height=None,
+        alias=None,
+        decode_cache=None,
+    ):
         """
         Initialize an ASCII image with a file, target dimensions, and optional alias.
 
@@ -207,47 +1041,397 @@ class ASCIIImage:
             target_height (int, optional): The target height for the ASCII conversion.
                 If None, calculated based on aspect ratio. Defaults to None.
             alias (str, optional): An alias to refer to the image. Defaults to None.
+            decode_cache (DecodeCache, optional): Where decoded images are kept between
+                sessions. If None, the image is always decoded. Defaults to None.
         """
         self.filename = filename
         self.alias = alias
         self.target_width = target_width
         self.target_height = target_height
-        self.image = self.load_image()
-        self.ascii = self.convert_to_ascii()
-
+        self.charset = ASCII_CHARS
         self.brightness = 1.0
         self.contrast = 1.0
+        self.workers = 1
+        self.band_height = BAND_HEIGHT
+        self.decode_cache = decode_cache
+        # only the header is read here, the pixels are decoded on the first render
+        self.source_size = self.read_size()
+        self.frame = None
+        self.frame_source = None
+        self.color = None
+        self.color_frame = None
+        self.color_report = None
+        self.mode = "plain"
+        self.source_hash = self.file_hash()
+        self.source_checked = True
+        self.attach_source()
+        self.stats = RenderStats(alias or filename)
+        self.ascii = []
+        self.target_size()
+
+    def __getstate__(self):
+        """
+        Leave the image pyramid and frames out when pickling, they are rebuilt when
+        needed. The decoded image is kept, so worker processes do not decode it again.
+        """
+        state = {
+            name: getattr(self, name)
+            for name in self.__slots__
+            if name not in ("source", "_finalizer", "__weakref__")
+        }
+        state["_image"] = self._image
+        state["frame"] = None
+        state["frame_source"] = None
+        state["color_frame"] = None
+        return state
+
+    def __setstate__(self, state):
+        """Restore a pickled image, including ones saved before images were decoded lazily."""
+        state = dict(state)
+        image = state.pop("image", None)
+        image = state.pop("_image", image)
+        defaults = {
+            "charset": ASCII_CHARS,
+            "workers": 1,
+            "band_height": BAND_HEIGHT,
+            "source_checked": True,
+            "decode_cache": None,
+            "color": None,
+            "color_frame": None,
+            "color_report": None,
+            "mode": "plain",
+            "frame": None,
+            "frame_source": None,
+            "ascii": [],
+        }
+        for name, value in {**defaults, **state}.items():
+            # older pickles also hold the pyramid, which is rebuilt when needed
+            if name in self.__slots__:
+                setattr(self, name, value)
+        if "stats" not in state:
+            self.stats = RenderStats(self.alias or self.filename)
+        if "source_hash" not in state:
+            if image is None:
+                self.source_hash = self.file_hash()
+                self.source_size = self.read_size()
+            else:
+                # images pickled before they were decoded lazily have the brightness
+                # and contrast applied to them already, so they are kept apart from
+                # the decoded file by a hash of their own pixels, and the factors are
+                # not applied a second time
+                self.source_hash = (
+                    "pickle-" + hashlib.sha256(image.tobytes()).hexdigest()
+                )
+                self.source_size = image.size
+                self.brightness = 1.0
+                self.contrast = 1.0
+        self.attach_source()
+        if self._image is None:
+            self._image = image
+
+    def to_record(self, key, include_ascii=False):
+        """
+        Return the settings of the image as a dictionary for a session file.
+
+        Args:
+            key (str): The name the image has in the studio.
+            include_ascii (bool, optional): Also include the last rendered ASCII art.
+                Defaults to False.
+        """
+        return {
+            "key": key,
+            "filename": self.filename,
+            "alias": self.alias,
+            "source_hash": self.source_hash,
+            "source_size": list(self.source_size),
+            "target_width": self.target_width,
+            "target_height": self.target_height,
+            "brightness": self.brightness,
+            "contrast": self.contrast,
+            "charset": self.charset,
+            "color": self.color,
+            "mode": self.mode,
+            "workers": self.workers,
+            "band_height": self.band_height,
+            "ascii": self.ascii if include_ascii else [],
+        }
+
+    @classmethod
+    def from_record(cls, record):
+        """
+        Create an image from a session file record without opening the image file.
+
+        The file is checked against its content hash when it is first decoded.
 
-    def load_image(self):
-        """Load the image from the file so that we can convert it to grayscale."""
+        Args:
+            record (dict): A record made by to_record().
+        """
+        image = cls.__new__(cls)
+        image.filename = record["filename"]
+        image.alias = record["alias"]
+        image.target_width = record["target_width"]
+        image.target_height = record["target_height"]
+        image.charset = record["charset"]
+        image.brightness = record["brightness"]
+        image.contrast = record["contrast"]
+        image.workers = record["workers"]
+        image.band_height = record["band_height"]
+        image.source_size = tuple(record["source_size"])
+        image.frame = None
+        image.frame_source = None
+        image.color = record.get("color")
+        image.color_frame = None
+        image.color_report = None
+        image.mode = record.get("mode", "plain")
+        image.source_hash = record["source_hash"]
+        image.source_checked = False
+        image.attach_source()
+        image.decode_cache = None
+        image.stats = RenderStats(image.alias or image.filename)
+        image.ascii = record["ascii"]
+        return image
+
+    def attach_source(self):
+        """
+        Share the decoded image of every image with the same content hash. The
+        reference is released when this image is garbage collected.
+        """
+        self.source = SOURCE_STORE.acquire(self.source_hash)
+        self._finalizer = weakref.finalize(self, SOURCE_STORE.release, self.source)
+        self._finalizer.atexit = False
+
+    def detach_source(self):
+        """Release the shared decoded image, e.g. before the content hash changes."""
+        self._finalizer()
+        self.source = None
+
+    def check_source(self):
+        """
+        Check that the image file still has the content it had when it was saved, and
+        say so on stderr if it has not, as it is checked while rendering.
+        """
+        self.source_checked = True
+        source_hash = self.file_hash()
+        if source_hash != self.source_hash:
+            print(
+                f"Image file {self.filename} has changed since the session was saved.",
+                file=sys.stderr,
+            )
+            self.detach_source()
+            self.source_hash = source_hash
+            self.source_size = self.read_size()
+            self.attach_source()
+
+    @property
+    def _image(self):
+        """The decoded grayscale image shared by every image of the same file, or None."""
+        return self.source.image
+
+    @_image.setter
+    def _image(self, image):
+        self.source.image = image
+
+    @property
+    def pyramid(self):
+        """The image pyramid shared by every image of the same file, or None."""
+        return self.source.pyramid
+
+    @pyramid.setter
+    def pyramid(self, pyramid):
+        self.source.pyramid = pyramid
+
+    @property
+    def image(self):
+        """The grayscale image, decoded the first time it is needed."""
+        if self._image is None:
+            self._image = self.load_image(self.target_size())
+        return self._image
+
+    def open_image(self):
+        """Open the image file without decoding it, printing help to stderr if it cannot be opened."""
         try:
-            with PILImage.open(self.filename) as im:
-                return im.convert("L")
+            return PILImage.open(self.filename)
         except FileNotFoundError as e:
-            print(f"Image file {self.filename} not found.")
+            print(f"Image file {self.filename} not found.", file=sys.stderr)
             files = [f for f in os.listdir(".") if os.path.isfile(f)]
-            print("These are the files in your directory:")
+            print("These are the files in your directory:", file=sys.stderr)
             formatted_file_names = ", ".join(files)
-            print(f"{formatted_file_names}")
+            print(f"{formatted_file_names}", file=sys.stderr)
             raise e
         except Exception as e:
             print(
-                f"Failed to load image {self.filename}: {e}. Ensure it was a .JPG or .PNG files."
+                f"Failed to load image {self.filename}: {e}. Ensure it was a .JPG or .PNG files.",
+                file=sys.stderr,
             )
             raise e
 
+    def read_size(self):
+        """Return the size of the image file, read from its header."""
+        with self.open_image() as im:
+            return im.size
+
+    def iter_frames(self):
+        """
+        Decode every frame of the image file and convert it to ASCII art.
+
+        Yields:
+            tuple: The rows of the ASCII art and the duration of the frame in
+                seconds, or None if the file does not say.
+        """
+        size = self.target_size()
+        with self.open_image() as im:
+            for frame in ImageSequence.Iterator(im):
+                duration = frame.info.get("duration")
+                resized_image = frame.convert("L").resize(size)
+                adjustment = ImageAdjustment(resized_image)
+                adjustment.apply_enhancement(ImageEnhance.Brightness, self.brightness)
+                tone = adjustment.apply_enhancement(
+                    ImageEnhance.Contrast, self.contrast
+                )
+                converter = ASCIIConverter(self.charset, tone, self.mode)
+                ascii = converter.convert(resized_image)
+                yield ascii, duration / 1000 if duration else None
+
+    def load_image(self, size=None):
+        """
+        Load the image from the file so that we can convert it to grayscale.
+
+        JPEG files are decoded at the smallest scale (1/1, 1/2, 1/4 or 1/8) that is
+        still at least the given size, which is much faster than decoding every pixel.
+        If the image was decoded at that scale before, it is mapped from the decode
+        cache instead.
+
+        Args:
+            size (tuple, optional): The (width, height) the image will be resized to.
+                If None, the full image is decoded. Defaults to None.
+        """
+        if not self.source_checked:
+            self.check_source()
+        with self.open_image() as im:
+            if size is not None:
+                im.draft("L", size)
+            if self.decode_cache is not None:
+                start = time.perf_counter()
+                image = self.decode_cache.get(self.source_hash, im.size)
+                if image is not None:
+                    seconds = time.perf_counter() - start
+                    self.stats.record("decode", seconds, im.width * im.height)
+                    return image
+            with self.stats.timed("decode", im.width * im.height):
+                im.load()
+            with self.stats.timed("grayscale", im.width * im.height):
+                image = im.convert("L")
+        if self.decode_cache is not None:
+            self.decode_cache.put(self.source_hash, image)
+        return image
+
+    def decode_for(self, size):
+        """
+        Decode the image again at a larger scale if it is smaller than the given size.
+
+        Args:
+            size (tuple): The (width, height) the image will be resized to.
+        """
+        # the decoded image is shared, so a larger decode is used by every alias
+        with self.source.lock:
+            if self._image is None:
+                self._image = self.load_image(size)
+            elif self._image.size != self.source_size and (
+                self._image.width < size[0] or self._image.height < size[1]
+            ):
+                self._image = self.load_image(size)
+                self.pyramid = None
+
+    def file_hash(self):
+        """
+        Return the SHA-256 digest of the image file, from the decode cache if the file
+        has not changed since it was last hashed.
+        """
+        if self.decode_cache is not None:
+            return self.decode_cache.file_hash(self.filename)
+        return self.hash_file()
+
+    def hash_file(self):
+        """Return the SHA-256 digest of the image file, used to identify its content."""
+        digest = hashlib.sha256()
+        with open(self.filename, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def render_key(self):
+        """Return the settings that decide the rendered ASCII art, used as a cache key."""
+        return (
+            self.source_hash,
+            self.target_width,
+            self.target_height,
+            self.brightness,
+            self.contrast,
+            self.charset,
+            self.color,
+            self.mode,
+        )
+
     def convert_to_ascii(self):
         """Convert the loaded image to ASCII art based on current settings."""
-        if not self.image:
-            return []
-        out = []
-        replacement_chars = " .:-=+*#%@"[::-1]
-        num_chars = len(replacement_chars)
+        resized_image = self.resized_frame()
+        converter = self.converter()
+        with self.stats.timed("map", resized_image.width * resized_image.height):
+            ascii = converter.convert(resized_image, self.workers, self.band_height)
+        if self.color:
+            ascii = self.colorize(ascii)
+        self.stats.update_peak_rss()
+        return ascii
+
+    def colorize(self, ascii):
+        """
+        Color every character of converted ASCII art like the pixel it stands for.
+
+        Args:
+            ascii (list[str]): The rows from the grayscale frame.
 
+        Returns:
+            list[str]: The rows with ANSI color escapes.
+        """
+        frame = self.resized_color_frame()
+        tone = self.tone_table()
+        encoder = ColorEncoder(self.color)
+        with self.stats.timed("map", frame.width * frame.height):
+            # the brightness and contrast tables work on each channel the same way
+            # ImageEnhance works on color images
+            colors = encoder.quantize(frame.point(tone * 3))
+            rows = encoder.encode(ascii, colors)
+        self.color_report = (encoder.written, encoder.naive)
+        return rows
+
+    def resized_color_frame(self):
+        """
+        Return the image in color, resized to the target size. It is decoded from the
+        file again, the decoded grayscale image has no color, and kept until the
+        target size changes.
+
+        Returns:
+            PIL.Image.Image: The resized frame in "RGB" mode.
+        """
+        size = self.target_size()
+        if self.color_frame is None or self.color_frame.size != size:
+            with self.open_image() as im:
+                with self.stats.timed("decode", im.width * im.height):
+                    im.draft("RGB", size)
+                    im = im.convert("RGB")
+                with self.stats.timed("resize", size[0] * size[1]):
+                    self.color_frame = im.resize(size)
+        return self.color_frame
+
+    def target_size(self):
+        """
+        Return the (width, height) of the ASCII art, working out a missing one from
+        the aspect ratio of the image.
+        """
         # Correction factor to account for the narrow width of characters
         correction_factor = 0.6
 
-        width, height = self.image.size
+        width, height = self.source_size
         aspect_ratio = height / width
 
         if self.target_height is None:
@@ -258,28 +1442,104 @@ class ASCIIImage:
         elif self.target_width is None:
             self.target_width = round(self.target_height / aspect_ratio)
 
-        resized_image = self.image.resize(
-            (int(self.target_width), int(self.target_height))
-        )
+        return (int(self.target_width), int(self.target_height))
+
+    def resized_frame(self):
+        """
+        Return the image resized to the target size, without brightness and contrast.
 
-        print("Size of image:", resized_image.size)
+        The frame is kept until the target size changes or the image is decoded
+        again, so changing only the brightness or contrast does not resize again.
 
-        for y in range(self.target_height):
-            line = "".join(
-                replacement_chars[
-                    min(
-                        int(resized_image.getpixel((x, y)) / 255 * num_chars),
-                        num_chars - 1,
-                    )
-                ]
-                for x in range(self.target_width)
-            )
+        Returns:
+            PIL.Image.Image: The resized frame in "L" mode.
+        """
+        size = self.target_size()
+        self.decode_for(size)
+        if (
+            self.frame is None
+            or self.frame.size != size
+            or self.frame_source is not self._image
+        ):
+            with self.stats.timed("resize", size[0] * size[1]):
+                self.frame = self.pyramid_level(size).resize(size)
+            self.frame_source = self._image
+        return self.frame
+
+    def tone_table(self):
+        """
+        Return the brightness and contrast of the image as one 256-entry table from
+        the pixel values of the resized frame to the adjusted values.
+        """
+        resized_image = self.resized_frame()
+        with self.stats.timed("enhance", resized_image.width * resized_image.height):
+            adjustment = ImageAdjustment(resized_image)
+            adjustment.apply_enhancement(ImageEnhance.Brightness, self.brightness)
+            return adjustment.apply_enhancement(ImageEnhance.Contrast, self.contrast)
+
+    def converter(self):
+        """Return a converter with the brightness and contrast built into its table."""
+        return ASCIIConverter(self.charset, self.tone_table(), self.mode)
+
+    def render_frame(self):
+        """
+        Resize the image to the target size and apply the brightness and contrast.
+
+        The adjustments are applied to the small resized frame, not to the loaded
+        image, so the loaded image is never changed and repeated settings do not
+        add up on each other.
+
+        Returns:
+            PIL.Image.Image: The adjusted frame in "L" mode.
+        """
+        return self.resized_frame().point(self.tone_table())
 
-            # line = line + "|" used for debgunggig the actual width of the ascii render
+    def pyramid_level(self, size):
+        """
+        Return the smallest level of the image pyramid that is at least the given size.
+
+        The pyramid holds the loaded image halved again and again. Levels are built
+        the first time a size needs them and kept, so changing the width only
+        resizes from a level close to the new size instead of the full image.
 
-            out.append(line)
+        Args:
+            size (tuple): The (width, height) the level will be resized to.
 
-        return out
+        Returns:
+            PIL.Image.Image: A level in "L" mode, the loaded image itself if no
+                smaller level is large enough.
+        """
+        # aliases of the same file can render on different threads
+        with self.source.lock:
+            if not self.pyramid:
+                self.pyramid = [self.image]
+
+            index = 0
+            while True:
+                if index + 1 == len(self.pyramid):
+                    level = self.pyramid[index]
+                    # reduce(2) rounds the size up
+                    next_size = ((level.width + 1) // 2, (level.height + 1) // 2)
+                    if (
+                        next_size[0] < max(size[0], PYRAMID_MIN_SIZE)
+                        or next_size[1] < max(size[1], PYRAMID_MIN_SIZE)
+                        or len(self.pyramid) == PYRAMID_MAX_LEVELS
+                    ):
+                        return level
+                    self.pyramid.append(level.reduce(2))
+
+                next_level = self.pyramid[index + 1]
+                if next_level.width < size[0] or next_level.height < size[1]:
+                    return self.pyramid[index]
+                index += 1
+
+    def pyramid_bytes(self):
+        """Return the memory used by the smaller pyramid levels, in bytes."""
+        return self.source.pyramid_bytes()
+
+    def frame_bytes(self):
+        """Return the memory used by the frames kept by this image only, in bytes."""
+        return image_bytes(self.frame) + image_bytes(self.color_frame)
 
     def set_width(self, new_width):
         """
@@ -288,7 +1548,7 @@ class ASCIIImage:
         Args:
             new_width (int): The new target width.
         """
-        width, height = self.image.size
+        width, height = self.source_size
         aspect_ratio = height / width
         correction_factor = 0.6
 
@@ -302,7 +1562,7 @@ class ASCIIImage:
         Args:
             new_height (int): The new target height.
         """
-        width, height = self.image.size
+        width, height = self.source_size
         aspect_ratio = height / width
         correction_factor = 0.6
 
@@ -311,58 +1571,1725 @@ class ASCIIImage:
 
     def set_brightness(self, new_brightness_level):
         """
-        Set a new brightness level for the image.
+        Set a new brightness level for the image. It is applied when the image is rendered.
 
         Args:
             new_brightness_level (float): The new brightness level. Must be a positive number.
         """
-        enhancer = ImageEnhance.Brightness(self.image)
-        self.image = enhancer.enhance(new_brightness_level)
         self.brightness = new_brightness_level
 
     def set_contrast(self, new_contrast_level):
         """
-        Set a new contrast level for the image.
+        Set a new contrast level for the image. It is applied when the image is rendered.
 
         Args:
             new_contrast_level (float): The new contrast level. Must be a positive number.
         """
-        enhancer = ImageEnhance.Contrast(self.image)
-        self.image = enhancer.enhance(new_contrast_level)
         self.contrast = new_contrast_level
 
+    def set_charset(self, new_charset):
+        """
+        Set the characters the image is drawn with.
+
+        Args:
+            new_charset (str): The name of a ramp in CHARSETS, or the characters to
+                use from the darkest to the lightest pixel.
+
+        Raises:
+            ValueError: If the charset is empty or has more than 256 characters.
+        """
+        self.charset = resolve_charset(new_charset)
+
+    def set_color(self, new_color):
+        """
+        Set whether the image is drawn in color, and with which terminal colors.
+
+        Args:
+            new_color (str): One of COLOR_MODES, or off.
+
+        Raises:
+            ValueError: If the color mode is unknown.
+        """
+        if new_color == "off":
+            new_color = None
+        elif new_color not in COLOR_MODES:
+            raise ValueError(f"Unknown color mode: {new_color}")
+        self.color = new_color
+        self.color_report = None
+
+    def set_mode(self, new_mode):
+        """
+        Set how the pixels of the image are turned into characters.
+
+        Args:
+            new_mode (str): One of RENDER_MODES.
+
+        Raises:
+            ValueError: If the render mode is unknown.
+        """
+        if new_mode not in RENDER_MODES:
+            raise ValueError(f"Unknown render mode: {new_mode}")
+        self.mode = new_mode
+
     def __str__(self):
         """Return a string representation of the ASCII image, including its properties."""
         return (
             f"Filename: {self.filename}\n"
             f"Alias: {self.alias}\n"
-            f"Original Size: {self.image.size}\n"
+            f"Original Size: {self.source_size}\n"
             f"Brightness: {self.brightness}\n"
             f"Contrast: {self.contrast}\n"
+            f"Charset: {self.charset}\n"
+            f"Color: {self.color or 'off'}\n"
+            f"Mode: {self.mode}\n"
             f"Filename: {self.filename}\n"
             f"Target Width: {self.target_width}\n"
             f"Target Height: {self.target_height}\n"
         )
 
-    def render(self):
-        """Print the ASCII art of the image."""
-        self.ascii = self.convert_to_ascii()
-        print("\n".join(self.ascii))
+    def iter_ascii(self):
+        """
+        Convert the image to ASCII art one row at a time.
+
+        Yields:
+            str: The rows of the ASCII art, from top to bottom.
+        """
+        if self.color:
+            # colors are coalesced across a whole row, so color art is not streamed
+            yield from self.convert_to_ascii()
+            return
+        resized_image = self.resized_frame()
+        lines = self.converter().iter_lines(
+            resized_image, self.workers, self.band_height
+        )
+        # the rows are mapped while they are written, so only the time spent
+        # producing them counts as mapping
+        seconds = 0.0
+        while True:
+            start = time.perf_counter()
+            line = next(lines, None)
+            seconds += time.perf_counter() - start
+            if line is None:
+                break
+            yield line
+        self.stats.record("map", seconds, resized_image.width * resized_image.height)
+
+    def render(self, ascii=None, stream=None, keep=True, show_size=True):
+        """
+        Print the ASCII art of the image.
+
+        Rows are written as soon as they are converted, so the first rows show up
+        before the whole image is done and the full text is never built in memory.
+
+        Args:
+            ascii (list[str], optional): Already converted ASCII art, e.g. from the
+                render cache. If None, the image is converted while it is written.
+                Defaults to None.
+            stream (file, optional): Where to write the ASCII art. Defaults to stdout.
+            keep (bool, optional): Keep the rows in self.ascii. Defaults to True.
+            show_size (bool, optional): Print the size of the ASCII art before it.
+                Defaults to True.
+        """
+        if show_size:
+            print("Size of image:", (self.target_width, self.target_height))
+        if ascii is not None:
+            seconds = write_lines(ascii, stream)
+            self.ascii = ascii
+        else:
+            kept = [] if keep else None
+            seconds = write_lines(self.iter_ascii(), stream, kept)
+            self.ascii = kept if keep else []
+        self.stats.record("write", seconds)
+        self.stats.update_peak_rss()
+
+
+def resolve_charset(charset):
+    """
+    Return the characters of a named ramp in CHARSETS, or the given characters.
+
+    Args:
+        charset (str): The name of a ramp, or the characters to use from the darkest
+            to the lightest pixel.
+
+    Raises:
+        ValueError: If the characters are empty or more than 256, which the lookup
+            tables cannot tell apart.
+    """
+    chars = CHARSETS.get(charset, charset)
+    if not chars or len(chars) > 256:
+        raise ValueError(f"A charset needs 1 to 256 characters, not {len(chars)}.")
+    return chars
+
+
+def image_bytes(image):
+    """
+    Return the memory used by the pixels of an image, in bytes.
+
+    Args:
+        image (PIL.Image.Image): The image, or None.
+    """
+    if image is None:
+        return 0
+    return image.width * image.height * len(image.getbands())
+
+
+def write_lines(lines, stream=None, kept=None, chunk_rows=WRITE_CHUNK_ROWS):
+    """
+    Write lines of ASCII art to a stream in chunks of rows.
+
+    Args:
+        lines (iterable[str]): The rows to write.
+        stream (file, optional): Where to write them. Defaults to stdout.
+        kept (list, optional): If given, every row is also appended to it.
+        chunk_rows (int, optional): The number of rows in each write.
+            Defaults to WRITE_CHUNK_ROWS.
+
+    Returns:
+        float: The seconds spent writing, not counting producing the rows.
+    """
+    stream = stream or sys.stdout
+    seconds = 0.0
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if kept is not None:
+            kept.append(line)
+        if len(chunk) == chunk_rows:
+            start = time.perf_counter()
+            stream.write("\n".join(chunk) + "\n")
+            seconds += time.perf_counter() - start
+            chunk = []
+    if chunk:
+        start = time.perf_counter()
+        stream.write("\n".join(chunk) + "\n")
+        seconds += time.perf_counter() - start
+    return seconds
+
+
+def add_profile_hook(hook):
+    """
+    Subscribe to the stages of every render, e.g. to feed an external profiler.
+
+    Args:
+        hook (callable): Called as hook(name, stage, seconds, size) after each stage,
+            where name is the alias or file name of the image and size is the number
+            of pixels the stage worked on (0 if it does not apply).
+    """
+    PROFILE_HOOKS.append(hook)
+
+
+def remove_profile_hook(hook):
+    """Unsubscribe a hook added with add_profile_hook()."""
+    PROFILE_HOOKS.remove(hook)
+
+
+class RenderStats:
+    """
+    A class to collect how long each stage of rendering an image takes, and how much
+    memory it used at most.
+    """
+
+    STAGES = ("decode", "grayscale", "enhance", "resize", "map", "write")
+
+    def __init__(self, name):
+        """
+        Initialize empty stats.
+
+        Args:
+            name (str): The alias or file name of the image, passed to the hooks.
+        """
+        self.name = name
+        self.counts = dict.fromkeys(self.STAGES, 0)
+        self.totals = dict.fromkeys(self.STAGES, 0.0)
+        self.slowest = dict.fromkeys(self.STAGES, 0.0)
+        self.peak_pixels = 0
+        self.peak_rss_kb = 0
+
+    @contextmanager
+    def timed(self, stage, size=0):
+        """
+        Time the code inside a with block as one run of a stage.
+
+        Args:
+            stage (str): One of STAGES.
+            size (int, optional): The number of pixels the stage works on.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start, size)
+
+    def record(self, stage, seconds, size=0):
+        """
+        Add one run of a stage and tell the profile hooks about it.
+
+        Args:
+            stage (str): One of STAGES.
+            seconds (float): How long the stage took.
+            size (int, optional): The number of pixels the stage worked on.
+        """
+        self.counts[stage] += 1
+        self.totals[stage] += seconds
+        self.slowest[stage] = max(self.slowest[stage], seconds)
+        self.peak_pixels = max(self.peak_pixels, size)
+        for hook in PROFILE_HOOKS:
+            hook(self.name, stage, seconds, size)
+
+    def update_peak_rss(self):
+        """Store the peak memory of the process so far, where the platform reports it."""
+        if resource is None:
+            return
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == "darwin":
+            # macOS reports bytes, Linux reports kilobytes
+            peak //= 1024
+        self.peak_rss_kb = max(self.peak_rss_kb, peak)
+
+    def summary(self):
+        """Return the total render time and peak memory on one line."""
+        total = sum(self.totals.values()) * 1000
+        return (
+            f"Render stats of {self.name}: {total:.2f} ms in "
+            f"{sum(self.counts.values())} stages, peak memory {self.peak_rss_kb} KB"
+        )
+
+    def __str__(self):
+        """Return a table of the count, total and slowest time of every stage."""
+        lines = [f"{self.name}:"]
+        for stage in self.STAGES:
+            count = self.counts[stage]
+            total = self.totals[stage] * 1000
+            average = total / count if count else 0.0
+            slowest = self.slowest[stage] * 1000
+            lines.append(
+                f"  {stage:<10} {count:>5} runs {total:>10.2f} ms total "
+                f"{average:>8.2f} ms avg {slowest:>8.2f} ms max"
+            )
+        lines.append(
+            f"  largest buffer: {self.peak_pixels} pixels, "
+            f"peak process memory: {self.peak_rss_kb} KB"
+        )
+        return "\n".join(lines)
+
+
+def convert_image(image):
+    """Convert an image to ASCII art, used by the worker pools of render_batch."""
+    return image.convert_to_ascii()
+
+
+def ingest_image(filename, decode_cache=None):
+    """
+    Load and decode an image file for a worker pool, raising instead of printing if
+    it cannot be loaded.
+
+    Args:
+        filename (str): The path to the image file.
+        decode_cache (DecodeCache, optional): Where decoded images are kept.
+
+    Returns:
+        ASCIIImage: The image, decoded for its default size.
+    """
+    # open it here first, so that a broken file raises without the help printed by
+    # ASCIIImage.open_image()
+    with PILImage.open(filename):
+        pass
+    image = ASCIIImage(filename, decode_cache=decode_cache)
+    image.decode_for(image.target_size())
+    return image
+
+
+def export_file(path, ascii, fmt="txt", compress=False, title=""):
+    """
+    Write ASCII art to a file in one of EXPORT_FORMATS, through a large buffer and
+    optionally gzip, replacing the file only once it is complete.
+
+    Args:
+        path (str): The file to write.
+        ascii (list[str]): The rows of the ASCII art, with or without color escapes.
+        fmt (str, optional): txt, html or ansi. Defaults to txt.
+        compress (bool, optional): Compress the file with gzip. Defaults to False.
+        title (str, optional): The title of an html page.
+
+    Returns:
+        int: The number of bytes written to the file.
+    """
+    if fmt == "txt":
+        ascii = [re.sub(r"\x1b\[[0-9;]*m", "", line) for line in ascii]
+    elif fmt == "html":
+        ascii = [ansi_to_html(line) for line in ascii]
+
+    temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temporary, "wb", buffering=EXPORT_BUFFER_BYTES) as raw:
+            # mtime 0 gives the same file for the same art, whenever it is exported
+            binary = gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) if compress else raw
+            stream = io.TextIOWrapper(binary, encoding="utf-8", newline="\n")
+            if fmt == "html":
+                stream.write(
+                    '<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n'
+                    f"<title>{html.escape(title)}</title>\n</head>\n"
+                    '<body style="background: #fff">\n'
+                    '<pre style="font-family: monospace; line-height: 1">\n'
+                )
+            write_lines(ascii, stream)
+            if fmt == "html":
+                stream.write("</pre>\n</body>\n</html>\n")
+            # leave closing the file to the with block
+            stream.flush()
+            stream.detach()
+            if compress:
+                binary.close()
+    except BaseException:
+        os.remove(temporary)
+        raise
+    os.replace(temporary, path)
+    return os.path.getsize(path)
+
+
+def ansi_to_html(line):
+    """
+    Turn a row of ASCII art with the color escapes of ColorEncoder into escaped html
+    with a colored span for every run of color.
+    """
+    parts = []
+    in_span = False
+    for index, part in enumerate(re.split(r"(\x1b\[[0-9;]*m)", line)):
+        if index % 2 == 0:
+            parts.append(html.escape(part))
+            continue
+        if in_span:
+            parts.append("</span>")
+            in_span = False
+        codes = [int(code) for code in part[2:-1].split(";") if code]
+        if codes[:2] == [38, 5] and len(codes) == 3:
+            number = codes[2] - 16
+            rgb = (
+                COLOR_CUBE_LEVELS[number // 36 % 6],
+                COLOR_CUBE_LEVELS[number // 6 % 6],
+                COLOR_CUBE_LEVELS[number % 6],
+            )
+        elif codes[:2] == [38, 2] and len(codes) == 5:
+            rgb = tuple(codes[2:])
+        else:
+            continue
+        parts.append('<span style="color: #%02x%02x%02x">' % rgb)
+        in_span = True
+    if in_span:
+        parts.append("</span>")
+    return "".join(parts)
+
+
+def render_file(
+    filename,
+    width,
+    height,
+    brightness,
+    contrast,
+    charset=ASCII_CHARS,
+    color=None,
+    mode="plain",
+    decode_cache=None,
+    max_cells=None,
+):
+    """
+    Convert an image file to ASCII art with the given settings, used by the worker pool
+    of the render server.
+
+    Args:
+        filename (str): The path to the image file.
+        width (int): The target width, or None to work it out from the height.
+        height (int): The target height, or None to work it out from the width.
+        brightness (float): The brightness factor.
+        contrast (float): The contrast factor.
+        charset (str, optional): The characters to use. Defaults to ASCII_CHARS.
+        color (str, optional): One of COLOR_MODES, or None for no color.
+        mode (str, optional): One of RENDER_MODES. Defaults to plain.
+        decode_cache (DecodeCache, optional): Where decoded images are kept.
+        max_cells (int, optional): The most characters the ASCII art may have, or
+            None for no limit.
+
+    Returns:
+        list[str]: The rows of the ASCII art.
+
+    Raises:
+        ValueError: If the ASCII art would have more than max_cells characters.
+    """
+    # like ingest_image(), a broken file raises without the help of open_image()
+    with PILImage.open(filename):
+        pass
+    image = ASCIIImage(filename, width, height, decode_cache=decode_cache)
+    target_width, target_height = image.target_size()
+    if max_cells is not None and target_width * target_height > max_cells:
+        raise ValueError(
+            f"{target_width}x{target_height} is more than {max_cells} characters"
+        )
+    image.set_brightness(brightness)
+    image.set_contrast(contrast)
+    image.set_charset(charset)
+    image.set_color(color or "off")
+    image.set_mode(mode)
+    return image.convert_to_ascii()
+
+
+class AnimationPlayer:
+    """
+    A class to play the frames of an animated image as ASCII art at a target frame
+    rate. The frames are decoded and converted ahead on a background thread into a
+    bounded queue, and frames that would be shown too late are dropped.
+    """
+
+    def __init__(
+        self,
+        image,
+        fps=None,
+        loops=1,
+        stream=None,
+        queue_size=8,
+        clock=time.perf_counter,
+        sleep=time.sleep,
+    ):
+        """
+        Initialize a player for an image.
+
+        Args:
+            image (ASCIIImage): The image to play.
+            fps (float, optional): The frame rate to play at. If None, the frame
+                durations stored in the file are used, or 10 fps if there are none.
+                Defaults to None.
+            loops (int, optional): How many times to play the animation. Defaults to 1.
+            stream (file, optional): Where to draw the frames. Defaults to stdout.
+            queue_size (int, optional): How many frames may be converted ahead.
+                Defaults to 8.
+            clock (callable, optional): Returns the current time in seconds.
+            sleep (callable, optional): Waits for a number of seconds.
+        """
+        self.image = image
+        self.fps = fps
+        self.loops = loops
+        self.stream = stream
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.clock = clock
+        self.sleep = sleep
+        self.stopped = threading.Event()
+        self.shown = 0
+        self.dropped = 0
+        self.seconds = 0.0
+
+    def produce(self):
+        """Convert the frames in order and put them on the queue, then put None."""
+        try:
+            for _ in range(self.loops):
+                for frame in self.image.iter_frames():
+                    while not self.stopped.is_set():
+                        try:
+                            self.frames.put(frame, timeout=0.1)
+                            break
+                        except queue.Full:
+                            pass
+                    if self.stopped.is_set():
+                        return
+        finally:
+            self.frames.put(None)
+
+    def play(self):
+        """
+        Play the animation until its last frame.
+
+        The clock starts when the first frame is ready, and each frame has a
+        deadline, one frame interval after the previous one. When a frame is ready
+        more than one interval after its deadline, the newest frame in the queue is
+        shown instead, the older ones are dropped, and the deadlines start again from
+        now, so the animation keeps its speed when converting falls behind.
+
+        Returns:
+            dict: The report, see report().
+        """
+        stream = self.stream or sys.stdout
+        producer = threading.Thread(target=self.produce, daemon=True)
+        producer.start()
+
+        stream.write(ANSI_CLEAR)
+        start = deadline = None
+        finished = False
+        while not finished:
+            frame = self.frames.get()
+            if frame is None:
+                break
+            now = self.clock()
+            if start is None:
+                start = deadline = now
+            interval = self.interval(frame)
+
+            if now > deadline + interval:
+                while True:
+                    try:
+                        newer = self.frames.get_nowait()
+                    except queue.Empty:
+                        break
+                    if newer is None:
+                        finished = True
+                        break
+                    self.dropped += 1
+                    frame = newer
+                interval = self.interval(frame)
+                deadline = now
+            elif now < deadline:
+                self.sleep(deadline - now)
+            stream.write(ANSI_HOME + "\n".join(frame[0]) + "\n")
+            stream.flush()
+            self.shown += 1
+            deadline += interval
+
+        producer.join()
+        if start is not None:
+            self.seconds = self.clock() - start
+        return self.report()
+
+    def interval(self, frame):
+        """Return the seconds a frame is shown for, at the frame rate of the player."""
+        return 1 / self.fps if self.fps else frame[1] or 0.1
+
+    def stop(self):
+        """Stop converting frames, e.g. when the playback is interrupted."""
+        self.stopped.set()
+
+    def report(self):
+        """Return the number of frames shown and dropped, and the seconds played."""
+        return {
+            "frames": self.shown + self.dropped,
+            "shown": self.shown,
+            "dropped": self.dropped,
+            "seconds": self.seconds,
+        }
+
+
+class DeltaWriter:
+    """
+    A class to draw ASCII art at the top of the terminal and, when art is drawn
+    again, rewrite only the spans of rows that changed since the frame on the screen,
+    using ANSI cursor moves. There is one screen, so the frame it keeps is the last one
+    drawn, whichever image it came from. A redraw that changes the size of the art, or
+    that would not save much, is written in full instead.
+    """
+
+    def __init__(self, full_ratio=DELTA_FULL_RATIO):
+        """
+        Initialize a writer that has not drawn anything yet.
+
+        Args:
+            full_ratio (float, optional): Write the whole frame when the changes would
+                take at least this share of its bytes. Defaults to DELTA_FULL_RATIO.
+        """
+        self.full_ratio = full_ratio
+        self.screen = None
+        self.draws = 0
+        self.bytes_written = 0
+        self.bytes_full = 0
+
+    @staticmethod
+    def changed_spans(old, new):
+        """
+        Return the rows that differ between two frames of the same size.
+
+        Args:
+            old (list[str]): The rows that are on the screen.
+            new (list[str]): The rows to draw.
+
+        Returns:
+            list[tuple]: (row, column, text) for each changed row, where text replaces
+                the characters from column up to the last one that changed. Rows that
+                are colored on the screen or in the new frame are replaced whole.
+        """
+        spans = []
+        for row, (old_line, new_line) in enumerate(zip(old, new)):
+            if old_line == new_line:
+                continue
+            if ANSI_RESET in old_line or ANSI_RESET in new_line:
+                # columns in a colored row are not characters, so rewrite all of it,
+                # also when the row that replaces it has no color
+                spans.append((row, 0, new_line + ANSI_CLEAR_LINE))
+                continue
+            first = 0
+            while old_line[first] == new_line[first]:
+                first += 1
+            last = len(new_line)
+            while old_line[last - 1] == new_line[last - 1]:
+                last -= 1
+            spans.append((row, first, new_line[first:last]))
+        return spans
+
+    def encode(self, ascii):
+        """
+        Return the text that turns the frame on the screen into a new one.
+
+        Args:
+            ascii (list[str]): The rows to draw.
+        """
+        full = "\n".join(ascii) + "\n"
+        old = self.screen
+        self.screen = ascii
+        if (
+            old is None
+            or len(old) != len(ascii)
+            or any(
+                len(old_line) != len(line)
+                for old_line, line in zip(old, ascii)
+                if ANSI_RESET not in old_line + line
+            )
+        ):
+            return ANSI_CLEAR + ANSI_HOME + full
+
+        # terminal rows and columns are counted from 1
+        parts = [
+            f"\x1b[{row + 1};{column + 1}H{text}"
+            for row, column, text in self.changed_spans(old, ascii)
+        ]
+        parts.append(f"\x1b[{len(ascii) + 1};1H")
+        delta = "".join(parts)
+        if len(delta) >= self.full_ratio * len(full):
+            return ANSI_HOME + full
+        return delta
+
+    def write(self, ascii, stream=None):
+        """
+        Draw a frame and count the bytes against a full redraw.
+
+        Args:
+            ascii (list[str]): The rows to draw.
+            stream (file, optional): Where to draw them. Defaults to stdout.
+
+        Returns:
+            tuple: The number of bytes written and the number a full redraw takes.
+        """
+        stream = stream or sys.stdout
+        self.draws += 1
+        text = self.encode(ascii)
+        stream.write(text)
+        stream.flush()
+        written = len(text.encode())
+        full = sum(len(line.encode()) + 1 for line in ascii)
+        self.bytes_written += written
+        self.bytes_full += full
+        return written, full
+
+    def forget(self):
+        """
+        Forget the frame on the screen, so the next frame is drawn in full, e.g. after
+        the screen was cleared or something else was printed.
+        """
+        self.screen = None
+
+
+class OutputWatcher:
+    """
+    A stream that passes everything on to another one and counts what was written
+    to it, so the studio can tell whether a command printed anything.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.written = 0
+
+    def write(self, text):
+        self.written += len(text)
+        return self.stream.write(text)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class DecodeCache:
+    """
+    A class to keep decoded grayscale images on disk as raw bytes, so that loading the
+    same file again, also in a new session or process, maps the pixels from the disk
+    without copying them instead of decoding the file.
+    """
+
+    def __init__(self, directory=None, max_bytes=256 * 1024 * 1024):
+        """
+        Initialize a decode cache. The directory is created on the first write.
+
+        Args:
+            directory (str, optional): Where to keep the images. Defaults to
+                AAS_CACHE_DIR if it is set, otherwise DECODE_CACHE_DIR.
+            max_bytes (int, optional): The size of the cache before the least
+                recently used images are removed. Defaults to 256 MB.
+        """
+        self.directory = (
+            directory or os.environ.get("AAS_CACHE_DIR") or DECODE_CACHE_DIR
+        )
+        self.max_bytes = max_bytes
+        self.hashes = None
+        self.unsaved_hashes = 0
+        self.hashes_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getstate__(self):
+        """Leave out the lock, which cannot be sent to a worker process."""
+        state = self.__dict__.copy()
+        state.pop("hashes_lock", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # the index is read again from the disk, also by caches pickled in sessions
+        # of versions that kept it in another format
+        self.hashes = None
+        self.unsaved_hashes = 0
+        self.hashes_lock = threading.Lock()
+
+    def path_for(self, source_hash, size):
+        """Return the path of the raw image for a content hash and decoded size."""
+        return os.path.join(self.directory, f"{source_hash}_{size[0]}x{size[1]}.raw")
+
+    def file_hash(self, filename):
+        """
+        Return the SHA-256 digest of a file, hashing it only if its modification time
+        or size changed since it was last hashed.
+
+        The digests are kept in hashes.json by path, one entry per file, which is
+        written after HASH_INDEX_BATCH new digests and by save_hashes().
+
+        Args:
+            filename (str): The path to the file.
+        """
+        path = os.path.abspath(filename)
+        info = os.stat(path)
+        with self.hashes_lock:
+            if self.hashes is None:
+                self.hashes = self.read_hashes()
+            entry = self.hashes.get(path)
+        if entry is not None and entry[:2] == [info.st_mtime_ns, info.st_size]:
+            return entry[2]
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        with self.hashes_lock:
+            self.hashes[path] = [info.st_mtime_ns, info.st_size, digest.hexdigest()]
+            self.unsaved_hashes += 1
+            if self.unsaved_hashes >= HASH_INDEX_BATCH:
+                self.write_hashes()
+        return digest.hexdigest()
+
+    def hashes_path(self):
+        """Return the path of the index of file hashes."""
+        return os.path.join(self.directory, "hashes.json")
+
+    def read_hashes(self):
+        """
+        Read the index of file hashes, leaving out the files that were removed or
+        changed since they were hashed, and entries of older versions.
+        """
+        try:
+            with open(self.hashes_path()) as f:
+                hashes = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(hashes, dict):
+            return {}
+        kept = {}
+        for path, entry in hashes.items():
+            try:
+                info = os.stat(path)
+            except OSError:
+                continue
+            if isinstance(entry, list) and entry[:2] == [
+                info.st_mtime_ns,
+                info.st_size,
+            ]:
+                kept[path] = entry
+        if len(kept) != len(hashes):
+            # write the pruned index with the next new digests
+            self.unsaved_hashes += 1
+        return kept
+
+    def write_hashes(self):
+        """Write the index of file hashes. Call it with hashes_lock held."""
+        os.makedirs(self.directory, exist_ok=True)
+        self.write_atomically(self.hashes_path(), json.dumps(self.hashes).encode())
+        self.unsaved_hashes = 0
+
+    def save_hashes(self):
+        """Write the digests that are not in hashes.json yet, if there are any."""
+        with self.hashes_lock:
+            if self.unsaved_hashes:
+                self.write_hashes()
+
+    def get(self, source_hash, size):
+        """
+        Return the cached image for a content hash and decoded size, or None.
+
+        The image is backed by a read-only memory map of the cache file.
+
+        Args:
+            source_hash (str): The SHA-256 digest of the image file.
+            size (tuple): The (width, height) the file decodes to.
+        """
+        path = self.path_for(source_hash, size)
+        try:
+            with open(path, "rb") as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        if len(buffer) != size[0] * size[1]:
+            buffer.close()
+            self.misses += 1
+            return None
+        # the modification time marks the file as recently used
+        os.utime(path)
+        self.hits += 1
+        return PILImage.frombuffer("L", size, buffer, "raw", "L", 0, 1)
+
+    def put(self, source_hash, image):
+        """
+        Store a decoded image and remove the least recently used ones if the cache
+        is too large.
+
+        Args:
+            source_hash (str): The SHA-256 digest of the image file.
+            image (PIL.Image.Image): The decoded image in "L" mode.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        self.write_atomically(self.path_for(source_hash, image.size), image.tobytes())
+        self.evict()
+
+    @staticmethod
+    def write_atomically(path, data):
+        """Write a file so that other processes and threads never see it half written."""
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, "wb") as f:
+            f.write(data)
+        os.replace(temporary, path)
+
+    def entries(self):
+        """Return (modification time, size, path) of every cached image, oldest first."""
+        if not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".raw"):
+                path = os.path.join(self.directory, name)
+                try:
+                    info = os.stat(path)
+                except FileNotFoundError:
+                    # evicted by another process or thread in the meantime
+                    continue
+                entries.append((info.st_mtime_ns, info.st_size, path))
+        return sorted(entries)
+
+    def evict(self):
+        """Remove the least recently used images until the cache fits in max_bytes."""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.evictions += 1
+
+    def clear(self):
+        """
+        Remove every cached image and the index of file hashes, and return how many
+        images were removed.
+        """
+        entries = self.entries()
+        for _, _, path in entries:
+            os.remove(path)
+        with self.hashes_lock:
+            self.hashes = {}
+            self.unsaved_hashes = 0
+            try:
+                os.remove(self.hashes_path())
+            except FileNotFoundError:
+                pass
+        return len(entries)
+
+    def __str__(self):
+        """Return the size of the cache and its hit, miss and eviction counters."""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        return (
+            f"Decode cache: {len(entries)} images, {total}/{self.max_bytes} bytes "
+            f"in {self.directory}, {self.hits} hits, {self.misses} misses, "
+            f"{self.evictions} evictions"
+        )
+
+
+class RenderCache:
+    """
+    A class to keep the most recently rendered ASCII art, so that rendering an image
+    again with the same settings does not convert it again.
+    """
+
+    def __init__(self, max_entries=32, max_cells=1_000_000):
+        """
+        Initialize an empty render cache.
+
+        Args:
+            max_entries (int, optional): The number of renders to keep before the
+                least recently used one is evicted. Defaults to 32.
+            max_cells (int, optional): Renders with more characters than this are
+                not cached. Defaults to 1 000 000.
+        """
+        self.max_entries = max_entries
+        self.max_cells = max_cells
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Return the cached ASCII art for a key, or None if it is not cached.
+
+        Args:
+            key (tuple): The render key, see ASCIIImage.render_key().
+        """
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, ascii):
+        """
+        Store the ASCII art for a key, evicting the least recently used entries if full.
+
+        Args:
+            key (tuple): The render key, see ASCIIImage.render_key().
+            ascii (list[str]): The rendered ASCII art.
+        """
+        self.entries[key] = ascii
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def discard(self, key):
+        """Remove a key from the cache if it is cached."""
+        self.entries.pop(key, None)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __str__(self):
+        """Return the size of the cache and its hit, miss and eviction counters."""
+        return (
+            f"Render cache: {len(self.entries)}/{self.max_entries} entries, "
+            f"{self.hits} hits, {self.misses} misses, {self.evictions} evictions"
+        )
+
+
+class SharedSource:
+    """
+    The decoded image of one file content, shared by every ASCIIImage of that
+    content, and how many images use it.
+    """
+
+    __slots__ = ("source_hash", "image", "pyramid", "refs", "lock")
+
+    def __init__(self, source_hash):
+        """
+        Initialize a source that is not decoded yet.
+
+        Args:
+            source_hash (str): The content hash of the image file.
+        """
+        self.source_hash = source_hash
+        self.image = None
+        self.pyramid = None
+        self.refs = 0
+        self.lock = threading.RLock()
+
+    def pyramid_bytes(self):
+        """Return the memory used by the smaller pyramid levels, in bytes."""
+        levels = self.pyramid or []
+        return sum(image_bytes(level) for level in levels[1:])
+
+    def resident_bytes(self):
+        """Return the memory used by the decoded image and its pyramid, in bytes."""
+        return image_bytes(self.image) + self.pyramid_bytes()
+
+
+class SourceStore:
+    """
+    A class to keep one decoded image per file content, so that loading the same file
+    under several aliases decodes it once. Sources are counted by reference and
+    dropped when the last image using them is gone.
+    """
+
+    def __init__(self):
+        """Initialize an empty source store."""
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, source_hash):
+        """
+        Return the shared source for a content hash and count one more image using it.
+
+        Args:
+            source_hash (str): The content hash of the image file.
+
+        Returns:
+            SharedSource: The source, created if no image used it yet.
+        """
+        with self.lock:
+            source = self.entries.get(source_hash)
+            if source is None:
+                source = self.entries[source_hash] = SharedSource(source_hash)
+            source.refs += 1
+            return source
+
+    def release(self, source):
+        """
+        Count one less image using a source, dropping it when no image uses it.
+
+        Args:
+            source (SharedSource): The source returned by acquire().
+        """
+        with self.lock:
+            source.refs -= 1
+            # after clear() the entry for the hash may be another source
+            if source.refs <= 0 and self.entries.get(source.source_hash) is source:
+                del self.entries[source.source_hash]
+
+    def clear(self):
+        """
+        Forget every source, so that images created from now on decode their files
+        again instead of sharing what earlier images decoded. Images that use a
+        source keep it until they are gone.
+
+        Returns:
+            int: The number of sources forgotten.
+        """
+        with self.lock:
+            count = len(self.entries)
+            self.entries.clear()
+            return count
+
+    def resident_bytes(self):
+        """Return the memory used by every decoded image and pyramid, in bytes."""
+        with self.lock:
+            sources = list(self.entries.values())
+        return sum(source.resident_bytes() for source in sources)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __str__(self):
+        """Return the number of sources, how many are decoded and their memory."""
+        with self.lock:
+            sources = list(self.entries.values())
+        decoded = sum(source.image is not None for source in sources)
+        return (
+            f"Source store: {len(sources)} sources, {decoded} decoded, "
+            f"{sum(source.resident_bytes() for source in sources)} bytes"
+        )
+
+
+# shared by every image, so aliases of the same file share their decoded image even
+# across studios, until it is cleared
+SOURCE_STORE = SourceStore()
+
+
+class ASCIIConverter:
+    """
+    A class to map a whole grayscale frame to ASCII characters in one bulk operation,
+    using a 256-entry lookup table instead of reading the frame pixel by pixel.
+
+    Frames are mapped to one byte per pixel. For ASCII charsets that byte is the
+    character itself, for others, such as block shades, it is the index of the
+    character, which is swapped for the character when the row is decoded.
+
+    Besides mapping every pixel to its nearest character, the render modes dither
+    between neighbouring characters, by error diffusion (floyd) or with a repeated
+    threshold matrix (bayer), or draw strong edges with line characters (edges).
+    They are built from whole-image PIL operations too, never a loop over pixels.
+    """
+
+    def __init__(self, chars=ASCII_CHARS, tone=None, mode="plain"):
+        """
+        Initialize the converter and build its lookup table.
+
+        Args:
+            chars (str, optional): The characters to use, from the darkest to the
+                lightest pixel. Defaults to ASCII_CHARS.
+            tone (list[int], optional): A 256-entry table of brightness and contrast
+                to apply to every pixel first, see ImageAdjustment. It is built into
+                the lookup table, so it costs nothing per pixel. Defaults to None.
+            mode (str, optional): One of RENDER_MODES. Defaults to plain.
+
+        Raises:
+            ValueError: If the mode is unknown, or the charset leaves no room for
+                the edge characters.
+        """
+        if mode not in RENDER_MODES:
+            raise ValueError(f"Unknown render mode: {mode}")
+        self.chars = chars
+        self.mode = mode
+        self.tone = tone
+        # the characters for the indexes in the table, or None if it holds characters
+        self.glyphs = None if chars.isascii() else chars
+        if mode == "edges" and self.glyphs is not None:
+            if len(chars) + len(EDGE_GLYPHS) > 256:
+                raise ValueError("Edges need a charset of at most 252 characters")
+            # the edge characters get the indexes after the charset
+            self.glyphs = chars + EDGE_GLYPHS
+        self.table = self.build_table(chars)
+        if tone is not None:
+            self.table = bytes(self.table[value] for value in tone)
+        # the same table as a list, which is what Image.point() takes
+        self.lut = list(self.table)
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def build_table(chars):
+        """
+        Build the table that maps every pixel value (0-255) to a character.
+
+        The same formula as the original per-pixel conversion is used, so the
+        output is identical to calling getpixel() for every cell. Each charset is
+        built once and the same table is shared by every converter that uses it, so
+        a long charset costs no more per pixel than a short one.
+
+        Args:
+            chars (str): The characters to use, from the darkest to the lightest pixel.
+
+        Returns:
+            bytes: 256 bytes, where the byte at index p is the character for pixel p,
+                or its index in chars if chars is not all ASCII.
+        """
+        num_chars = len(chars)
+        codes = [ord(char) for char in chars] if chars.isascii() else range(num_chars)
+        return bytes(
+            codes[min(int(p / 255 * num_chars), num_chars - 1)] for p in range(256)
+        )
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def level_table(chars):
+        """
+        Build the table from the index of a character to its byte, for frames that
+        hold character indexes instead of pixel values.
+
+        Args:
+            chars (str): The characters to use, from the darkest to the lightest pixel.
+
+        Returns:
+            bytes: 256 bytes, indexes past the last character map to the last one.
+        """
+        num_chars = len(chars)
+        codes = [ord(char) for char in chars] if chars.isascii() else range(num_chars)
+        return bytes(codes[min(index, num_chars - 1)] for index in range(256))
+
+    @staticmethod
+    def ramp_grays(levels):
+        """
+        Return the gray every character of a ramp stands for, the middle of the
+        pixel values build_table() maps to it.
+
+        Args:
+            levels (int): The number of characters in the ramp.
+
+        Returns:
+            list[int]: One gray (0-255) per character, from the darkest.
+        """
+        return [round((index + 0.5) * 255 / levels) for index in range(levels)]
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def ramp_palette(levels):
+        """
+        Build a palette with the gray of every character of a ramp, see ramp_grays().
+
+        Args:
+            levels (int): The number of characters in the ramp.
+
+        Returns:
+            PIL.Image.Image: A "P" image with the palette, for Image.quantize().
+        """
+        grays = ASCIIConverter.ramp_grays(levels)
+        # the unused entries repeat the last gray, level_table() maps them to the
+        # last character
+        grays += grays[-1:] * (256 - levels)
+        palette = PILImage.new("P", (1, 1))
+        palette.putpalette([channel for gray in grays for channel in (gray,) * 3])
+        return palette
+
+    @staticmethod
+    @lru_cache(maxsize=8)
+    def bayer_offsets(size, levels):
+        """
+        Build a frame of the Bayer matrix repeated to the given size, as offsets of
+        less than half the gray levels between two characters, plus 128.
+
+        Args:
+            size (tuple): The (width, height) of the frame.
+            levels (int): The number of characters in the ramp.
+
+        Returns:
+            PIL.Image.Image: The offsets in "L" mode.
+        """
+        width, height = size
+        step = 255 / levels
+        rows = []
+        for thresholds in BAYER_MATRIX:
+            # rounded towards 0, so a pixel in the middle of a character stays on it
+            row = bytes(
+                128 + int(((threshold + 0.5) / 64 - 0.5) * step)
+                for threshold in thresholds
+            )
+            rows.append((row * (width // len(row) + 1))[:width])
+        data = b"".join(rows[y % len(rows)] for y in range(height))
+        return PILImage.frombytes("L", size, data)
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def edge_tables():
+        """
+        Build the tables of edges mode.
+
+        The Sobel gradients in x and y, with 128 for no gradient, are each turned into
+        a 3-bit magnitude and a sign bit and packed into one byte, and every packed
+        byte is given an edge direction.
+
+        Returns:
+            tuple: The table for the x gradient, the table for the y gradient, and
+                for every packed byte the index in EDGE_GLYPHS, or None if the cell
+                is not an edge.
+        """
+
+        def pack(value):
+            return min(abs(value - 128) >> 4, 7) << 1 | (value > 128)
+
+        x_table = [pack(value) << 4 for value in range(256)]
+        y_table = [pack(value) for value in range(256)]
+        # the kernels are scaled by 1/8, so a step of n gray levels gives n/2
+        threshold = (EDGE_MIN_STEP // 2) >> 4
+        directions = []
+        for code in range(256):
+            x, x_sign = code >> 5, code >> 4 & 1
+            y, y_sign = code >> 1 & 7, code & 1
+            if max(x, y) < threshold:
+                directions.append(None)
+            elif x > 2 * y:
+                directions.append(1)
+            elif y > 2 * x:
+                directions.append(0)
+            else:
+                # brighter to the right and below, or to the left and above, is an
+                # edge from the bottom left to the top right
+                directions.append(2 if x_sign == y_sign else 3)
+        return x_table, y_table, directions
+
+    def intensity_frame(self, ascii):
+        """
+        Turn ASCII art back into the grays its characters stand for, one pixel per
+        character, e.g. to compare it with the image it was converted from.
+
+        Args:
+            ascii (list[str]): Rows of ASCII art without color escapes, drawn with
+                the charset of the converter.
+
+        Returns:
+            PIL.Image.Image: The grays in "L" mode.
+        """
+        # edge characters stand for no gray of their own, they get the middle one
+        grays = dict.fromkeys(map(ord, EDGE_GLYPHS), chr(128))
+        for char, gray in zip(self.chars, self.ramp_grays(len(self.chars))):
+            grays[ord(char)] = chr(gray)
+        data = "".join(ascii).translate(grays).encode("latin-1")
+        width = len(ascii[0]) if ascii else 0
+        return PILImage.frombytes("L", (width, len(ascii)), data)
+
+    def decode(self, data):
+        """Turn mapped bytes into the characters they stand for."""
+        if self.glyphs is None:
+            return data.decode("ascii")
+        # latin-1 turns every byte into the character with that code, which indexes
+        # the glyphs
+        return data.decode("latin-1").translate(self.glyphs)
+
+    def convert(self, frame, workers=1, band_height=BAND_HEIGHT):
+        """
+        Convert a resized grayscale frame to lines of ASCII art.
+
+        With more than one worker, a frame taller than band_height is split into
+        bands of rows that are mapped at the same time and joined back in order,
+        which gives exactly the same lines as mapping it in one go.
+
+        Args:
+            frame (PIL.Image.Image): A frame in "L" mode, already resized to the
+                target width and height.
+            workers (int, optional): The number of workers. Defaults to 1.
+            band_height (int, optional): The number of rows in each band.
+                Defaults to BAND_HEIGHT.
+
+        Returns:
+            list[str]: One string per row of the frame.
+        """
+        width, height = frame.size
+        if self.mode != "plain":
+            data = self.map_frame(frame)
+        elif workers > 1 and height > band_height:
+            bands = [
+                (0, top, width, min(top + band_height, height))
+                for top in range(0, height, band_height)
+            ]
+            with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                data = b"".join(
+                    executor.map(lambda box: self.map_band(frame, box), bands)
+                )
+        else:
+            data = frame.tobytes().translate(self.table)
+        text = self.decode(data)
+        return [text[y * width : (y + 1) * width] for y in range(height)]
+
+    def iter_lines(self, frame, workers=1, band_height=BAND_HEIGHT):
+        """
+        Convert a resized grayscale frame to lines of ASCII art, one band at a time.
+
+        Only one band of mapped rows is held at a time when there is one worker, so
+        memory does not grow with the height of the frame.
+
+        Args:
+            frame (PIL.Image.Image): A frame in "L" mode, already resized to the
+                target width and height.
+            workers (int, optional): The number of workers. Defaults to 1.
+            band_height (int, optional): The number of rows in each band.
+                Defaults to BAND_HEIGHT.
+
+        Yields:
+            str: The rows of the frame, from top to bottom.
+        """
+        width, height = frame.size
+        if self.mode != "plain":
+            yield from self.split_rows(self.map_frame(frame), width)
+            return
+        bands = [
+            (0, top, width, min(top + band_height, height))
+            for top in range(0, height, band_height)
+        ]
+        if workers > 1 and len(bands) > 1:
+            with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                for data in executor.map(lambda box: self.map_band(frame, box), bands):
+                    yield from self.split_rows(data, width)
+        else:
+            for box in bands:
+                yield from self.split_rows(self.map_band(frame, box), width)
+
+    def split_rows(self, data, width):
+        """Split mapped character bytes into rows of the given width."""
+        text = self.decode(data)
+        for start in range(0, len(text), width):
+            yield text[start : start + width]
+
+    def map_band(self, frame, box):
+        """
+        Map one band of a frame to character bytes.
+
+        crop() and point() run in C without holding the GIL, so several bands can be
+        mapped by threads at the same time.
+
+        Args:
+            frame (PIL.Image.Image): The frame in "L" mode.
+            box (tuple): The (left, top, right, bottom) of the band.
+
+        Returns:
+            bytes: One character byte per pixel of the band.
+        """
+        return frame.crop(box).point(self.lut).tobytes()
+
+    def map_frame(self, frame):
+        """
+        Map a whole frame to character bytes with the render mode of the converter.
+
+        Dithering and edges look at the neighbours of every pixel, so these modes
+        map the whole frame in one go instead of in bands.
+
+        Args:
+            frame (PIL.Image.Image): The frame in "L" mode.
+
+        Returns:
+            bytes: One character byte per pixel of the frame.
+        """
+        if self.mode == "floyd":
+            return self.map_diffused(frame)
+        if self.mode == "bayer":
+            return self.map_ordered(frame)
+        if self.mode == "edges":
+            return self.map_edges(frame)
+        return frame.tobytes().translate(self.table)
+
+    def toned(self, frame):
+        """Return the frame with the brightness and contrast of the converter applied."""
+        return frame if self.tone is None else frame.point(self.tone)
+
+    def map_diffused(self, frame):
+        """
+        Map a frame with Floyd-Steinberg error diffusion: each pixel is given the
+        nearest gray of the ramp, and the difference is spread to the pixels right
+        of and below it. PIL does the diffusion in C when it quantizes to a palette.
+        """
+        levels = len(self.chars)
+        image = self.toned(frame).convert("RGB")
+        indexes = image.quantize(
+            palette=self.ramp_palette(levels), dither=PILImage.Dither.FLOYDSTEINBERG
+        )
+        return indexes.tobytes().translate(self.level_table(self.chars))
+
+    def map_ordered(self, frame):
+        """
+        Map a frame with ordered dithering: an offset from the repeated Bayer
+        matrix is added to every pixel before it is mapped, so pixels between two
+        characters become a fixed pattern of both.
+        """
+        offsets = self.bayer_offsets(frame.size, len(self.chars))
+        dithered = ImageChops.add(self.toned(frame), offsets, offset=-128)
+        return dithered.tobytes().translate(self.build_table(self.chars))
+
+    def map_edges(self, frame):
+        """
+        Map a frame with the character of every pixel, except strong edges, which
+        are drawn with the EDGE_GLYPHS character closest to their direction.
+        """
+        x_table, y_table, directions = self.edge_tables()
+        if self.glyphs is None:
+            codes = [ord(char) for char in EDGE_GLYPHS]
+        else:
+            codes = range(len(self.chars), len(self.chars) + len(EDGE_GLYPHS))
+        glyph_table = [0 if d is None else codes[d] for d in directions]
+        mask_table = [0 if d is None else 255 for d in directions]
+
+        toned = self.toned(frame)
+        gradient_x = toned.filter(ImageFilter.Kernel((3, 3), SOBEL_X, 8, 128))
+        gradient_y = toned.filter(ImageFilter.Kernel((3, 3), SOBEL_Y, 8, 128))
+        packed = ImageChops.add(gradient_x.point(x_table), gradient_y.point(y_table))
+        mask = packed.point(mask_table)
+        # the filter leaves the pixels on the border as they were, they are not edges
+        width, height = frame.size
+        for box in [
+            (0, 0, width, 1),
+            (0, height - 1, width, height),
+            (0, 0, 1, height),
+            (width - 1, 0, width, height),
+        ]:
+            mask.paste(0, box)
+        edges = PILImage.composite(
+            packed.point(glyph_table), frame.point(self.lut), mask
+        )
+        return edges.tobytes()
+
+
+class ColorEncoder:
+    """
+    A class to color rows of ASCII art with ANSI escapes, in 256 colors or in
+    truecolor. Neighbouring characters of the same color share one escape, and
+    spaces, which show no color, continue the color before them.
+    """
+
+    def __init__(self, mode):
+        """
+        Initialize an encoder for a color mode.
+
+        Args:
+            mode (str): One of COLOR_MODES.
+        """
+        if mode not in COLOR_MODES:
+            raise ValueError(f"Unknown color mode: {mode}")
+        self.mode = mode
+        self.escapes = {}
+        self.written = 0
+        self.naive = 0
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def cube_tables():
+        """
+        Build the tables that map red, green and blue values to their share of the
+        nearest color number in the color cube, so that the three shares add up.
+
+        Returns:
+            tuple: Three 256-entry lists, for red, green and blue.
+        """
+        nearest = [
+            min(range(6), key=lambda i: abs(COLOR_CUBE_LEVELS[i] - value))
+            for value in range(256)
+        ]
+        return (
+            [36 * level for level in nearest],
+            [6 * level for level in nearest],
+            [16 + level for level in nearest],
+        )
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def truecolor_table():
+        """Build the table that rounds each channel to a multiple of TRUECOLOR_STEP."""
+        table = [
+            min(255, round(value / TRUECOLOR_STEP) * TRUECOLOR_STEP)
+            for value in range(256)
+        ]
+        return table * 3
+
+    def quantize(self, frame):
+        """
+        Work out the color of every cell of a frame, using whole-image operations.
+
+        Args:
+            frame (PIL.Image.Image): The frame in "RGB" mode at the target size.
+
+        Returns:
+            list: One sequence of colors per row, color numbers (bytes) in 256-color
+                mode and (red, green, blue) tuples in truecolor.
+        """
+        width, height = frame.size
+        if self.mode == "256":
+            red, green, blue = frame.split()
+            red_table, green_table, blue_table = self.cube_tables()
+            numbers = ImageChops.add(
+                ImageChops.add(red.point(red_table), green.point(green_table)),
+                blue.point(blue_table),
+            ).tobytes()
+            return [numbers[y * width : (y + 1) * width] for y in range(height)]
+        data = frame.point(self.truecolor_table()).tobytes()
+        colors = list(zip(data[0::3], data[1::3], data[2::3]))
+        return [colors[y * width : (y + 1) * width] for y in range(height)]
+
+    def escape(self, color):
+        """Return the escape that sets the foreground to a color."""
+        escape = self.escapes.get(color)
+        if escape is None:
+            if self.mode == "256":
+                escape = f"\x1b[38;5;{color}m"
+            else:
+                escape = f"\x1b[38;2;{color[0]};{color[1]};{color[2]}m"
+            self.escapes[color] = escape
+        return escape
+
+    def encode(self, ascii, colors):
+        """
+        Add color escapes to rows of ASCII art, one per run of the same color.
+
+        The bytes written and the bytes an escape before every character would take
+        are added to self.written and self.naive.
+
+        Args:
+            ascii (list[str]): The rows of characters.
+            colors (list): The colors of the cells, from quantize().
+
+        Returns:
+            list[str]: The rows with escapes, each ending with a reset.
+        """
+        rows = []
+        for line, row_colors in zip(ascii, colors):
+            parts = []
+            current = None
+            start = 0
+            for x, char in enumerate(line):
+                color = row_colors[x]
+                if color != current and char != " ":
+                    parts.append(line[start:x])
+                    parts.append(self.escape(color))
+                    current = color
+                    start = x
+            parts.append(line[start:])
+            parts.append(ANSI_RESET)
+            row = "".join(parts)
+            rows.append(row)
+
+            self.written += len(row.encode()) + 1
+            self.naive += len(line.encode()) + len(ANSI_RESET) + 1
+            for color, count in Counter(row_colors).items():
+                self.naive += count * len(self.escape(color))
+        return rows
+
+    def encode_naive(self, ascii, colors):
+        """
+        Add an escape before every character, the simple way this is usually done,
+        for comparing with encode().
+        """
+        return [
+            "".join(self.escape(color) + char for color, char in zip(row_colors, line))
+            + ANSI_RESET
+            for line, row_colors in zip(ascii, colors)
+        ]
 
 
 class ImageAdjustment:
+    """
+    A class to combine enhancements of an image, one after the other, into a single
+    256-entry tone table instead of enhancing every pixel of the image.
+
+    The table gives the same values as ImageEnhance, which blends the image with a
+    black image for brightness and with its mean gray for contrast.
+    """
+
     def __init__(self, image):
         self.image = image
+        self.table = list(range(256))
 
     def apply_enhancement(self, enhancer_class, factor):
-        enhancer = enhancer_class(self.image)
-        self.image = enhancer.enhance(factor)
-        return self.image
+        """
+        Add an enhancement to the tone table and return the table.
+
+        Args:
+            enhancer_class (type): ImageEnhance.Brightness or ImageEnhance.Contrast.
+            factor (float): The enhancement factor. 1.0 gives back the same values,
+                so it is skipped.
+        """
+        if factor == 1.0:
+            return self.table
+        if enhancer_class is ImageEnhance.Brightness:
+            degenerate = 0
+        elif enhancer_class is ImageEnhance.Contrast:
+            degenerate = self.mean()
+        else:
+            raise ValueError(f"{enhancer_class.__name__} can not be made into a table")
+        self.table = [self.blend(degenerate, value, factor) for value in self.table]
+        return self.table
+
+    def mean(self):
+        """Return the rounded mean of the image after the table, like ImageEnhance.Contrast."""
+        histogram = self.image.histogram()
+        total = sum(self.table[value] * count for value, count in enumerate(histogram))
+        return int(total / (self.image.width * self.image.height) + 0.5)
+
+    @staticmethod
+    def blend(degenerate, value, factor):
+        """
+        Blend one value like Image.blend(), which computes in single precision floats
+        and truncates the result.
+        """
+        factor = float32(factor)
+        blended = float32(degenerate + float32(factor * (value - degenerate)))
+        if blended <= 0:
+            return 0
+        if blended >= 255:
+            return 255
+        return int(blended)
+
+
+def float32(value):
+    """Round a float to single precision."""
+    return struct.unpack("f", struct.pack("f", value))[0]
 
 
 class CommandHandler:
     def __init__(self, studio):
         self.studio = studio
+        self.running = True
         self.commands = {
             "load": self.load,
             "save": self.save,
@@ -370,35 +3297,110 @@ class CommandHandler:
             "set": self.set_image_property,
             "help": self.show_help,
             "quit": self.quit,
+            "cache": self.cache,
+            "play": self.play,
+            "export": self.export,
         }
 
     def load(self, args):
-        if args[0] == "image":
+        if args[0] == "dir" and len(args) in (2, 3):
+            pattern = args[2] if len(args) == 3 else None
+            self.studio.add_directory_to_studio(args[1], pattern)
+        elif args[0] == "image":
             filename = args[1]
             alias = None
             if len(args) > 3 and args[2] == "as":
                 alias = args[3]
             self.studio.add_image_to_studio(filename, alias=alias)
         elif len(args) == 1:
-            print(args[0])
+            self.studio.log(args[0])
             filename = args[0]
             self.studio.add_image_to_studio(filename)
         elif args[0] == "session":
             self.studio.load_session(args[1])
         else:
-            print("Invalid load command. Use 'help' for more information.")
+            self.studio.error("Invalid load command. Use 'help' for more information.")
 
     def save(self, args):
-        if args[0] == "session":
-            self.studio.save_session(args[1])
+        if args and args[0] == "session":
+            include_ascii = "--ascii" in args
+            if include_ascii:
+                args.remove("--ascii")
+            names = args[2:] if args[1:2] == ["as"] else args[1:]
+            if len(names) != 1:
+                self.studio.error("Usage: save session [as] name [--ascii]")
+                return
+            self.studio.save_session(names[0], include_ascii)
         else:
-            print("Invalid save command. Use 'help' for more information.")
+            self.studio.error("Invalid save command. Use 'help' for more information.")
+
+    def play(self, args):
+        name = None
+        fps = None
+        loops = 1
+        if args and args[0] not in ("fps", "loops"):
+            name = args[0]
+            args = args[1:]
+        if len(args) % 2:
+            self.studio.error("Usage: play [name] [fps number] [loops number]")
+            return
+        for option, value in zip(args[::2], args[1::2]):
+            if option == "fps":
+                fps = float(value)
+            elif option == "loops":
+                loops = int(value)
+            else:
+                self.studio.error(f"Unknown play option: {option}")
+                return
+        self.studio.play_animation(name, fps, loops)
+
+    def export(self, args):
+        fmt = "txt"
+        workers = None
+        compress = "--gzip" in args
+        if compress:
+            args.remove("--gzip")
+        if "--format" in args:
+            index = args.index("--format")
+            fmt = args[index + 1]
+            del args[index : index + 2]
+        if "--workers" in args:
+            index = args.index("--workers")
+            workers = int(args[index + 1])
+            del args[index : index + 2]
+        if len(args) < 2:
+            self.studio.error("Insufficient arguments for 'export' command.")
+            return
+        self.studio.export_images(args[:-1], args[-1], fmt, compress, workers)
+
+    def cache(self, args):
+        if not args:
+            self.studio.decode_cache_info()
+        elif args[0] == "clear":
+            self.studio.clear_decode_cache()
+        else:
+            self.studio.error("Invalid cache command. Use 'help' for more information.")
 
     def render(self, args):
+        workers = None
+        use_processes = False
+        if "--processes" in args:
+            args.remove("--processes")
+            use_processes = True
+        if "--workers" in args:
+            index = args.index("--workers")
+            workers = int(args[index + 1])
+            del args[index : index + 2]
+        delta = "--delta" in args
+        if delta:
+            args.remove("--delta")
+
         if len(args) == 0:
-            self.studio.render_ascii_art(None)
+            self.studio.render_ascii_art(None, delta)
+        elif len(args) == 1 and args[0] != "all":
+            self.studio.render_ascii_art(args[0], delta)
         else:
-            self.studio.render_ascii_art(args[0])
+            self.studio.render_batch(args, workers, use_processes)
 
     def show_help(self, args=None):
         print(
@@ -408,28 +3410,50 @@ class CommandHandler:
     e.g. load image stadshuset.jpg as hus or load stadshuset.jpg
     1b. load session - you can load a saved ASCII studio session
     e.g. load session s1
+    1c. load dir - loads every image of a directory at once, named after the files
+    e.g. load dir photos or load dir photos "**/*.png"
 2. save - saves a sesion so that you can modify and render your images
     e.g. save session as s1
+    add --ascii to also save the last rendered ASCII art
 3. info - Prints the current loaded image and all images.
     e.g. info
+    stats - Prints how long each stage of rendering took for every image.
 4. render - Prints the current loaded image an an ASCII drawing
+    e.g. render, render hus, render all or render hus slalom
+    add --workers number or --processes to choose how several images are converted
+    add --delta to redraw only what changed since the last render --delta
 5. set - used to modify the images in the ASCII studio
     5a. set image height number
     5b. set image width number
     5c. set image brightness number
     5d. set image contrast number
-6. help
-7. quit
+    5e. set image workers number - converts large images in bands at the same time
+    5f. set image bandheight number - the number of rows in each band
+    5g. set image charset name - short, long or blocks, or your own characters
+    from the darkest to the lightest, e.g. set hus charset "@#+-. "
+    5h. set image color mode - 256, truecolor or off
+    5i. set image mode name - plain, floyd or bayer to dither between characters,
+    or edges to draw strong edges with / \\ | and -
+6. cache - Prints the decoded images kept on disk between sessions.
+    e.g. cache or cache clear
+7. play - Plays an animated GIF, APNG or TIFF image as ASCII art.
+    e.g. play anim, play anim fps 12 or play anim fps 24 loops 3
+8. export - Writes the ASCII art of images to files in a directory, only the
+    images that changed since they were last exported there.
+    e.g. export hus out, export all out --format html or export all out --gzip
+    formats are txt, html and ansi, add --workers number to choose the workers
+9. help
+10. quit
                           """
         )
 
     def quit(self, args=None):
-        print("Exiting ASCII Art Studio.")
-        exit()
+        self.studio.log("Exiting ASCII Art Studio.")
+        self.running = False
 
     def set_image_property(self, args):
         if len(args) < 3:
-            print("Insufficient arguments for 'set' command.")
+            self.studio.error("Insufficient arguments for 'set' command.")
             return
         alias = args[0]
         property_name = args[1]
@@ -440,38 +3464,430 @@ class CommandHandler:
             "height": self.studio.set_image_height,
             "brightness": self.studio.set_image_brightness,
             "contrast": self.studio.set_image_contrast,
+            "charset": self.studio.set_image_charset,
+            "color": self.studio.set_image_color,
+            "mode": self.studio.set_image_mode,
+            "workers": self.studio.set_image_workers,
+            "bandheight": self.studio.set_image_band_height,
         }
 
         if property_name in property_setters:
             try:
-                if property_name in ["width", "height"]:
+                if property_name in ["width", "height", "workers", "bandheight"]:
                     value = int(value)
                 elif property_name in ["brightness", "contrast"]:
                     value = float(value)
                 property_setters[property_name](alias, value)
             except ValueError:
-                print(f"Invalid value for {property_name}.")
+                self.studio.error(f"Invalid value for {property_name}.")
         else:
-            print(f"Unknown property: {property_name}")
+            self.studio.error(f"Unknown property: {property_name}")
 
     def process_command(self, command_input):
-        command_args = shlex.split(command_input)
+        try:
+            command_args = shlex.split(command_input)
+        except ValueError as e:
+            # e.g. No closing quotation
+            self.studio.error(f"Cannot read command: {e}")
+            return
         if not command_args:
             return
-        command = command_args[0].lower()
-        args = command_args[1:]
-
+        writer = self.studio.delta_writer
+        draws = writer.draws
+        output = OutputWatcher(sys.stdout)
+        with redirect_stdout(output):
+            self.run_command(command_args[0].lower(), command_args[1:])
+        self.studio.save_hashes()
+        if output.written and writer.draws == draws:
+            # anything printed but a delta render moves the rows the next one rewrites
+            writer.forget()
+
+    def run_command(self, command, args):
         if command == "info":
             self.studio.studio_info()
 
+        elif command == "stats":
+            self.studio.studio_stats()
+
         elif command in self.commands:
             try:
                 self.commands[command](args)
 
             except Exception as e:
-                print(f"Error executing {command}: {e}")
+                self.studio.error(f"Error executing {command}: {e}")
+        else:
+            self.studio.error("Unknown command. Type 'help' for a list of commands.")
+
+
+class RequestError(Exception):
+    """An error in a request to the render server, answered with an HTTP status."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class RenderServer:
+    """
+    A class to serve ASCII art over HTTP from one long running process, so the
+    interpreter and PIL are only started once.
+
+    GET /render?path=slalom.jpg&width=80 converts an image file below the root
+    directory, and POST /render?width=80 converts the image sent as the request body.
+    width, height, brightness, contrast, charset, color and mode can be given as
+    query parameters, and ASCII art of more than max_cells characters is refused.
+    GET /metrics returns the counters and latencies of the server as JSON.
+
+    Conversions run on a worker pool. Identical requests that arrive while one is
+    being converted wait for that conversion instead of starting another, finished
+    ones are kept in the render cache of the studio, and new conversions are refused
+    with 503 while max_pending are running.
+    """
+
+    def __init__(
+        self,
+        studio=None,
+        host="127.0.0.1",
+        port=8000,
+        workers=None,
+        use_processes=False,
+        max_pending=SERVER_MAX_PENDING,
+        max_upload_bytes=SERVER_MAX_UPLOAD_BYTES,
+        max_cells=SERVER_MAX_CELLS,
+        read_timeout=SERVER_READ_TIMEOUT,
+        root=".",
+    ):
+        """
+        Initialize a server that is not listening yet.
+
+        Args:
+            studio (ASCIIArtStudio, optional): The studio whose caches are used.
+                Defaults to a new studio.
+            host (str, optional): The address to listen on. Defaults to 127.0.0.1.
+            port (int, optional): The port to listen on, 0 picks a free one.
+                Defaults to 8000.
+            workers (int, optional): The number of workers. Defaults to None.
+            use_processes (bool, optional): Use processes instead of threads.
+                Defaults to False.
+            max_pending (int, optional): The number of conversions that may run at
+                once. Defaults to SERVER_MAX_PENDING.
+            max_upload_bytes (int, optional): The largest image that may be uploaded.
+                Defaults to SERVER_MAX_UPLOAD_BYTES.
+            max_cells (int, optional): The most characters the ASCII art of a
+                request may have. Defaults to SERVER_MAX_CELLS.
+            read_timeout (float, optional): The seconds to wait for each line and
+                for the body of a request. Defaults to SERVER_READ_TIMEOUT.
+            root (str, optional): Only image files below this directory can be
+                converted by path. Defaults to the current directory.
+        """
+        self.studio = studio or ASCIIArtStudio()
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.use_processes = use_processes
+        self.max_pending = max_pending
+        self.max_upload_bytes = max_upload_bytes
+        self.max_cells = max_cells
+        self.read_timeout = read_timeout
+        self.root = os.path.realpath(root)
+        self.executor = None
+        self.server = None
+        self.upload_dir = None
+        self.in_flight = {}
+        self.counters = {
+            "requests": 0,
+            "served": 0,
+            "rendered": 0,
+            "coalesced": 0,
+            "cache_hits": 0,
+            "rejected": 0,
+            "errors": 0,
+        }
+        self.latencies = deque(maxlen=SERVER_LATENCY_SAMPLES)
+        self.started = None
+
+    async def start(self):
+        """Start the worker pool and listen for connections."""
+        executor_class = (
+            futures.ProcessPoolExecutor
+            if self.use_processes
+            else futures.ThreadPoolExecutor
+        )
+        self.executor = executor_class(max_workers=self.workers)
+        self.upload_dir = tempfile.mkdtemp(prefix="aas_uploads_")
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.started = time.perf_counter()
+        self.studio.log(f"Serving ASCII art on http://{self.host}:{self.port}/render")
+
+    async def serve_forever(self):
+        """Start the server and serve until it is cancelled."""
+        await self.start()
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.close()
+
+    async def close(self):
+        """Stop listening, shut the worker pool down and remove the uploads."""
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        if self.upload_dir is not None:
+            shutil.rmtree(self.upload_dir, ignore_errors=True)
+            self.upload_dir = None
+        self.studio.save_hashes()
+
+    async def handle(self, reader, writer):
+        """Answer one HTTP request on a connection and close it."""
+        start = time.perf_counter()
+        self.counters["requests"] += 1
+        try:
+            method, target, body = await self.read_request(reader)
+            url = urllib_parse.urlsplit(target)
+            params = {
+                key: values[-1]
+                for key, values in urllib_parse.parse_qs(url.query).items()
+            }
+            if url.path == "/render" and method in ("GET", "POST"):
+                ascii = await self.render(params, body if method == "POST" else None)
+                status = http.HTTPStatus.OK
+                content_type = "text/plain; charset=utf-8"
+                payload = ("\n".join(ascii) + "\n").encode()
+                self.counters["served"] += 1
+                self.latencies.append(time.perf_counter() - start)
+            elif url.path == "/metrics" and method == "GET":
+                status = http.HTTPStatus.OK
+                content_type = "application/json"
+                payload = json.dumps(self.metrics()).encode()
+            else:
+                raise RequestError(
+                    http.HTTPStatus.NOT_FOUND, f"No route for {method} {url.path}"
+                )
+        except RequestError as e:
+            if e.status == http.HTTPStatus.SERVICE_UNAVAILABLE:
+                self.counters["rejected"] += 1
+            else:
+                self.counters["errors"] += 1
+            status = e.status
+            content_type = "text/plain; charset=utf-8"
+            payload = (str(e) + "\n").encode()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+
+        head = (
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            "Connection: close\r\n\r\n"
+        )
+        writer.write(head.encode() + payload)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    async def read_request(self, reader):
+        """
+        Read the request line, headers and body of an HTTP request.
+
+        Returns:
+            tuple: The method, the target and the body.
+
+        Raises:
+            RequestError: If the request is malformed, a line is longer than the
+                limit of the reader, the body is too large, or the client is too
+                slow to send it.
+        """
+        request_line = (await self.read_line(reader)).decode("latin-1").split()
+        if len(request_line) != 3:
+            raise RequestError(http.HTTPStatus.BAD_REQUEST, "Malformed request line")
+        method, target, _ = request_line
+
+        length = 0
+        while True:
+            line = (await self.read_line(reader)).decode("latin-1").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            if name.strip().lower() == "content-length":
+                try:
+                    length = int(value)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    raise RequestError(
+                        http.HTTPStatus.BAD_REQUEST, "Bad Content-Length"
+                    )
+
+        if length > self.max_upload_bytes:
+            raise RequestError(
+                http.HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                f"Uploads are limited to {self.max_upload_bytes} bytes",
+            )
+        body = b""
+        if length:
+            try:
+                body = await asyncio.wait_for(
+                    reader.readexactly(length), self.read_timeout
+                )
+            except asyncio.TimeoutError:
+                raise RequestError(http.HTTPStatus.REQUEST_TIMEOUT, "Request timed out")
+        return method, target, body
+
+    async def read_line(self, reader):
+        """Read one line of the request head, within the read timeout."""
+        try:
+            return await asyncio.wait_for(reader.readline(), self.read_timeout)
+        except asyncio.TimeoutError:
+            raise RequestError(http.HTTPStatus.REQUEST_TIMEOUT, "Request timed out")
+        except (ValueError, asyncio.LimitOverrunError):
+            # readline() raises ValueError for a line longer than the stream limit
+            raise RequestError(
+                http.HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, "Header line too long"
+            )
+
+    async def render(self, params, upload=None):
+        """
+        Convert the image of a request, sharing the work with identical requests.
+
+        Args:
+            params (dict): The query parameters: path (unless uploading), width,
+                height, brightness and contrast.
+            upload (bytes, optional): The image sent with the request.
+
+        Returns:
+            list[str]: The rows of the ASCII art.
+
+        Raises:
+            RequestError: If the parameters are wrong, the image cannot be converted
+                or too many conversions are running.
+        """
+        settings = self.parse_settings(params)
+        if upload:
+            digest = hashlib.sha256(upload).hexdigest()
+            filename = os.path.join(self.upload_dir, digest)
+            if not os.path.exists(filename):
+                with open(filename, "wb") as file:
+                    file.write(upload)
+            key = ("upload", digest) + settings
+        else:
+            filename = self.resolve_path(params.get("path"))
+            stat = os.stat(filename)
+            key = ("path", filename, stat.st_mtime_ns, stat.st_size) + settings
+
+        ascii = self.studio.render_cache.get(key)
+        if ascii is not None:
+            self.counters["cache_hits"] += 1
+            return ascii
+
+        future = self.in_flight.get(key)
+        if future is not None:
+            self.counters["coalesced"] += 1
         else:
-            print("Unknown command. Type 'help' for a list of commands.")
+            if len(self.in_flight) >= self.max_pending:
+                raise RequestError(
+                    http.HTTPStatus.SERVICE_UNAVAILABLE, "Too many conversions running"
+                )
+            future = asyncio.get_running_loop().run_in_executor(
+                self.executor,
+                render_file,
+                filename,
+                *settings,
+                self.studio.decode_cache,
+                self.max_cells,
+            )
+            self.in_flight[key] = future
+            future.add_done_callback(lambda _: self.in_flight.pop(key, None))
+            self.counters["rendered"] += 1
+
+        try:
+            ascii = await asyncio.shield(future)
+        except Exception as e:
+            raise RequestError(
+                http.HTTPStatus.BAD_REQUEST, f"Cannot convert image: {e}"
+            )
+        if ascii and len(ascii) * len(ascii[0]) <= self.studio.render_cache.max_cells:
+            self.studio.render_cache.put(key, ascii)
+        return ascii
+
+    def parse_settings(self, params):
+        """
+        Return (width, height, brightness, contrast, charset, color, mode) from the
+        query parameters.
+        """
+        try:
+            width = int(params["width"]) if "width" in params else None
+            height = int(params["height"]) if "height" in params else None
+            brightness = float(params.get("brightness", 1.0))
+            contrast = float(params.get("contrast", 1.0))
+            charset = resolve_charset(params.get("charset", ASCII_CHARS))
+            color = params.get("color", "off")
+            if color != "off" and color not in COLOR_MODES:
+                raise ValueError(f"Unknown color mode: {color}")
+            mode = params.get("mode", "plain")
+            if mode not in RENDER_MODES:
+                raise ValueError(f"Unknown render mode: {mode}")
+        except ValueError as e:
+            raise RequestError(http.HTTPStatus.BAD_REQUEST, f"Bad parameter: {e}")
+        if width is None and height is None:
+            width = 50
+        if (width is not None and width < 1) or (height is not None and height < 1):
+            raise RequestError(
+                http.HTTPStatus.BAD_REQUEST, "width and height must be positive"
+            )
+        # one side alone is checked here too, the other one is at least 1
+        if (width or 1) * (height or 1) > self.max_cells:
+            raise RequestError(
+                http.HTTPStatus.BAD_REQUEST,
+                f"ASCII art is limited to {self.max_cells} characters",
+            )
+        return (width, height, brightness, contrast, charset, color, mode)
+
+    def resolve_path(self, path):
+        """Return the real path of an image file below the root directory."""
+        if not path:
+            raise RequestError(
+                http.HTTPStatus.BAD_REQUEST, "Give a path or upload an image"
+            )
+        filename = os.path.realpath(os.path.join(self.root, path))
+        if not filename.startswith(self.root + os.sep) or not os.path.isfile(filename):
+            raise RequestError(
+                http.HTTPStatus.NOT_FOUND, f"Image file {path} not found"
+            )
+        return filename
+
+    def metrics(self):
+        """Return the counters, throughput and latency percentiles of the server."""
+        uptime = time.perf_counter() - self.started if self.started else 0.0
+        latencies = sorted(self.latencies)
+
+        def percentile(share):
+            if not latencies:
+                return 0.0
+            return (
+                latencies[min(len(latencies) - 1, int(share * len(latencies)))] * 1000
+            )
+
+        return {
+            **self.counters,
+            "in_flight": len(self.in_flight),
+            "uptime_seconds": round(uptime, 3),
+            "served_per_second": (
+                round(self.counters["served"] / uptime, 3) if uptime else 0.0
+            ),
+            "latency_ms": {
+                "p50": round(percentile(0.5), 3),
+                "p95": round(percentile(0.95), 3),
+                "max": round(latencies[-1] * 1000 if latencies else 0.0, 3),
+            },
+        }
 
 
 class Main:
@@ -483,11 +3899,169 @@ class Main:
     def run(self):
         """Run the main loop of the ASCII Art Studio application, accepting and processing user commands."""
         print("Welcome to ASCII Art Studio!")
-        while True:
-            command_input = input("AAS Command Input: ")
+        while self.command_handler.running:
+            try:
+                command_input = input("AAS Command Input: ")
+            except EOFError:
+                break
             self.command_handler.process_command(command_input)
 
+    def run_script(self, lines, quiet=True, timing=False):
+        """
+        Run commands from a script without prompting, e.g. from a file or stdin.
+
+        Empty lines and lines starting with # are skipped, and the script stops at
+        quit or at its end.
+
+        Args:
+            lines (iterable[str]): The commands, one per line.
+            quiet (bool, optional): Only print the ASCII art and errors, not status
+                messages. Defaults to True.
+            timing (bool, optional): Print how long each command took to stderr.
+                Defaults to False.
+
+        Returns:
+            int: The number of commands that failed.
+        """
+        self.studio.verbose = not quiet
+        failed = 0
+        for line in lines:
+            command_input = line.strip()
+            if not command_input or command_input.startswith("#"):
+                continue
+            start = time.perf_counter()
+            errors = self.studio.errors
+            self.command_handler.process_command(command_input)
+            if self.studio.errors > errors:
+                failed += 1
+            if timing:
+                elapsed = (time.perf_counter() - start) * 1000
+                print(f"{elapsed:10.3f} ms  {command_input}", file=sys.stderr)
+            if not self.command_handler.running:
+                break
+        return failed
+
+
+def run_once(arguments):
+    """
+    Run one command given on the command line, without the studio prompt.
+
+    render FILE converts the image straight away, with the --width, --height,
+    --brightness, --contrast, --charset, --color and --mode options. Any other
+    command is run like a one line script.
+
+    Args:
+        arguments (argparse.Namespace): The parsed command line.
+
+    Returns:
+        int: The exit status, 0 if the command succeeded.
+    """
+    command = arguments.command
+    if command[0] == "render" and len(command) == 2:
+        width = arguments.width
+        if width is None and arguments.height is None:
+            width = 50
+        decode_cache = DecodeCache()
+        try:
+            image = ASCIIImage(
+                command[1], width, arguments.height, decode_cache=decode_cache
+            )
+        except Exception:
+            # open_image has already said why
+            return 1
+        decode_cache.save_hashes()
+        if arguments.brightness is not None:
+            image.set_brightness(arguments.brightness)
+        if arguments.contrast is not None:
+            image.set_contrast(arguments.contrast)
+        try:
+            if arguments.charset is not None:
+                image.set_charset(arguments.charset)
+            if arguments.color is not None:
+                image.set_color(arguments.color)
+            if arguments.mode is not None:
+                image.set_mode(arguments.mode)
+            image.render(keep=False, show_size=False)
+        except Exception as e:
+            print(f"Failed to render {command[1]}: {e}", file=sys.stderr)
+            return 1
+        return 0
+    failed = Main().run_script([shlex.join(command)], not arguments.verbose)
+    return 1 if failed else 0
+
+
+def parse_arguments(argv=None):
+    """Parse the command line options of the ASCII Art Studio."""
+    parser = argparse.ArgumentParser(description="ASCII Art Studio")
+    parser.add_argument(
+        "command",
+        nargs="*",
+        help="run one command and exit, e.g. render slalom.jpg --width 120",
+    )
+    parser.add_argument("--width", type=int, help="the width for render FILE")
+    parser.add_argument("--height", type=int, help="the height for render FILE")
+    parser.add_argument(
+        "--brightness", type=float, help="the brightness for render FILE"
+    )
+    parser.add_argument("--contrast", type=float, help="the contrast for render FILE")
+    parser.add_argument(
+        "--charset",
+        help="the charset for render FILE: short, long, blocks or the characters",
+    )
+    parser.add_argument(
+        "--color",
+        choices=COLOR_MODES + ("off",),
+        help="draw render FILE in 256 colors or truecolor",
+    )
+    parser.add_argument(
+        "--mode",
+        choices=RENDER_MODES,
+        help="dither render FILE (floyd or bayer) or draw its edges",
+    )
+    parser.add_argument(
+        "--script",
+        metavar="FILE",
+        help="run the commands in FILE without prompting, use - for stdin",
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="print status messages when running a script",
+    )
+    parser.add_argument(
+        "--timing",
+        action="store_true",
+        help="print how long each script command took to stderr",
+    )
+    parser.add_argument(
+        "--serve",
+        metavar="PORT",
+        type=int,
+        help="serve ASCII art over HTTP on PORT instead of reading commands",
+    )
+    parser.add_argument(
+        "--host",
+        default="127.0.0.1",
+        help="the address the server listens on (default: 127.0.0.1)",
+    )
+    return parser.parse_intermixed_args(argv)
+
 
 if __name__ == "__main__":
+    arguments = parse_arguments()
+    if arguments.command:
+        sys.exit(run_once(arguments))
     main = Main()
-    main.run()
+    if arguments.serve is not None:
+        server = RenderServer(main.studio, arguments.host, arguments.serve)
+        try:
+            asyncio.run(server.serve_forever())
+        except KeyboardInterrupt:
+            pass
+    elif arguments.script is None:
+        main.run()
+    else:
+        script = sys.stdin if arguments.script == "-" else open(arguments.script)
+        with script:
+            failed = main.run_script(script, not arguments.verbose, arguments.timing)
+        sys.exit(1 if failed else 0)
@@ -0,0 +1,676 @@
+# bench_ascii_art_studio.py
+
+import argparse
+import json
+import os
+import pickle
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+from ascii_art_studio import (
+    ASCII_CHARS,
+    ASCIIArtStudio,
+    ASCIIConverter,
+    ASCIIImage,
+    ColorEncoder,
+    DecodeCache,
+    RENDER_MODES,
+    SOURCE_STORE,
+    write_lines,
+)
+from contextlib import redirect_stdout
+from PIL import Image as PILImage
+import PIL
+
+BUNDLED_IMAGES = [
+    "dag.jpg",
+    "galaxy.jpg",
+    "grayscale.jpg",
+    "slalom.jpg",
+    "stadshuset.jpg",
+]
+
+# the widths convert_to_ascii is timed at by the suite
+SUITE_WIDTHS = (80, 200, 400)
+
+# the synthetic images of the suite, as name: size
+SYNTHETIC_SIZES = {"4k": (3840, 2160), "8k": (7680, 4320)}
+
+# benchmarks faster than this are mostly timer and scheduler noise, so compare
+# allows them to get this much slower instead of the threshold, if it is lower
+NOISY_BELOW_MS = 1.0
+NOISY_THRESHOLD = 1.0
+
+
+def per_pixel_convert(frame, chars=ASCII_CHARS):
+    """The original conversion, reading one pixel at a time with getpixel()."""
+    num_chars = len(chars)
+    width, height = frame.size
+    out = []
+    for y in range(height):
+        line = "".join(
+            chars[min(int(frame.getpixel((x, y)) / 255 * num_chars), num_chars - 1)]
+            for x in range(width)
+        )
+        out.append(line)
+    return out
+
+
+def best_of(func, repeat=5, number=3):
+    """Return the best time of a function call in milliseconds."""
+    return min(timeit.repeat(func, repeat=repeat, number=number)) / number * 1000
+
+
+def bench_convert(filename="grayscale.jpg", widths=(50, 100, 200, 400)):
+    """Compare the per-pixel conversion with the lookup table conversion."""
+    with PILImage.open(filename) as im:
+        image = im.convert("L")
+    converter = ASCIIConverter()
+
+    print(f"=== convert: {filename} ===")
+    print(
+        f"{'width':>6} {'cells':>8} {'per-pixel ms':>13} {'table ms':>9} {'speedup':>8}"
+    )
+    for width in widths:
+        height = round(width * image.height / image.width * 0.6)
+        frame = image.resize((width, height))
+        assert converter.convert(frame) == per_pixel_convert(frame)
+
+        slow = best_of(lambda: per_pixel_convert(frame), repeat=3, number=1)
+        fast = best_of(lambda: converter.convert(frame))
+        print(
+            f"{width:>6} {width * height:>8} {slow:>13.2f} {fast:>9.3f} {slow / fast:>7.0f}x"
+        )
+
+
+def bench_width_change(filename="grayscale.jpg", widths=(40, 80, 120, 200, 300)):
+    """Compare resizing from the full image with resizing from the image pyramid."""
+    image = ASCIIImage(filename)
+
+    print(f"=== width change: {filename} ===")
+    print(f"{'width':>6} {'full ms':>8} {'pyramid ms':>11} {'speedup':>8}")
+    for width in widths:
+        image.set_width(width)
+        size = (image.target_width, image.target_height)
+        full = best_of(lambda: image.image.resize(size))
+        pyramid = best_of(lambda: image.pyramid_level(size).resize(size))
+        print(f"{width:>6} {full:>8.2f} {pyramid:>11.3f} {full / pyramid:>7.0f}x")
+    print(f"pyramid memory: {image.pyramid_bytes()} bytes")
+
+
+# run in a fresh interpreter for each file, so that the peak memory is only its own
+LOAD_SCRIPT = """
+import json, sys, time
+from ascii_art_studio import ASCIIImage
+from contextlib import redirect_stdout
+from PIL import Image as PILImage
+import PIL
+
+def peak_rss_kb():
+    # ru_maxrss is kept across exec on Linux, so it would include the parent
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+
+filename, mode = sys.argv[1], sys.argv[2]
+start = time.perf_counter()
+if mode == "full":
+    with PILImage.open(filename) as im:
+        im.convert("L")
+    loaded = render = time.perf_counter()
+else:
+    image = ASCIIImage(filename, 100)
+    loaded = time.perf_counter()
+    image.render_frame()
+    render = time.perf_counter()
+print(json.dumps({
+    "load_ms": (loaded - start) * 1000,
+    "first_render_ms": (render - start) * 1000,
+    "peak_rss_kb": peak_rss_kb(),
+}))
+"""
+
+
+def bench_load(filenames=BUNDLED_IMAGES):
+    """Compare decoding the full image at load with decoding lazily in draft mode."""
+    print("=== load: full decode vs lazy draft decode at width 100 ===")
+    print(
+        f"{'file':>15} {'full ms':>8} {'full rss KB':>12} "
+        f"{'lazy load ms':>13} {'1st render ms':>14} {'lazy rss KB':>12}"
+    )
+    for filename in filenames:
+        results = {}
+        for mode in ("full", "lazy"):
+            output = subprocess.run(
+                [sys.executable, "-c", LOAD_SCRIPT, filename, mode],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+            results[mode] = json.loads(output.splitlines()[-1])
+        full, lazy = results["full"], results["lazy"]
+        print(
+            f"{filename:>15} {full['load_ms']:>8.2f} {full['peak_rss_kb']:>12} "
+            f"{lazy['load_ms']:>13.2f} {lazy['first_render_ms']:>14.2f} "
+            f"{lazy['peak_rss_kb']:>12}"
+        )
+
+
+def bench_startup(runs=10, width=120):
+    """Time importing the studio and rendering once from the command line."""
+    print("=== startup: import time and one-shot render ===")
+    import_times = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import ascii_art_studio"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stderr
+        for line in output.splitlines():
+            if line.endswith("| ascii_art_studio"):
+                import_times.append(int(line.split("|")[1]) / 1000)
+    print(f"import ascii_art_studio: {statistics.median(import_times):.1f} ms")
+
+    script = f"load image slalom.jpg as s\nset s width {width}\nrender s\n"
+    commands = {
+        "python -c pass": ([sys.executable, "-c", "pass"], None),
+        "--script render": (
+            [sys.executable, "ascii_art_studio.py", "--script", "-"],
+            script,
+        ),
+        "render FILE": (
+            [
+                sys.executable,
+                "ascii_art_studio.py",
+                "render",
+                "slalom.jpg",
+                "--width",
+                str(width),
+            ],
+            None,
+        ),
+    }
+    for name, (command, stdin) in commands.items():
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run(
+                command, input=stdin, capture_output=True, text=True, check=True
+            )
+            times.append((time.perf_counter() - start) * 1000)
+        print(f"{name:>16}: {statistics.median(times):.1f} ms")
+
+
+def write_distinct_copies(directory, copies):
+    """
+    Copy the bundled images into a directory, each copy with a different byte after
+    the end of the image. The copies decode to the same pixels, but have different
+    content hashes, so the source store does not share them.
+
+    Returns:
+        list[str]: The paths of the copies.
+    """
+    paths = []
+    for copy in range(copies):
+        for filename in BUNDLED_IMAGES:
+            with open(filename, "rb") as source:
+                data = source.read()
+            path = os.path.join(directory, f"{copy}_{filename}")
+            with open(path, "wb") as f:
+                f.write(data + bytes([copy]))
+            paths.append(path)
+    return paths
+
+
+def bench_batch(copies=4, width=120):
+    """Time a batch render of the bundled images with more and more workers."""
+    worker_counts = sorted({1, 2, 4, os.cpu_count() or 1})
+    with tempfile.TemporaryDirectory() as directory:
+        filenames = write_distinct_copies(directory, copies)
+
+        print(f"=== batch render: {len(filenames)} images at width {width} ===")
+        print(f"cpus: {os.cpu_count()}")
+        print(f"{'workers':>8} {'threads ms':>11} {'processes ms':>13}")
+        for workers in worker_counts:
+            times = []
+            for use_processes in (False, True):
+                # new images every time, so that decoding is part of the work
+                SOURCE_STORE.clear()
+                images = [ASCIIImage(filename, width) for filename in filenames]
+                start = time.perf_counter()
+                ASCIIArtStudio().convert_batch(images, workers, use_processes)
+                times.append((time.perf_counter() - start) * 1000)
+            print(f"{workers:>8} {times[0]:>11.1f} {times[1]:>13.1f}")
+
+
+def bench_ingest(copies=8):
+    """Time loading a directory of images with more and more workers."""
+    worker_counts = sorted({1, 2, 4, os.cpu_count() or 1})
+    with tempfile.TemporaryDirectory() as directory:
+        count = len(write_distinct_copies(directory, copies))
+
+        print(f"=== load dir: {count} images, decoded without the decode cache ===")
+        print(f"cpus: {os.cpu_count()}")
+        print(f"{'workers':>8} {'ms':>9} {'images/s':>9}")
+        for workers in worker_counts:
+            SOURCE_STORE.clear()
+            studio = ASCIIArtStudio()
+            studio.decode_cache = None
+            studio.verbose = False
+            start = time.perf_counter()
+            studio.add_directory_to_studio(directory, workers=workers)
+            elapsed = time.perf_counter() - start
+            print(f"{workers:>8} {elapsed * 1000:>9.1f} {count / elapsed:>9.1f}")
+
+
+def bench_aliases(filename="grayscale.jpg", aliases=(1, 4, 16), width=200):
+    """Show the decoded memory of one file loaded under more and more aliases."""
+    print(f"=== aliases of one file: {filename}, width {width} ===")
+    print(f"{'aliases':>8} {'decoded':>8} {'resident KB':>12} {'ms':>9}")
+    for count in aliases:
+        studio = ASCIIArtStudio()
+        studio.decode_cache = None
+        studio.verbose = False
+        start = time.perf_counter()
+        for alias in range(count):
+            studio.add_image_to_studio(filename, width, alias=f"a{alias}")
+            studio.images[f"a{alias}"].convert_to_ascii()
+        elapsed = time.perf_counter() - start
+        sources = {item.source_hash: item.source for item in studio.images.values()}
+        resident = sum(source.resident_bytes() for source in sources.values())
+        resident += sum(item.frame_bytes() for item in studio.images.values())
+        print(
+            f"{count:>8} {len(sources):>8} {resident / 1024:>12.1f} "
+            f"{elapsed * 1000:>9.1f}"
+        )
+
+
+def bench_stream(filename="grayscale.jpg", widths=(200, 1000, 2000)):
+    """Compare printing the joined ASCII art with streaming it row by row."""
+    print(f"=== streaming render: {filename} ===")
+    print(
+        f"{'width':>6} {'joined 1st row ms':>18} {'joined peak KB':>15} "
+        f"{'streamed 1st row ms':>20} {'streamed peak KB':>17}"
+    )
+    with open(os.devnull, "w") as devnull:
+        for width in widths:
+            image = ASCIIImage(filename, width)
+            image.render_frame()
+
+            tracemalloc.start()
+            start = time.perf_counter()
+            devnull.write("\n".join(image.convert_to_ascii()))
+            joined_first = (time.perf_counter() - start) * 1000
+            joined_peak = tracemalloc.get_traced_memory()[1] // 1024
+            tracemalloc.stop()
+
+            tracemalloc.start()
+            start = time.perf_counter()
+            lines = image.iter_ascii()
+            devnull.write(next(lines))
+            streamed_first = (time.perf_counter() - start) * 1000
+            write_lines(lines, devnull)
+            streamed_peak = tracemalloc.get_traced_memory()[1] // 1024
+            tracemalloc.stop()
+
+            print(
+                f"{width:>6} {joined_first:>18.2f} {joined_peak:>15} "
+                f"{streamed_first:>20.2f} {streamed_peak:>17}"
+            )
+
+
+def bench_session(filename="bench_session", width=100):
+    """Compare pickling the whole studio with the compact session format."""
+    studio = ASCIIArtStudio()
+    devnull = open(os.devnull, "w")
+    with redirect_stdout(devnull):
+        for image_file in BUNDLED_IMAGES:
+            studio.add_image_to_studio(image_file, width, alias=image_file)
+            studio.render_ascii_art(image_file)
+
+    def save_pickle():
+        with open(filename, "wb") as f:
+            pickle.dump(studio, f)
+
+    def load_pickle():
+        with open(filename, "rb") as f:
+            pickle.load(f)
+
+    def save_compact(include_ascii):
+        with redirect_stdout(devnull):
+            studio.save_session(filename, include_ascii)
+
+    def load_compact():
+        with redirect_stdout(devnull):
+            ASCIIArtStudio().load_session(filename)
+
+    print(
+        f"=== session: {len(BUNDLED_IMAGES)} bundled images rendered at width {width} ==="
+    )
+    print(f"{'format':>16} {'save ms':>8} {'load ms':>8} {'bytes':>9}")
+    for name, save, load in [
+        ("pickle", save_pickle, load_pickle),
+        ("compact", lambda: save_compact(False), load_compact),
+        ("compact + ascii", lambda: save_compact(True), load_compact),
+    ]:
+        save_ms = best_of(save)
+        size = os.path.getsize(filename)
+        load_ms = best_of(load)
+        print(f"{name:>16} {save_ms:>8.2f} {load_ms:>8.2f} {size:>9}")
+    os.remove(filename)
+    devnull.close()
+
+
+def bench_decode_cache(filenames=BUNDLED_IMAGES):
+    """Compare decoding the full image with mapping it from the decode cache."""
+    print("=== decode cache: full resolution ===")
+    print(f"{'file':>15} {'decode ms':>10} {'mapped ms':>10} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as directory:
+        cache = DecodeCache(directory)
+        for filename in filenames:
+            image = ASCIIImage(filename)
+            decode = best_of(image.load_image)
+            image.decode_cache = cache
+            image.load_image()
+            mapped = best_of(image.load_image)
+            print(
+                f"{filename:>15} {decode:>10.2f} {mapped:>10.3f} {decode / mapped:>7.0f}x"
+            )
+
+
+def bench_color(filename="stadshuset.jpg", widths=(80, 200)):
+    """Compare an escape before every character with coalesced color escapes."""
+    print(f"=== color: {filename}, escape per character vs coalesced ===")
+    print(
+        f"{'mode':>10} {'width':>6} {'naive KB':>9} {'naive ms':>9} "
+        f"{'coalesced KB':>13} {'coalesced ms':>13}"
+    )
+    with PILImage.open(filename) as im:
+        source = im.convert("RGB")
+    for mode in ("256", "truecolor"):
+        for width in widths:
+            frame = source.resize(
+                (width, round(width * source.height / source.width * 0.6))
+            )
+            ascii = ASCIIConverter().convert(frame.convert("L"))
+            encoder = ColorEncoder(mode)
+            colors = encoder.quantize(frame)
+            naive = encoder.encode_naive(ascii, colors)
+            rows = encoder.encode(ascii, colors)
+            naive_ms = best_of(
+                lambda: encoder.encode_naive(ascii, encoder.quantize(frame))
+            )
+            coalesced_ms = best_of(
+                lambda: encoder.encode(ascii, encoder.quantize(frame))
+            )
+            naive_kb = sum(len(row.encode()) + 1 for row in naive) / 1024
+            coalesced_kb = sum(len(row.encode()) + 1 for row in rows) / 1024
+            print(
+                f"{mode:>10} {width:>6} {naive_kb:>9.1f} {naive_ms:>9.2f} "
+                f"{coalesced_kb:>13.1f} {coalesced_ms:>13.2f}"
+            )
+
+
+def bench_modes(filename="stadshuset.jpg", widths=(100, 300)):
+    """Time the render modes on the same frame, to check they stay interactive."""
+    with PILImage.open(filename) as im:
+        source = im.convert("L")
+    print(f"=== render modes: {filename} ===")
+    print(f"{'mode':>6} {'width':>6} {'cells':>7} {'ms':>8} {'Mcells/s':>9}")
+    for width in widths:
+        frame = source.resize(
+            (width, round(width * source.height / source.width * 0.6))
+        )
+        cells = frame.width * frame.height
+        for mode in RENDER_MODES:
+            converter = ASCIIConverter(mode=mode)
+            ms = best_of(lambda: converter.convert(frame))
+            print(
+                f"{mode:>6} {width:>6} {cells:>7} {ms:>8.3f} "
+                f"{cells / ms / 1000:>9.1f}"
+            )
+
+
+def make_synthetic_images(directory, sizes=SYNTHETIC_SIZES):
+    """
+    Write the synthetic JPEGs of the suite. They are generated from a Mandelbrot
+    set and a radial gradient, so they are the same on every run.
+
+    Returns:
+        list[str]: The paths of the images.
+    """
+    paths = []
+    for name, size in sizes.items():
+        half = (size[0] // 2, size[1] // 2)
+        fractal = PILImage.effect_mandelbrot(half, (-2.0, -1.2, 1.0, 1.2), 64)
+        gradient = PILImage.radial_gradient("L").resize(half)
+        image = PILImage.merge("RGB", [fractal, gradient, fractal]).resize(size)
+        path = os.path.join(directory, f"synthetic_{name}.jpg")
+        image.save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+def measure(func, repeat=5):
+    """
+    Time a function call in milliseconds. Each sample calls it as many times as
+    timeit.Timer.autorange() needs to run for at least 0.2 s, so that fast calls
+    are not lost in the resolution of the timer.
+
+    Returns:
+        dict: The best and median time of one call, and the calls per sample.
+    """
+    timer = timeit.Timer(func)
+    loops, _ = timer.autorange()
+    times = [t / loops * 1000 for t in timer.repeat(repeat=repeat, number=loops)]
+    return {
+        "best_ms": min(times),
+        "median_ms": statistics.median(times),
+        "loops": loops,
+    }
+
+
+def run_suite(filenames, widths=SUITE_WIDTHS, repeat=5):
+    """
+    Time loading, converting, adjusting and saving sessions of the given images.
+
+    Returns:
+        dict: The timings of every benchmark, by benchmark name.
+    """
+    results = {}
+    devnull = open(os.devnull, "w")
+    directory = tempfile.TemporaryDirectory()
+    studio = ASCIIArtStudio()
+    # not the cache directory of the user
+    studio.decode_cache = DecodeCache(os.path.join(directory.name, "cache"))
+    for filename in filenames:
+        name = os.path.basename(filename)
+        image = ASCIIImage(filename, widths[0])
+        print(f"  {name}", file=sys.stderr)
+
+        size = image.target_size()
+        results[f"load_image/{name}/draft"] = measure(
+            lambda: image.load_image(size), repeat
+        )
+        results[f"load_image/{name}/full"] = measure(image.load_image, repeat)
+
+        def convert():
+            # resize from the pyramid again, as after a change of size
+            image.frame = None
+            image.convert_to_ascii()
+
+        for width in widths:
+            image.set_width(width)
+            image.convert_to_ascii()
+            results[f"convert_to_ascii/{name}/w{width}"] = measure(convert, repeat)
+
+        def adjust():
+            image.set_brightness(1.3)
+            image.set_contrast(1.2)
+            image.convert_to_ascii()
+
+        results[f"adjust/{name}/w{widths[-1]}"] = measure(adjust, repeat)
+
+        for mode in RENDER_MODES[1:]:
+            image.set_mode(mode)
+            results[f"mode/{name}/{mode}/w{widths[-1]}"] = measure(
+                image.convert_to_ascii, repeat
+            )
+        image.set_mode("plain")
+
+        with redirect_stdout(devnull):
+            studio.add_image_to_studio(filename, widths[0], alias=name)
+            studio.render_ascii_art(name)
+
+    session = os.path.join(directory.name, "session")
+    with redirect_stdout(devnull):
+        results["session/save"] = measure(lambda: studio.save_session(session), repeat)
+        results["session/load"] = measure(
+            lambda: ASCIIArtStudio().load_session(session), repeat
+        )
+    devnull.close()
+    directory.cleanup()
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Print the results next to a baseline and return the benchmarks that got slower.
+
+    The medians are compared, as the best time of a few samples moves more between
+    runs, and a benchmark only counts as slower if its best time got slower too.
+    Benchmarks whose baseline is under NOISY_BELOW_MS may get NOISY_THRESHOLD
+    slower, and are marked with a * in the table.
+
+    Args:
+        results (dict): The new timings, by benchmark name.
+        baseline (dict): The saved timings, by benchmark name.
+        threshold (float): How much slower than the baseline a benchmark may be,
+            e.g. 0.25 for 25 %.
+
+    Returns:
+        list[str]: The names of the benchmarks slower than the threshold allows.
+    """
+    regressions = []
+    print(f"{'benchmark':<40} {'baseline ms':>12} {'now ms':>9} {'change':>8}")
+    for name, result in results.items():
+        if name not in baseline:
+            print(f"{name:<40} {'-':>12} {result['median_ms']:>9.3f} {'new':>8}")
+            continue
+        before = baseline[name]["median_ms"]
+        now = result["median_ms"]
+        change = now / before - 1 if before else 0.0
+        allowed = threshold
+        flag = ""
+        if before < NOISY_BELOW_MS:
+            allowed = max(threshold, NOISY_THRESHOLD)
+            flag = " *"
+        best_before = baseline[name]["best_ms"]
+        best_change = result["best_ms"] / best_before - 1 if best_before else 0.0
+        if change > allowed and best_change > allowed:
+            regressions.append(name)
+            flag += "  SLOWER"
+        print(f"{name:<40} {before:>12.3f} {now:>9.3f} {change:>+7.0%}{flag}")
+    print(
+        f"* under {NOISY_BELOW_MS} ms, allowed to get "
+        f"{max(threshold, NOISY_THRESHOLD):.0%} slower"
+    )
+    return regressions
+
+
+def run_reports():
+    """Run the comparisons of the old and new code paths."""
+    bench_convert()
+    bench_width_change()
+    bench_load()
+    bench_startup()
+    bench_batch()
+    bench_ingest()
+    bench_aliases()
+    bench_stream()
+    bench_session()
+    bench_decode_cache()
+    bench_color()
+    bench_modes()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ASCII Art Studio benchmarks")
+    parser.add_argument("--json", metavar="FILE", help="write the results to FILE")
+    parser.add_argument(
+        "--compare", metavar="FILE", help="compare the results with a saved FILE"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="allowed slowdown against the baseline, default 0.25 (25 %%)",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="samples per benchmark, default 5"
+    )
+    parser.add_argument(
+        "--no-synthetic", action="store_true", help="skip the 4K and 8K images"
+    )
+    parser.add_argument(
+        "--reports",
+        action="store_true",
+        help="run the comparisons of old and new code paths instead of the suite",
+    )
+    arguments = parser.parse_args(argv)
+
+    if arguments.reports:
+        # the studios of the reports keep their decoded images out of the user's
+        # cache directory too, unless another one is set
+        with tempfile.TemporaryDirectory() as directory:
+            os.environ.setdefault("AAS_CACHE_DIR", directory)
+            run_reports()
+        return 0
+
+    with tempfile.TemporaryDirectory() as directory:
+        filenames = list(BUNDLED_IMAGES)
+        if not arguments.no_synthetic:
+            filenames += make_synthetic_images(directory)
+        results = run_suite(filenames, repeat=arguments.repeat)
+
+    output = {
+        "meta": {
+            "python": platform.python_version(),
+            "pillow": PIL.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "repeat": arguments.repeat,
+        },
+        "results": results,
+    }
+    if arguments.json:
+        with open(arguments.json, "w") as f:
+            json.dump(output, f, indent=2)
+
+    if arguments.compare:
+        with open(arguments.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, arguments.threshold)
+        if regressions:
+            print(f"{len(regressions)} benchmarks are slower than the baseline.")
+            return 1
+    else:
+        for name, result in results.items():
+            print(
+                f"{name:<40} {result['best_ms']:>9.3f} ms best "
+                f"{result['median_ms']:>9.3f} ms median "
+                f"{result['loops']:>6} loops"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
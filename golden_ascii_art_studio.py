@@ -0,0 +1,253 @@
+# golden_ascii_art_studio.py
+
+import argparse
+import os
+import sys
+
+from ascii_art_studio import ASCIIImage
+from PIL import Image as PILImage
+from PIL import ImageChops, ImageEnhance, ImageFilter, ImageStat
+
+# where the golden renders are kept, one text file per image and case
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "goldens")
+
+GOLDEN_IMAGES = [
+    "dag.jpg",
+    "galaxy.jpg",
+    "grayscale.jpg",
+    "slalom.jpg",
+    "stadshuset.jpg",
+]
+
+# the settings every bundled image is rendered with, by case name
+GOLDEN_CASES = {
+    "w80": {"width": 80},
+    "w120_long_adjusted": {
+        "width": 120,
+        "charset": "long",
+        "brightness": 1.2,
+        "contrast": 1.3,
+    },
+    "w60_blocks": {"width": 60, "charset": "blocks"},
+    "w80_floyd": {"width": 80, "mode": "floyd"},
+    "w80_bayer": {"width": 80, "mode": "bayer"},
+    "w80_edges": {"width": 80, "mode": "edges"},
+}
+
+# a render that is not the same as its golden still passes if at most this share of
+# its characters stand for another gray, and its grays are this close on average
+CHANGED_CELLS_TOLERANCE = 0.02
+GRAY_TOLERANCE = 2.0
+
+# every render must look at least this much like its source, see similarity(). The
+# bundled images score 0.95 or more, a render of one flat gray about 0.85
+MIN_SIMILARITY = 0.93
+
+
+def render_case(filename, settings):
+    """
+    Render an image file with the settings of a golden case.
+
+    Args:
+        filename (str): The path to the image file.
+        settings (dict): The width, and optionally the charset, brightness,
+            contrast and mode.
+
+    Returns:
+        tuple: The rows of the ASCII art and the ASCIIImage they came from.
+    """
+    image = ASCIIImage(filename, settings["width"])
+    image.set_brightness(settings.get("brightness", 1.0))
+    image.set_contrast(settings.get("contrast", 1.0))
+    if "charset" in settings:
+        image.set_charset(settings["charset"])
+    image.set_mode(settings.get("mode", "plain"))
+    return image.convert_to_ascii(), image
+
+
+def golden_path(filename, case):
+    """Return the path of the golden render of an image file for a case."""
+    name = os.path.splitext(os.path.basename(filename))[0]
+    return os.path.join(GOLDEN_DIR, f"{name}_{case}.txt")
+
+
+def read_golden(path):
+    """Return the rows of a golden render, or None if there is none."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return f.read().splitlines()
+    except FileNotFoundError:
+        return None
+
+
+def write_golden(path, ascii):
+    """Save the rows of a render as a golden render."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8", newline="\n") as f:
+        f.write("\n".join(ascii) + "\n")
+
+
+def reference_frame(filename, size, brightness=1.0, contrast=1.0):
+    """
+    Downsample an image file the straightforward way, independent of the studio's
+    pyramid, decode cache and lookup tables.
+
+    Args:
+        filename (str): The path to the image file.
+        size (tuple): The (width, height) of the ASCII art.
+        brightness (float, optional): The brightness factor. Defaults to 1.0.
+        contrast (float, optional): The contrast factor. Defaults to 1.0.
+
+    Returns:
+        PIL.Image.Image: The frame in "L" mode.
+    """
+    with PILImage.open(filename) as im:
+        frame = im.convert("L").resize(size, PILImage.Resampling.BOX)
+    frame = ImageEnhance.Brightness(frame).enhance(brightness)
+    return ImageEnhance.Contrast(frame).enhance(contrast)
+
+
+def similarity(ascii, frame, converter):
+    """
+    Score how much ASCII art looks like a frame, from 0 to 1.
+
+    The characters are turned back into the grays they stand for and both grids
+    are blurred over 3x3 cells before they are compared, so dithering, which only
+    moves gray between neighbouring cells, is not counted against a render.
+
+    Args:
+        ascii (list[str]): The rows of the ASCII art.
+        frame (PIL.Image.Image): The frame in "L" mode, the size of the ASCII art.
+        converter (ASCIIConverter): A converter with the charset of the ASCII art.
+
+    Returns:
+        float: 1 minus the mean difference in gray, divided by 255.
+    """
+    blur = ImageFilter.BoxBlur(1)
+    grays = converter.intensity_frame(ascii).filter(blur)
+    difference = ImageChops.difference(grays, frame.filter(blur))
+    return 1 - ImageStat.Stat(difference).mean[0] / 255
+
+
+def compare_render(golden, ascii, converter):
+    """
+    Compare a render with its golden render.
+
+    Args:
+        golden (list[str]): The rows of the golden render.
+        ascii (list[str]): The rows of the new render.
+        converter (ASCIIConverter): A converter with the charset of both.
+
+    Returns:
+        tuple: The share of characters that stand for another gray, and the mean
+            difference in gray over all characters. Both are 1.0 and 255.0 if the
+            renders do not have the same size.
+    """
+    if len(golden) != len(ascii) or any(
+        len(old) != len(new) for old, new in zip(golden, ascii)
+    ):
+        return 1.0, 255.0
+    difference = ImageChops.difference(
+        converter.intensity_frame(golden), converter.intensity_frame(ascii)
+    )
+    histogram = difference.histogram()
+    cells = sum(histogram)
+    changed = 1 - histogram[0] / cells if cells else 0.0
+    return changed, ImageStat.Stat(difference).mean[0] if cells else 0.0
+
+
+def check_case(filename, case, update=False):
+    """
+    Render an image file for a golden case and check it against the golden render
+    and against its source.
+
+    Args:
+        filename (str): The path to the image file.
+        case (str): The name of the case in GOLDEN_CASES.
+        update (bool, optional): Save the render as the new golden render first.
+            Defaults to False.
+
+    Returns:
+        dict: The name of the check, whether the render is the same as the golden
+            render, the share of changed characters, the mean gray difference, the
+            similarity to the source and whether it passed.
+    """
+    settings = GOLDEN_CASES[case]
+    ascii, image = render_case(filename, settings)
+    path = golden_path(filename, case)
+    if update:
+        write_golden(path, ascii)
+    golden = read_golden(path)
+
+    converter = image.converter()
+    frame = reference_frame(
+        filename,
+        image.target_size(),
+        settings.get("brightness", 1.0),
+        settings.get("contrast", 1.0),
+    )
+    score = similarity(ascii, frame, converter)
+    if golden is None:
+        changed, gray = 1.0, 255.0
+    else:
+        changed, gray = compare_render(golden, ascii, converter)
+    return {
+        "name": os.path.basename(path),
+        "exact": golden == ascii,
+        "changed": changed,
+        "gray": gray,
+        "similarity": score,
+        "passed": (
+            golden is not None
+            and changed <= CHANGED_CELLS_TOLERANCE
+            and gray <= GRAY_TOLERANCE
+            and score >= MIN_SIMILARITY
+        ),
+    }
+
+
+def check_all(filenames=GOLDEN_IMAGES, cases=GOLDEN_CASES, update=False):
+    """
+    Check every image file against its golden renders and print a table.
+
+    Returns:
+        list[dict]: The results of check_case(), one per image file and case.
+    """
+    print(
+        f"{'golden':<36} {'exact':>6} {'changed':>8} {'gray':>6} "
+        f"{'similarity':>11} {'result':>7}"
+    )
+    results = []
+    for filename in filenames:
+        for case in cases:
+            result = check_case(filename, case, update)
+            results.append(result)
+            print(
+                f"{result['name']:<36} {'yes' if result['exact'] else 'no':>6} "
+                f"{result['changed']:>8.2%} {result['gray']:>6.2f} "
+                f"{result['similarity']:>11.3f} "
+                f"{'pass' if result['passed'] else 'FAIL':>7}"
+            )
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ASCII Art Studio golden renders")
+    parser.add_argument(
+        "--update",
+        action="store_true",
+        help="save the current renders as the golden renders",
+    )
+    arguments = parser.parse_args(argv)
+
+    results = check_all(update=arguments.update)
+    failed = [result["name"] for result in results if not result["passed"]]
+    if failed:
+        print(f"{len(failed)} of {len(results)} renders failed: {', '.join(failed)}")
+        return 1
+    print(f"All {len(results)} renders passed.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,76 @@
 # test_ascii_art_studio.py
 
+import asyncio
+import gzip
+import io
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import types
 import unittest
+from unittest import mock
+from contextlib import redirect_stderr, redirect_stdout
 
-from ascii_art_studio import ASCIIArtStudio, ASCIIImage
+from ascii_art_studio import (
+    ANSI_CLEAR,
+    ANSI_CLEAR_LINE,
+    ANSI_HOME,
+    ANSI_RESET,
+    ASCII_CHARS,
+    CHARSETS,
+    ColorEncoder,
+    ASCIIArtStudio,
+    ASCIIConverter,
+    ASCIIImage,
+    AnimationPlayer,
+    DecodeCache,
+    DeltaWriter,
+    Main,
+    RenderCache,
+    RenderServer,
+    RenderStats,
+    SOURCE_STORE,
+    add_profile_hook,
+    parse_arguments,
+    remove_profile_hook,
+    run_once,
+)
+from golden_ascii_art_studio import (
+    GOLDEN_CASES,
+    GOLDEN_IMAGES,
+    check_case,
+    compare_render,
+    reference_frame,
+    render_case,
+    similarity,
+)
 from PIL import Image as PILImage
+from PIL import ImageChops, ImageEnhance, ImageStat
 import os
-import pickle
+import re
+
+
+def setUpModule():
+    """Keep the decode cache of the tests out of the user's cache directory."""
+    global cache_directory
+    cache_directory = tempfile.mkdtemp()
+    os.environ["AAS_CACHE_DIR"] = cache_directory
+
+
+def tearDownModule():
+    del os.environ["AAS_CACHE_DIR"]
+    shutil.rmtree(cache_directory)
 
 
 class TestASCIIArtStudio(unittest.TestCase):
 
     def setUp(self):
         """Set up a test environment for each test method."""
+        # images of earlier tests must not share their decoded image with this one
+        SOURCE_STORE.clear()
         self.studio = ASCIIArtStudio()
         self.pickle_filename = "test_session.pkl"
         self.test_image_path = (
@@ -30,6 +89,8 @@ class TestASCIIArtStudio(unittest.TestCase):
             os.remove(self.test_image_path)
         if os.path.exists(self.pickle_filename):
             os.remove(self.pickle_filename)
+        # release the decoded images, which are shared with later tests otherwise
+        del self.studio
 
     def test_initialization(self):
         """Test that the studio initializes correctly."""
@@ -53,6 +114,143 @@ class TestASCIIArtStudio(unittest.TestCase):
         self.studio.save_session(self.pickle_filename)
         self.assertTrue(os.path.exists(self.pickle_filename))
 
+    def test_load_directory(self):
+        """Test that load dir decodes every image, names them and lists failures once."""
+        directory = tempfile.mkdtemp()
+        try:
+            for name in ["slalom.jpg", "grayscale.jpg"]:
+                shutil.copy(name, directory)
+            os.mkdir(os.path.join(directory, "sub"))
+            shutil.copy("slalom.jpg", os.path.join(directory, "sub", "my slalom.jpg"))
+            with open(os.path.join(directory, "broken.png"), "w") as f:
+                f.write("not an image")
+
+            self.studio.images["slalom"] = None
+            with redirect_stdout(io.StringIO()) as output:
+                aliases = self.studio.add_directory_to_studio(directory, workers=2)
+            self.assertEqual(aliases, ["grayscale", "slalom_2"])
+            failures = [
+                line for line in output.getvalue().splitlines() if "broken.png" in line
+            ]
+            self.assertEqual(len(failures), 1)
+            self.assertIn("1 of 3 images could not be loaded", output.getvalue())
+            image = self.studio.images["slalom_2"]
+            self.assertIsNotNone(image._image)
+            self.assertEqual(image.stats.name, "slalom_2")
+
+            main = Main()
+            main.run_script([f'load dir {directory} "**/*.jpg"'])
+            self.assertEqual(
+                sorted(main.studio.images), ["grayscale", "my_slalom", "slalom"]
+            )
+        finally:
+            shutil.rmtree(directory)
+
+    def test_load_directory_rate_counts_loaded_images(self):
+        """Test that the images/s of load dir leaves out the files that failed."""
+        directory = tempfile.mkdtemp()
+        try:
+            shutil.copy("slalom.jpg", directory)
+            for name in ("a.png", "b.png", "c.png"):
+                with open(os.path.join(directory, name), "w") as f:
+                    f.write("not an image")
+            # the clock reads 0 when loading starts and 2 seconds later after that
+            calls = []
+
+            def clock():
+                calls.append(None)
+                return 0.0 if len(calls) == 1 else 2.0
+
+            with mock.patch("time.perf_counter", clock):
+                with redirect_stdout(io.StringIO()) as output:
+                    self.studio.add_directory_to_studio(directory, workers=1)
+            self.assertIn(
+                "Loaded 1 images in 2.00 s (0.5 images/s).", output.getvalue()
+            )
+        finally:
+            shutil.rmtree(directory)
+
+    def test_export_is_incremental(self):
+        """Test that export writes the art to files and skips unchanged images."""
+        directory = tempfile.mkdtemp()
+        try:
+            self.studio.verbose = False
+            self.studio.add_image_to_studio("slalom.jpg", alias="slalom")
+            self.studio.add_image_to_studio("grayscale.jpg", alias="gray")
+            exported, skipped = self.studio.export_images(["all"], directory)
+            self.assertEqual((exported, skipped), (["slalom", "gray"], []))
+            with open(os.path.join(directory, "slalom.txt")) as f:
+                expected = self.studio.images["slalom"].convert_to_ascii()
+                self.assertEqual(f.read(), "\n".join(expected) + "\n")
+
+            self.studio.set_image_brightness("gray", 1.5)
+            exported, skipped = self.studio.export_images(["all"], directory)
+            self.assertEqual((exported, skipped), (["gray"], ["slalom"]))
+            exported, _ = self.studio.export_images(["all"], directory, "txt", True)
+            self.assertEqual(exported, ["slalom", "gray"])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_export_names_are_unique_per_alias(self):
+        """Test that aliases with the same file name export to different files."""
+        directory = tempfile.mkdtemp()
+        try:
+            self.studio.verbose = False
+            for subdirectory in ("d1", "d2"):
+                os.mkdir(os.path.join(directory, subdirectory))
+            shutil.copy("slalom.jpg", os.path.join(directory, "d1", "a.jpg"))
+            shutil.copy("grayscale.jpg", os.path.join(directory, "d2", "a.jpg"))
+            for alias in ("d1/a.jpg", "d2/a.jpg", "d1_a.jpg"):
+                filename = os.path.join(directory, alias.replace("_", "/"))
+                self.studio.add_image_to_studio(filename, alias=alias)
+            filenames = self.studio.export_filenames("txt")
+            self.assertEqual(
+                filenames,
+                {
+                    "d1/a.jpg": "d1_a.jpg.txt",
+                    "d2/a.jpg": "d2_a.jpg.txt",
+                    "d1_a.jpg": "d1_a.jpg_2.txt",
+                },
+            )
+
+            output = os.path.join(directory, "out")
+            exported, _ = self.studio.export_images(["all"], output)
+            self.assertEqual(len(exported), 3)
+            for alias, filename in filenames.items():
+                with open(os.path.join(output, filename)) as f:
+                    expected = self.studio.images[alias].convert_to_ascii()
+                    self.assertEqual(f.read(), "\n".join(expected) + "\n")
+            with open(os.path.join(output, ".aas_export.json")) as f:
+                manifest = f.read()
+            for alias, filename in filenames.items():
+                self.assertIn(f'"{alias}": {{"{filename}": ', manifest)
+            _, skipped = self.studio.export_images(["all"], output)
+            self.assertEqual(skipped, exported)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_export_html_with_colors(self):
+        """Test that html export escapes the art and turns colors into spans."""
+        directory = tempfile.mkdtemp()
+        try:
+            main = Main()
+            main.run_script(
+                [
+                    "load image slalom.jpg as s",
+                    "set s color 256",
+                    'set s charset "<&. "',
+                    f"export s {directory} --format html --gzip",
+                ]
+            )
+            with gzip.open(os.path.join(directory, "s.html.gz"), "rt") as f:
+                page = f.read()
+            self.assertIn('<span style="color: #', page)
+            self.assertIn("&lt;", page)
+            self.assertNotIn("\x1b", page)
+            self.assertEqual(os.listdir(directory).count(".aas_export.json"), 1)
+        finally:
+            shutil.rmtree(directory)
+
     def test_save_and_load_session(self):
         """Test that the state of the studio is preserved after saving and loading a session."""
         # Set up some state in the studio
@@ -61,14 +259,84 @@ class TestASCIIArtStudio(unittest.TestCase):
         # Save the studio's state
         self.studio.save_session(self.pickle_filename)
 
-        # Load the studio's state from the pickle file
-        with open(self.pickle_filename, "rb") as f:
-            loaded_studio = pickle.load(f)
+        # Load the studio's state from the session file
+        loaded_studio = ASCIIArtStudio()
+        loaded_studio.load_session(self.pickle_filename)
 
         # Verify that the loaded state matches the original state
         self.assertIn("test_image", loaded_studio.images)
         self.assertEqual(len(loaded_studio.images), len(self.studio.images))
 
+    def test_session_keeps_settings_without_decoding(self):
+        """Test that a loaded session has the same settings and decodes lazily."""
+        self.studio.add_image_to_studio("slalom.jpg", alias="slalom")
+        self.studio.set_image_width("slalom", 80)
+        self.studio.set_image_contrast("slalom", 1.2)
+        expected = self.studio.images["slalom"].convert_to_ascii()
+        key = self.studio.images["slalom"].render_key()
+        self.studio.save_session(self.pickle_filename)
+        self.assertLess(os.path.getsize(self.pickle_filename), 1000)
+        # a new session would share the image decoded by this one
+        self.studio = ASCIIArtStudio()
+
+        loaded_studio = ASCIIArtStudio()
+        loaded_studio.load_session(self.pickle_filename)
+        image = loaded_studio.images["slalom"]
+        self.assertIs(loaded_studio.current_image, image)
+        self.assertIsNone(image._image)
+        self.assertEqual(image.render_key(), key)
+        self.assertEqual(image.convert_to_ascii(), expected)
+
+    def test_session_with_ascii_fills_render_cache(self):
+        """Test that ASCII art saved in a session is rendered without converting."""
+        self.studio.add_image_to_studio(self.test_image_path, alias="test_image")
+        self.studio.render_ascii_art("test_image")
+        self.studio.save_session(self.pickle_filename, include_ascii=True)
+        self.studio = ASCIIArtStudio()
+
+        loaded_studio = ASCIIArtStudio()
+        loaded_studio.load_session(self.pickle_filename)
+        loaded_studio.render_ascii_art("test_image")
+        self.assertEqual(loaded_studio.render_cache.hits, 1)
+        self.assertIsNone(loaded_studio.images["test_image"]._image)
+
+    def test_load_legacy_pickle_session(self):
+        """Test that a session pickled by the first version of the studio still loads."""
+        # fixtures/legacy_session.pkl was saved by the first version after loading
+        # fixtures/legacy.png with width 24 and setting its brightness to 1.5
+        loaded_studio = ASCIIArtStudio()
+        loaded_studio.load_session(os.path.join("fixtures", "legacy_session.pkl"))
+        image = loaded_studio.images["legacy"]
+        self.assertEqual(image.source_size, (48, 32))
+        self.assertEqual(image.charset, ASCII_CHARS)
+        # the brightness is already applied to the pickled image
+        self.assertEqual(image.brightness, 1.0)
+        with PILImage.open(os.path.join("fixtures", "legacy.png")) as im:
+            brightened = ImageEnhance.Brightness(im.convert("L")).enhance(1.5)
+        self.assertEqual(image.image.tobytes(), brightened.tobytes())
+
+        with redirect_stdout(io.StringIO()):
+            loaded_studio.render_ascii_art("legacy")
+        expected = ASCIIConverter().convert(brightened.resize((24, 10)))
+        self.assertEqual(image.ascii, expected)
+
+    def test_session_detects_changed_image_file(self):
+        """Test that an image file changed after saving is noticed when decoded."""
+        self.studio.add_image_to_studio(self.test_image_path, alias="test_image")
+        self.studio.save_session(self.pickle_filename)
+        PILImage.new("RGB", (60, 30), color="blue").save(self.test_image_path)
+
+        loaded_studio = ASCIIArtStudio()
+        loaded_studio.load_session(self.pickle_filename)
+        image = loaded_studio.images["test_image"]
+        with redirect_stderr(io.StringIO()) as errors:
+            with redirect_stdout(io.StringIO()) as output:
+                image.convert_to_ascii()
+        self.assertEqual(output.getvalue(), "")
+        self.assertIn("has changed since the session was saved", errors.getvalue())
+        self.assertEqual(image.source_size, (60, 30))
+        self.assertEqual(image.source_hash, image.hash_file())
+
     def test_set_image_height(self):
         """Test setting an image height."""
         self.studio.add_image_to_studio(self.test_image_path, alias="test_image")
@@ -127,6 +395,1051 @@ class TestASCIIArtStudio(unittest.TestCase):
                 "!Make sure you have the file DO_NOT_DELETE_saturn.jpg in the same folder!"
             )
 
+    def test_adjustments_do_not_compound(self):
+        """Test that setting the same brightness twice equals setting it once."""
+        self.studio.add_image_to_studio("slalom.jpg", alias="once")
+        self.studio.add_image_to_studio("slalom.jpg", alias="twice")
+        self.studio.set_image_brightness("once", 1.5)
+        self.studio.set_image_brightness("twice", 1.5)
+        self.studio.set_image_brightness("twice", 1.5)
+        self.assertEqual(
+            self.studio.images["once"].convert_to_ascii(),
+            self.studio.images["twice"].convert_to_ascii(),
+        )
+
+    def test_adjustments_keep_source_image(self):
+        """Test that brightness and contrast do not change the loaded image."""
+        self.studio.add_image_to_studio("slalom.jpg", alias="slalom")
+        image = self.studio.images["slalom"]
+        original = image.image.tobytes()
+        image.set_brightness(1.3)
+        image.set_contrast(0.7)
+        image.convert_to_ascii()
+        self.assertEqual(image.image.tobytes(), original)
+
+    def test_adjusted_frame_matches_full_resolution(self):
+        """Test that adjusting the small frame is close to adjusting the full image."""
+        self.studio.add_image_to_studio("slalom.jpg", target_width=100, alias="slalom")
+        image = self.studio.images["slalom"]
+        image.set_brightness(1.3)
+        image.set_contrast(1.4)
+        frame = image.render_frame()
+        brightened = ImageEnhance.Brightness(image.image).enhance(1.3)
+        expected = ImageEnhance.Contrast(brightened).enhance(1.4).resize(frame.size)
+        difference = ImageStat.Stat(ImageChops.difference(frame, expected)).mean[0]
+        self.assertLess(difference, 4)
+
+    def test_tone_table_matches_image_enhance(self):
+        """Test that the tone table gives exactly the pixels of ImageEnhance."""
+        self.studio.add_image_to_studio("slalom.jpg", target_width=120, alias="slalom")
+        image = self.studio.images["slalom"]
+        frame = image.resized_frame()
+        for brightness, contrast in [(1.3, 1.4), (0.7, 1.0), (1.0, 0.35), (2.2, 2.7)]:
+            image.set_brightness(brightness)
+            image.set_contrast(contrast)
+            brightened = ImageEnhance.Brightness(frame).enhance(brightness)
+            expected = ImageEnhance.Contrast(brightened).enhance(contrast)
+            self.assertEqual(image.render_frame().tobytes(), expected.tobytes())
+
+    def test_tone_change_does_not_resize_again(self):
+        """Test that changing brightness or contrast reuses the resized frame."""
+        self.studio.add_image_to_studio("slalom.jpg", alias="slalom")
+        image = self.studio.images["slalom"]
+        image.convert_to_ascii()
+        image.set_brightness(1.4)
+        image.set_contrast(0.8)
+        image.convert_to_ascii()
+        self.assertEqual(image.stats.counts["resize"], 1)
+        image.set_width(70)
+        image.convert_to_ascii()
+        self.assertEqual(image.stats.counts["resize"], 2)
+
+    def test_tone_table_ascii_matches_full_path(self):
+        """Test that the ASCII art is close to enhancing the full image first."""
+        self.studio.add_image_to_studio("dag.jpg", target_width=100, alias="dag")
+        image = self.studio.images["dag"]
+        image.set_brightness(1.2)
+        image.set_contrast(1.5)
+        ascii = "".join(image.convert_to_ascii())
+
+        with PILImage.open("dag.jpg") as im:
+            full = im.convert("L")
+        full = ImageEnhance.Brightness(full).enhance(1.2)
+        full = ImageEnhance.Contrast(full).enhance(1.5)
+        frame = full.resize(image.resized_frame().size)
+        expected = "".join(ASCIIConverter().convert(frame))
+
+        differences = [
+            abs(ASCII_CHARS.index(a) - ASCII_CHARS.index(b))
+            for a, b in zip(ascii, expected)
+        ]
+        self.assertLess(sum(differences) / len(differences), 0.3)
+
+    def test_pyramid_resize_matches_direct_resize(self):
+        """Test that resizing from a pyramid level is close to resizing the full image."""
+        self.studio.add_image_to_studio("grayscale.jpg", alias="gray")
+        image = self.studio.images["gray"]
+        image.decode_for(image.source_size)
+        for size in [(50, 22), (120, 54), (400, 180)]:
+            level = image.pyramid_level(size)
+            self.assertGreaterEqual(level.width, size[0])
+            self.assertGreaterEqual(level.height, size[1])
+            self.assertLess(level.width, image.image.width)
+            difference = ImageChops.difference(
+                level.resize(size), image.image.resize(size)
+            )
+            self.assertLess(ImageStat.Stat(difference).mean[0], 2)
+
+    def test_pyramid_memory_is_bounded(self):
+        """Test that the pyramid uses less memory than a third of the image."""
+        self.studio.add_image_to_studio("grayscale.jpg", alias="gray")
+        image = self.studio.images["gray"]
+        image.pyramid_level((1, 1))
+        self.assertLessEqual(
+            image.pyramid_bytes(), image.image.width * image.image.height / 3
+        )
+        self.assertIsNone(image.__getstate__()["frame"])
+        self.assertNotIn("pyramid", image.__getstate__())
+
+    def test_load_does_not_decode(self):
+        """Test that loading an image only reads its header."""
+        self.studio.add_image_to_studio("grayscale.jpg", alias="gray")
+        image = self.studio.images["gray"]
+        self.assertIsNone(image._image)
+        self.assertEqual(image.source_size, (2000, 1500))
+        self.assertEqual(image.target_height, 22)
+
+    def test_aliases_share_decoded_image(self):
+        """Test that aliases of the same file decode it once and release it when gone."""
+        self.studio.add_image_to_studio("grayscale.jpg", alias="a")
+        self.studio.add_image_to_studio("grayscale.jpg", target_width=200, alias="b")
+        a, b = self.studio.images["a"], self.studio.images["b"]
+        a.convert_to_ascii()
+        self.assertIs(b._image, a._image)
+        b.convert_to_ascii()
+        self.assertIs(a._image, b._image)
+        self.assertGreaterEqual(a._image.width, 200)
+        self.assertEqual(SOURCE_STORE.entries[a.source_hash].refs, 2)
+
+        with redirect_stdout(io.StringIO()) as output:
+            self.studio.studio_info()
+        resident = a.source.resident_bytes() + a.frame_bytes() + b.frame_bytes()
+        self.assertIn(
+            f"Resident image memory: {resident} bytes, 1 decoded images for 2 aliases",
+            output.getvalue(),
+        )
+
+        source_hash = a.source_hash
+        del a, b
+        self.studio.images.clear()
+        self.studio.current_image = None
+        self.assertNotIn(source_hash, SOURCE_STORE.entries)
+
+    def test_clear_source_store(self):
+        """Test that images created after a clear decode again, and old ones keep theirs."""
+        self.studio.add_image_to_studio("grayscale.jpg", alias="a")
+        a = self.studio.images["a"]
+        a.convert_to_ascii()
+        self.assertEqual(SOURCE_STORE.clear(), 1)
+        self.studio.add_image_to_studio("grayscale.jpg", alias="b")
+        b = self.studio.images["b"]
+        self.assertIsNot(b.source, a.source)
+        self.assertIsNone(b._image)
+        self.assertIsNotNone(a._image)
+
+        del a
+        self.studio.images.pop("a")
+        self.assertIs(SOURCE_STORE.entries[b.source_hash], b.source)
+
+    def test_render_decodes_jpeg_at_reduced_scale(self):
+        """Test that a small render decodes a smaller JPEG, and a large one decodes more."""
+        self.studio.add_image_to_studio("grayscale.jpg", alias="gray")
+        image = self.studio.images["gray"]
+        image.convert_to_ascii()
+        self.assertEqual(image.image.size, (250, 188))
+
+        image.set_width(600)
+        image.convert_to_ascii()
+        self.assertEqual(image.image.size, (1000, 750))
+
+    def test_reduced_decode_matches_full_decode(self):
+        """Test that the frame from a reduced decode is close to one from a full decode."""
+        self.studio.add_image_to_studio("grayscale.jpg", target_width=120, alias="gray")
+        image = self.studio.images["gray"]
+        frame = image.render_frame()
+        with PILImage.open("grayscale.jpg") as im:
+            expected = im.convert("L").resize(frame.size)
+        difference = ImageStat.Stat(ImageChops.difference(frame, expected)).mean[0]
+        self.assertLess(difference, 2)
+
+    def test_render_cache_hit(self):
+        """Test that rendering the same image twice converts it only once."""
+        self.studio.add_image_to_studio(self.test_image_path, alias="test_image")
+        self.studio.render_ascii_art("test_image")
+        self.studio.render_ascii_art("test_image")
+        self.assertEqual(self.studio.render_cache.misses, 1)
+        self.assertEqual(self.studio.render_cache.hits, 1)
+
+    def test_setter_invalidates_only_its_image(self):
+        """Test that changing one image keeps the cached renders of other images."""
+        self.studio.add_image_to_studio(self.test_image_path, alias="a")
+        self.studio.add_image_to_studio("slalom.jpg", alias="b")
+        self.studio.render_ascii_art("a")
+        self.studio.render_ascii_art("b")
+        self.studio.set_image_width("a", 20)
+        self.assertEqual(len(self.studio.render_cache), 1)
+        self.studio.render_ascii_art("b")
+        self.assertEqual(self.studio.render_cache.hits, 1)
+
+    def test_setter_keeps_entry_shared_by_another_alias(self):
+        """Test that an entry used by another alias of the same file is kept."""
+        self.studio.add_image_to_studio(self.test_image_path, alias="a")
+        self.studio.add_image_to_studio(self.test_image_path, alias="b")
+        self.studio.render_ascii_art("a")
+        self.studio.set_image_brightness("a", 1.5)
+        self.studio.render_ascii_art("b")
+        self.assertEqual(self.studio.render_cache.hits, 1)
+
+    def test_render_batch_matches_serial_render(self):
+        """Test that a batch render gives the same art as rendering one by one."""
+        for name in ["slalom", "stadshuset", "galaxy"]:
+            self.studio.add_image_to_studio(f"{name}.jpg", alias=name)
+        expected = [
+            self.studio.images[name].convert_to_ascii()
+            for name in ["galaxy", "slalom", "stadshuset"]
+        ]
+        for use_processes in [False, True]:
+            images = [
+                self.studio.images[name] for name in ["galaxy", "slalom", "stadshuset"]
+            ]
+            studio = ASCIIArtStudio()
+            self.assertEqual(studio.convert_batch(images, 2, use_processes), expected)
+
+    def test_render_batch_prints_in_given_order(self):
+        """Test that a batch render prints the images in the order they were given."""
+        self.studio.add_image_to_studio("slalom.jpg", target_width=10, alias="slalom")
+        self.studio.add_image_to_studio("galaxy.jpg", target_width=10, alias="galaxy")
+        output = io.StringIO()
+        with redirect_stdout(output):
+            self.studio.render_batch(["galaxy", "slalom"], workers=2)
+        expected = io.StringIO()
+        with redirect_stdout(expected):
+            self.studio.images["galaxy"].render()
+            self.studio.images["slalom"].render()
+        self.assertEqual(output.getvalue(), expected.getvalue())
+        self.assertEqual(self.studio.render_cache.misses, 2)
+
+    def test_streamed_render_matches_conversion(self):
+        """Test that streaming the rows gives the same ASCII art as converting at once."""
+        self.studio.add_image_to_studio("slalom.jpg", target_width=120, alias="slalom")
+        image = self.studio.images["slalom"]
+        expected = image.convert_to_ascii()
+        self.assertEqual(list(image.iter_ascii()), expected)
+
+        output = io.StringIO()
+        with redirect_stdout(io.StringIO()):
+            image.render(stream=output)
+        self.assertEqual(output.getvalue(), "\n".join(expected) + "\n")
+        self.assertEqual(image.ascii, expected)
+
+    def test_large_render_is_streamed_without_caching(self):
+        """Test that a render larger than the cache limit is not kept."""
+        self.studio.render_cache.max_cells = 100
+        self.studio.add_image_to_studio("slalom.jpg", target_width=40, alias="slalom")
+        with redirect_stdout(io.StringIO()) as output:
+            self.studio.render_ascii_art("slalom")
+        self.assertEqual(len(self.studio.render_cache), 0)
+        self.assertEqual(self.studio.images["slalom"].ascii, [])
+        self.assertEqual(len(output.getvalue().splitlines()), 1 + 16)
+
+    def test_render_records_every_stage(self):
+        """Test that a render times every stage and calls the profile hooks."""
+        events = []
+
+        def hook(name, stage, seconds, size):
+            events.append((name, stage))
+
+        add_profile_hook(hook)
+        try:
+            # without the decode cache, so that the file is really decoded
+            self.studio.decode_cache = None
+            self.studio.add_image_to_studio("slalom.jpg", alias="slalom")
+            with redirect_stdout(io.StringIO()):
+                self.studio.render_ascii_art("slalom")
+        finally:
+            remove_profile_hook(hook)
+
+        stats = self.studio.images["slalom"].stats
+        for stage in RenderStats.STAGES:
+            self.assertEqual(stats.counts[stage], 1)
+            self.assertIn(("slalom", stage), events)
+        self.assertEqual(stats.peak_pixels, 91 * 61)
+
+    def test_stats_command(self):
+        """Test that the stats command prints a table for every image."""
+        main = Main()
+        with redirect_stdout(io.StringIO()) as output:
+            main.run_script(["load image slalom.jpg as s", "render s", "stats"])
+        self.assertIn("resize         1 runs", output.getvalue())
+
+    def test_render_cache_evicts_least_recently_used(self):
+        """Test that the cache stays bounded and counts evictions."""
+        cache = RenderCache(max_entries=2)
+        cache.put("a", ["a"])
+        cache.put("b", ["b"])
+        cache.get("a")
+        cache.put("c", ["c"])
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), ["a"])
+        self.assertEqual(cache.evictions, 1)
+
+
+class TestDecodeCache(unittest.TestCase):
+
+    def setUp(self):
+        SOURCE_STORE.clear()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_second_load_maps_cached_image(self):
+        """Test that a new image of the same file maps the decoded pixels from disk."""
+        cache = DecodeCache(self.directory)
+        first = ASCIIImage("grayscale.jpg", 100, decode_cache=cache)
+        expected = first.convert_to_ascii()
+        self.assertEqual(cache.misses, 1)
+        decoded = first.image.tobytes()
+        # otherwise the second image shares the image decoded by the first
+        del first
+
+        second = ASCIIImage(
+            "grayscale.jpg", 100, decode_cache=DecodeCache(self.directory)
+        )
+        self.assertEqual(second.convert_to_ascii(), expected)
+        self.assertEqual(second.decode_cache.hits, 1)
+        self.assertEqual(second.image.tobytes(), decoded)
+        self.assertTrue(second.image.readonly)
+
+    def test_cache_evicts_least_recently_used(self):
+        """Test that the cache stays below its size by removing the oldest images."""
+        cache = DecodeCache(self.directory, max_bytes=70_000)
+        for width, filename in [(100, "slalom.jpg"), (100, "stadshuset.jpg")]:
+            ASCIIImage(filename, width, decode_cache=cache).convert_to_ascii()
+        ASCIIImage("galaxy.jpg", 400, decode_cache=cache).convert_to_ascii()
+        self.assertGreater(cache.evictions, 0)
+        self.assertLessEqual(sum(size for _, size, _ in cache.entries()), 70_000)
+
+    def test_cache_command_clears(self):
+        """Test that cache clear removes every cached image."""
+        main = Main()
+        main.studio.decode_cache = DecodeCache(self.directory)
+        with redirect_stdout(io.StringIO()) as output:
+            main.run_script(["load image slalom.jpg as s", "render s", "cache"])
+        self.assertIn("Decode cache: 1 images", output.getvalue())
+        self.assertTrue(os.path.exists(os.path.join(self.directory, "hashes.json")))
+        main.run_script(["cache clear"])
+        self.assertEqual(main.studio.decode_cache.entries(), [])
+        self.assertFalse(os.path.exists(os.path.join(self.directory, "hashes.json")))
+
+    def test_hash_index_keeps_one_entry_per_file(self):
+        """Test that the hash index is written in batches and drops stale entries."""
+        index = os.path.join(self.directory, "hashes.json")
+        filename = os.path.join(self.directory, "a.png")
+        PILImage.new("L", (8, 8), 10).save(filename)
+        cache = DecodeCache(self.directory)
+        first = cache.file_hash(filename)
+        self.assertFalse(os.path.exists(index))
+        cache.save_hashes()
+
+        PILImage.new("L", (8, 8), 200).save(filename)
+        os.utime(filename, ns=(1, 1))
+        cache = DecodeCache(self.directory)
+        second = cache.file_hash(filename)
+        self.assertNotEqual(first, second)
+        self.assertEqual(cache.file_hash(filename), second)
+        cache.save_hashes()
+        with open(index) as f:
+            self.assertEqual(list(json.load(f)), [os.path.abspath(filename)])
+
+        os.remove(filename)
+        self.assertEqual(DecodeCache(self.directory).read_hashes(), {})
+
+
+class TestASCIIConverter(unittest.TestCase):
+
+    def per_pixel_convert(self, frame, chars=ASCII_CHARS):
+        """The original conversion, reading one pixel at a time."""
+        num_chars = len(chars)
+        width, height = frame.size
+        return [
+            "".join(
+                chars[min(int(frame.getpixel((x, y)) / 255 * num_chars), num_chars - 1)]
+                for x in range(width)
+            )
+            for y in range(height)
+        ]
+
+    def test_table_matches_per_pixel_for_every_value(self):
+        """Test that every pixel value maps to the same character as before."""
+        gradient = PILImage.new("L", (256, 1))
+        gradient.putdata(range(256))
+        self.assertEqual(
+            ASCIIConverter().convert(gradient), self.per_pixel_convert(gradient)
+        )
+
+    def test_convert_matches_per_pixel_on_photo(self):
+        """Test that a resized photo converts byte for byte like before."""
+        with PILImage.open("slalom.jpg") as im:
+            frame = im.convert("L").resize((80, 32))
+        self.assertEqual(ASCIIConverter().convert(frame), self.per_pixel_convert(frame))
+
+    def test_banded_convert_matches_serial(self):
+        """Test that converting in bands on several workers gives identical lines."""
+        with PILImage.open("grayscale.jpg") as im:
+            frame = im.convert("L").resize((300, 203))
+        converter = ASCIIConverter()
+        expected = converter.convert(frame)
+        for band_height in [1, 7, 64, 203]:
+            self.assertEqual(converter.convert(frame, 4, band_height), expected)
+
+    def test_named_charsets_match_per_pixel(self):
+        """Test that the long and the block shade ramps map like the per-pixel formula."""
+        with PILImage.open("slalom.jpg") as im:
+            frame = im.convert("L").resize((90, 30))
+        for name in ["short", "long", "blocks"]:
+            converter = ASCIIConverter(CHARSETS[name])
+            expected = self.per_pixel_convert(frame, CHARSETS[name])
+            self.assertEqual(converter.convert(frame), expected)
+            self.assertEqual(list(converter.iter_lines(frame, band_height=7)), expected)
+            self.assertEqual(converter.convert(frame, 3, 7), expected)
+
+    def test_charset_tables_are_shared(self):
+        """Test that converters with the same charset share one lookup table."""
+        self.assertIs(
+            ASCIIConverter(CHARSETS["long"]).table,
+            ASCIIConverter(CHARSETS["long"]).table,
+        )
+
+    def test_set_charset_command(self):
+        """Test that set charset takes names and characters, and refuses empty ones."""
+        main = Main()
+        with redirect_stderr(io.StringIO()) as output:
+            main.run_script(
+                [
+                    "load image slalom.jpg as s",
+                    "set s charset blocks",
+                    'set s charset ""',
+                ]
+            )
+        image = main.studio.images["s"]
+        self.assertEqual(image.charset, CHARSETS["blocks"])
+        self.assertIn("Invalid value for charset.", output.getvalue())
+        image.set_charset("@o. ")
+        self.assertEqual(set("".join(image.convert_to_ascii())), set("@o. "))
+
+    def test_dither_modes_keep_brightness(self):
+        """Test that dithering mixes neighbouring characters but keeps the average."""
+        frame = PILImage.new("L", (64, 32), 100)
+        index = {char: i for i, char in enumerate(ASCII_CHARS)}
+        plain = ASCIIConverter(ASCII_CHARS).convert(frame)
+        self.assertEqual(len(set("".join(plain))), 1)
+        # 100 lies between the middles of characters 3 and 4, at 0.42 of the way
+        for mode in ["floyd", "bayer"]:
+            rows = ASCIIConverter(ASCII_CHARS, mode=mode).convert(frame)
+            cells = [index[char] for char in "".join(rows)]
+            self.assertEqual(set(cells), {3, 4}, mode)
+            self.assertAlmostEqual(sum(cells) / len(cells), 3.42, delta=0.05)
+
+        # a pixel in the middle of a character is not dithered at all
+        middle = PILImage.new("L", (64, 32), round(7.5 * 255 / len(ASCII_CHARS)))
+        for mode in ["floyd", "bayer"]:
+            rows = ASCIIConverter(ASCII_CHARS, mode=mode).convert(middle)
+            self.assertEqual(set("".join(rows)), {ASCII_CHARS[7]}, mode)
+
+    def test_edges_mode_draws_edge_directions(self):
+        """Test that edges are drawn with the character of their direction."""
+        size = (24, 12)
+        cases = [
+            (lambda x, y: x >= 12, "|"),
+            (lambda x, y: y >= 6, "-"),
+            (lambda x, y: x + y >= 12, "/"),
+            (lambda x, y: x - y >= 6, "\\"),
+        ]
+        for bright, glyph in cases:
+            frame = PILImage.frombytes(
+                "L",
+                size,
+                bytes(
+                    255 if bright(x, y) else 0
+                    for y in range(size[1])
+                    for x in range(size[0])
+                ),
+            )
+            for chars in [ASCII_CHARS, CHARSETS["blocks"]]:
+                plain = "".join(ASCIIConverter(chars).convert(frame))
+                text = "".join(ASCIIConverter(chars, mode="edges").convert(frame))
+                edges = [char for char, p in zip(text, plain) if char != p]
+                self.assertGreater(len(edges), 6, glyph)
+                self.assertEqual(set(edges), {glyph}, glyph)
+        flat = PILImage.new("L", size, 128)
+        self.assertEqual(
+            ASCIIConverter(mode="edges").convert(flat), ASCIIConverter().convert(flat)
+        )
+
+    def test_set_mode_command(self):
+        """Test that set mode changes the ASCII art, is saved, and refuses bad modes."""
+        main = Main()
+        with redirect_stderr(io.StringIO()) as output:
+            main.run_script(
+                [
+                    "load image slalom.jpg as s",
+                    "render s",
+                    "set s mode floyd",
+                    "render s",
+                    "set s mode sketchy",
+                ]
+            )
+        image = main.studio.images["s"]
+        self.assertEqual(image.mode, "floyd")
+        self.assertEqual(main.studio.render_cache.hits, 0)
+        self.assertIn("Invalid value for mode.", output.getvalue())
+        self.assertEqual(
+            ASCIIImage.from_record(image.to_record("s")).render_key(),
+            image.render_key(),
+        )
+        with self.assertRaises(ValueError):
+            ASCIIConverter(mode="sketchy")
+
+    def test_image_workers_do_not_change_output(self):
+        """Test that setting workers on an image keeps its ASCII art the same."""
+        studio = ASCIIArtStudio()
+        studio.add_image_to_studio("slalom.jpg", target_width=200, alias="slalom")
+        expected = studio.images["slalom"].convert_to_ascii()
+        studio.set_image_workers("slalom", 3)
+        studio.set_image_band_height("slalom", 10)
+        self.assertEqual(studio.images["slalom"].convert_to_ascii(), expected)
+
+
+class TestAnimationPlayer(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.temp_dir, "anim.gif")
+        frames = [
+            PILImage.radial_gradient("L").rotate(i * 60).resize((64, 48))
+            for i in range(6)
+        ]
+        frames[0].save(
+            self.filename, save_all=True, append_images=frames[1:], duration=40
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_iter_frames_converts_every_frame(self):
+        """Test that every frame is converted at the target size with its duration."""
+        image = ASCIIImage(self.filename, target_width=30)
+        frames = list(image.iter_frames())
+        self.assertEqual(len(frames), 6)
+        with PILImage.open(self.filename) as im:
+            im.seek(3)
+            expected = ASCIIConverter().convert(
+                im.convert("L").resize(image.target_size())
+            )
+        self.assertEqual(frames[3], (expected, 0.04))
+
+    def test_play_shows_every_frame_in_time(self):
+        """Test that a player that keeps up draws every frame at its deadline."""
+        clock = [0.0]
+
+        def sleep(seconds):
+            clock[0] += seconds
+
+        stream = io.StringIO()
+        player = AnimationPlayer(
+            ASCIIImage(self.filename, target_width=30),
+            fps=25,
+            loops=2,
+            stream=stream,
+            clock=lambda: clock[0],
+            sleep=sleep,
+        )
+        report = player.play()
+        self.assertEqual(report["shown"], 12)
+        self.assertEqual(report["dropped"], 0)
+        self.assertAlmostEqual(report["seconds"], 11 / 25)
+        self.assertEqual(stream.getvalue().count("\x1b[H"), 12)
+
+    def test_play_drops_late_frames(self):
+        """Test that a player that falls behind shows the newest frame and drops the rest."""
+        clock = [0.0]
+        converted = threading.Event()
+        frames = list(ASCIIImage(self.filename, target_width=30).iter_frames())
+
+        def iter_frames():
+            yield from frames
+            converted.set()
+
+        def slow_clock():
+            converted.wait()
+            clock[0] += 0.05
+            return clock[0]
+
+        image = types.SimpleNamespace(iter_frames=iter_frames)
+        stream = io.StringIO()
+        player = AnimationPlayer(
+            image, fps=50, stream=stream, clock=slow_clock, sleep=lambda seconds: None
+        )
+        report = player.play()
+        self.assertEqual((report["shown"], report["dropped"]), (2, 4))
+        self.assertTrue(stream.getvalue().endswith("\n".join(frames[-1][0]) + "\n"))
+
+    def test_play_slow_conversion_shows_every_frame(self):
+        """Test that frames which take longer to convert than to show are not dropped."""
+        clock = [0.0]
+        frames = list(ASCIIImage(self.filename, target_width=30).iter_frames())
+
+        def iter_frames():
+            for frame in frames:
+                clock[0] += 0.05
+                yield frame
+
+        image = types.SimpleNamespace(iter_frames=iter_frames)
+        player = AnimationPlayer(
+            image,
+            fps=30,
+            stream=io.StringIO(),
+            clock=lambda: clock[0],
+            sleep=lambda seconds: None,
+        )
+        report = player.play()
+        self.assertEqual((report["shown"], report["dropped"]), (6, 0))
+
+
+class TestColorEncoder(unittest.TestCase):
+    def visible_colors(self, row):
+        """Return the (character, color escape) of every character that shows a color."""
+        cells = []
+        color = None
+        for escape, text in re.findall(r"(\x1b\[[0-9;]*m)?([^\x1b]*)", row):
+            color = escape or color
+            cells.extend((char, color) for char in text if char != " ")
+        return cells
+
+    def test_encode_coalesces_and_keeps_colors(self):
+        """Test that runs share an escape and every character keeps its own color."""
+        with PILImage.open("stadshuset.jpg") as im:
+            frame = im.convert("RGB").resize((80, 30))
+        ascii = ASCIIConverter().convert(frame.convert("L"))
+        for mode in ["256", "truecolor"]:
+            encoder = ColorEncoder(mode)
+            colors = encoder.quantize(frame)
+            rows = encoder.encode(ascii, colors)
+            naive = encoder.encode_naive(ascii, colors)
+            for row, naive_row, line in zip(rows, naive, ascii):
+                self.assertEqual(re.sub(r"\x1b\[[0-9;]*m", "", row), line)
+                self.assertEqual(
+                    self.visible_colors(row), self.visible_colors(naive_row)
+                )
+            self.assertEqual(encoder.naive, sum(len(row) + 1 for row in naive))
+            self.assertLess(encoder.written * 2, encoder.naive)
+
+    def test_256_colors_use_the_nearest_cube_color(self):
+        """Test that colors map to the nearest level of the 6x6x6 color cube."""
+        frame = PILImage.new("RGB", (3, 1))
+        frame.putdata([(0, 0, 0), (255, 255, 255), (100, 180, 20)])
+        colors = ColorEncoder("256").quantize(frame)
+        self.assertEqual(list(colors[0]), [16, 231, 16 + 36 * 1 + 6 * 3 + 0])
+
+    def test_color_setting(self):
+        """Test that set color renders escapes, changes the cache key and is saved."""
+        main = Main()
+        with redirect_stderr(io.StringIO()) as output:
+            main.run_script(
+                ["load image slalom.jpg as s", "set s color 256", "set s color pink"]
+            )
+        image = main.studio.images["s"]
+        self.assertEqual(image.color, "256")
+        self.assertIn("Invalid value for color.", output.getvalue())
+        self.assertIn("\x1b[38;5;", "".join(image.convert_to_ascii()))
+        self.assertEqual(image.to_record("s")["color"], "256")
+        key = image.render_key()
+        image.set_color("off")
+        self.assertNotEqual(image.render_key(), key)
+
+
+class TestDeltaWriter(unittest.TestCase):
+    def test_first_frame_is_drawn_in_full(self):
+        """Test that the first frame clears the screen and draws all rows."""
+        stream = io.StringIO()
+        written, full = DeltaWriter().write(["@@@@", "...."], stream)
+        self.assertEqual(stream.getvalue(), "\x1b[2J\x1b[H@@@@\n....\n")
+        self.assertEqual(full, 10)
+        self.assertEqual(written, len(stream.getvalue()))
+
+    def test_small_change_writes_only_changed_span(self):
+        """Test that a small change moves the cursor to the changed span only."""
+        writer = DeltaWriter()
+        old = ["@" * 40] * 10
+        new = list(old)
+        new[3] = "@" * 5 + "..." + "@" * 32
+        writer.encode(old)
+        self.assertEqual(writer.encode(new), "\x1b[4;6H...\x1b[11;1H")
+        self.assertEqual(writer.encode(new), "\x1b[11;1H")
+
+    def test_large_change_or_new_size_redraws(self):
+        """Test that a large change redraws in place and a new size clears first."""
+        writer = DeltaWriter()
+        writer.encode(["@@@@", "@@@@"])
+        self.assertEqual(writer.encode(["....", "...."]), "\x1b[H....\n....\n")
+        self.assertEqual(writer.encode(["...."]), "\x1b[2J\x1b[H....\n")
+        writer.forget()
+        self.assertTrue(writer.encode(["...."]).startswith("\x1b[2J"))
+
+    def test_delta_renders_of_two_images_share_the_screen(self):
+        """Test that a delta render is drawn over the last frame of any image."""
+        main = Main()
+        script = [
+            "load image slalom.jpg as a",
+            "load image slalom.jpg as b",
+            "set a width 40",
+            "set b width 40",
+            "set b brightness 1.3",
+            "render a --delta",
+            "render b --delta",
+            "render a --delta",
+        ]
+        with redirect_stdout(io.StringIO()) as output:
+            self.assertEqual(main.run_script(script), 0)
+        a = main.studio.images["a"].convert_to_ascii()
+        b = main.studio.images["b"].convert_to_ascii()
+        writer = DeltaWriter()
+        expected = writer.encode(a) + writer.encode(b) + writer.encode(a)
+        self.assertEqual(output.getvalue(), expected)
+
+    def test_other_output_redraws_in_full(self):
+        """Test that a delta render after anything else was printed draws all rows."""
+        main = Main()
+        script = ["load image slalom.jpg as a", "render a --delta", "render a"]
+        with redirect_stdout(io.StringIO()):
+            main.run_script(script)
+        with redirect_stdout(io.StringIO()) as output:
+            main.run_script(["render a --delta", "help", "render a --delta"])
+        art = "\n".join(main.studio.images["a"].convert_to_ascii()) + "\n"
+        self.assertTrue(output.getvalue().startswith(ANSI_CLEAR + ANSI_HOME + art))
+        self.assertTrue(output.getvalue().endswith(ANSI_CLEAR + ANSI_HOME + art))
+
+    def test_studio_delta_render_reports_bytes(self):
+        """Test that a repeated delta render of an unchanged image writes almost nothing."""
+        studio = ASCIIArtStudio()
+        studio.decode_cache = None
+        studio.add_image_to_studio("slalom.jpg", alias="slalom")
+        with redirect_stdout(io.StringIO()):
+            studio.render_ascii_art("slalom", delta=True)
+        with redirect_stdout(io.StringIO()) as output:
+            studio.render_ascii_art("slalom", delta=True)
+        self.assertIn("Wrote 7 bytes", output.getvalue())
+        self.assertLess(
+            studio.delta_writer.bytes_written, studio.delta_writer.bytes_full * 2
+        )
+
+    def test_delta_render_from_color_to_plain(self):
+        """Test that turning color off between delta renders rewrites the colored rows."""
+        main = Main()
+        with redirect_stdout(io.StringIO()) as output:
+            failed = main.run_script(
+                [
+                    "load image slalom.jpg as s",
+                    "set s color 256",
+                    "render s --delta",
+                    "set s color off",
+                    "render s --delta",
+                ]
+            )
+        self.assertEqual(failed, 0)
+        plain = main.studio.images["s"].convert_to_ascii()
+        colored = ["\x1b[38;5;16m" + row + ANSI_RESET for row in plain]
+        spans = DeltaWriter.changed_spans(colored, plain)
+        self.assertEqual(
+            spans, [(row, 0, line + ANSI_CLEAR_LINE) for row, line in enumerate(plain)]
+        )
+
+
+class TestRenderServer(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = RenderServer(port=0, max_pending=1)
+        self.server.studio.verbose = False
+        await self.server.start()
+
+    async def asyncTearDown(self):
+        await self.server.close()
+
+    async def request(self, target, body=b"", length=None):
+        """Send one request to the server and return the status and the body."""
+        reader, writer = await asyncio.open_connection("127.0.0.1", self.server.port)
+        method = "POST" if body else "GET"
+        if length is None:
+            length = len(body)
+        writer.write(
+            f"{method} {target} HTTP/1.1\r\nContent-Length: {length}\r\n\r\n".encode()
+            + body
+        )
+        response = await reader.read()
+        writer.close()
+        head, _, payload = response.partition(b"\r\n\r\n")
+        return int(head.split()[1]), payload.decode()
+
+    async def test_render_path_and_upload(self):
+        """Test that a path and an uploaded image render like the studio does."""
+        image = ASCIIImage("slalom.jpg", target_width=40)
+        image.set_contrast(1.5)
+        expected = "\n".join(image.convert_to_ascii()) + "\n"
+        status, payload = await self.request(
+            "/render?path=slalom.jpg&width=40&contrast=1.5"
+        )
+        self.assertEqual((status, payload), (200, expected))
+        with open("slalom.jpg", "rb") as file:
+            upload = file.read()
+        status, payload = await self.request("/render?width=40&contrast=1.5", upload)
+        self.assertEqual((status, payload), (200, expected))
+
+    async def test_bad_requests(self):
+        """Test that missing files, paths outside the root and bad values are refused."""
+        self.assertEqual((await self.request("/render?path=missing.jpg"))[0], 404)
+        self.assertEqual((await self.request("/render?path=../etc/passwd"))[0], 404)
+        self.assertEqual(
+            (await self.request("/render?path=slalom.jpg&width=x"))[0], 400
+        )
+        self.assertEqual((await self.request("/render", b"not an image"))[0], 400)
+        self.assertEqual((await self.request("/other"))[0], 404)
+        self.assertEqual((await self.request("/render", b"image", -5))[0], 400)
+        huge = "/render?path=slalom.jpg&width=100000&height=100000"
+        self.assertEqual((await self.request(huge))[0], 400)
+
+    async def test_long_header_and_idle_client_are_answered(self):
+        """Test that a header over the line limit gets 431 and an idle client 408."""
+        reader, writer = await asyncio.open_connection("127.0.0.1", self.server.port)
+        writer.write(b"GET /render HTTP/1.1\r\nX-Long: " + b"x" * 70000 + b"\r\n\r\n")
+        response = await reader.read()
+        writer.close()
+        self.assertTrue(response.startswith(b"HTTP/1.1 431 "))
+
+        self.server.read_timeout = 0.05
+        reader, writer = await asyncio.open_connection("127.0.0.1", self.server.port)
+        writer.write(b"GET /render HTTP/1.1\r\n")
+        response = await asyncio.wait_for(reader.read(), 5)
+        writer.close()
+        self.assertTrue(response.startswith(b"HTTP/1.1 408 "))
+
+    async def test_too_large_art_is_refused(self):
+        """Test that art of more than max_cells characters is refused, also by width."""
+        self.server.max_cells = 40 * 20
+        status, payload = await self.request("/render?path=slalom.jpg&width=60")
+        self.assertEqual(status, 400)
+        self.assertIn("more than 800 characters", payload)
+        status, _ = await self.request("/render?path=slalom.jpg&width=40&height=20")
+        self.assertEqual(status, 200)
+
+    async def test_broken_file_prints_no_help(self):
+        """Test that a file that is not an image is refused without printing help."""
+        with redirect_stderr(io.StringIO()) as errors:
+            with redirect_stdout(io.StringIO()) as output:
+                status, _ = await self.request("/render?path=README.MD")
+        self.assertEqual(status, 400)
+        self.assertEqual((output.getvalue(), errors.getvalue()), ("", ""))
+
+    async def test_identical_requests_are_coalesced(self):
+        """Test that identical requests share one conversion and then hit the cache."""
+        params = {"path": "slalom.jpg", "width": "60"}
+        first, second = await asyncio.gather(
+            self.server.render(params), self.server.render(params)
+        )
+        self.assertEqual(first, second)
+        await self.server.render(params)
+        metrics = self.server.metrics()
+        self.assertEqual(metrics["rendered"], 1)
+        self.assertEqual(metrics["coalesced"], 1)
+        self.assertEqual(metrics["cache_hits"], 1)
+
+    async def test_too_many_conversions_are_refused(self):
+        """Test that a conversion beyond max_pending is refused with 503."""
+        results = await asyncio.gather(
+            self.server.render({"path": "slalom.jpg"}),
+            self.server.render({"path": "grayscale.jpg"}),
+            return_exceptions=True,
+        )
+        self.assertIsInstance(results[0], list)
+        self.assertEqual(results[1].status, 503)
+        status, _ = await self.request("/render?path=grayscale.jpg")
+        self.assertEqual(status, 200)
+
+
+class TestGoldenRenders(unittest.TestCase):
+    def setUp(self):
+        # a render must not depend on how earlier tests decoded the same file
+        SOURCE_STORE.clear()
+
+    def test_renders_match_goldens(self):
+        """Test that every bundled image renders like its golden renders."""
+        for filename in GOLDEN_IMAGES:
+            for case in GOLDEN_CASES:
+                with self.subTest(filename=filename, case=case):
+                    result = check_case(filename, case)
+                    self.assertTrue(result["passed"], result)
+
+    def test_small_changes_are_within_tolerance(self):
+        """Test that a few changed characters are measured, and a shift is not small."""
+        ascii, image = render_case("slalom.jpg", {"width": 80})
+        converter = image.converter()
+        self.assertEqual(compare_render(ascii, ascii, converter), (0.0, 0.0))
+
+        changed = list(ascii)
+        changed[5] = ASCII_CHARS[0] * 10 + changed[5][10:]
+        cells, gray = compare_render(ascii, changed, converter)
+        self.assertGreater(cells, 0)
+        self.assertLessEqual(cells, 10 / (len(ascii) * len(ascii[0])))
+        self.assertGreater(gray, 0)
+
+        shifted = ascii[3:] + ascii[:3]
+        self.assertGreater(compare_render(ascii, shifted, converter)[0], 0.1)
+        self.assertEqual(compare_render(ascii, ascii[1:], converter), (1.0, 255.0))
+
+    def test_similarity_prefers_the_right_render(self):
+        """Test that a render is more like its source than a flat or inverted one."""
+        ascii, image = render_case("stadshuset.jpg", {"width": 80})
+        converter = image.converter()
+        frame = reference_frame("stadshuset.jpg", image.target_size())
+        flat = [ASCII_CHARS[5] * len(row) for row in ascii]
+        inverted = [
+            row.translate(str.maketrans(ASCII_CHARS, ASCII_CHARS[::-1]))
+            for row in ascii
+        ]
+        score = similarity(ascii, frame, converter)
+        self.assertGreater(score, 0.95)
+        self.assertGreater(score, similarity(flat, frame, converter) + 0.1)
+        self.assertGreater(score, similarity(inverted, frame, converter) + 0.1)
+
+
+class TestScriptMode(unittest.TestCase):
+
+    def test_quiet_script_prints_only_ascii(self):
+        """Test that a quiet script prints the ASCII art and nothing else."""
+        main = Main()
+        script = ["load image slalom.jpg as s", "set s width 20", "", "render s"]
+        with redirect_stdout(io.StringIO()) as output:
+            failed = main.run_script(script)
+        self.assertEqual(failed, 0)
+        expected = "\n".join(main.studio.images["s"].convert_to_ascii()) + "\n"
+        self.assertEqual(output.getvalue(), expected)
+
+    def test_script_stops_at_quit_and_counts_errors(self):
+        """Test that quit ends a script without exiting, and failed commands are counted."""
+        main = Main()
+        script = ["# comment", "bogus", "quit", "load image slalom.jpg as s"]
+        with redirect_stderr(io.StringIO()) as errors:
+            failed = main.run_script(script)
+        self.assertEqual(failed, 1)
+        self.assertIn("Unknown command.", errors.getvalue())
+        self.assertFalse(main.command_handler.running)
+        self.assertEqual(main.studio.images, {})
+
+    def test_script_counts_unbalanced_quote(self):
+        """Test that a line with an unbalanced quote fails without ending the script."""
+        main = Main()
+        script = ['load image "slalom.jpg as s', "load image slalom.jpg as s"]
+        with redirect_stderr(io.StringIO()) as errors:
+            failed = main.run_script(script)
+        self.assertEqual(failed, 1)
+        self.assertIn("No closing quotation", errors.getvalue())
+        self.assertIn("s", main.studio.images)
+
+    def test_save_session_needs_a_name(self):
+        """Test that save session without a name fails instead of naming the file."""
+        directory = tempfile.mkdtemp()
+        try:
+            main = Main()
+            name = os.path.join(directory, "s1")
+            script = [
+                "load image slalom.jpg as s",
+                "save session",
+                "save session as",
+                "save session --ascii",
+                f"save session as {name} --ascii",
+            ]
+            with redirect_stderr(io.StringIO()) as errors:
+                failed = main.run_script(script)
+            self.assertEqual(failed, 3)
+            self.assertIn("Usage: save session", errors.getvalue())
+            self.assertFalse(os.path.exists("session"))
+            self.assertFalse(os.path.exists("as"))
+            self.assertTrue(os.path.exists(name))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_play_option_without_value_is_refused(self):
+        """Test that play with an option but no number fails instead of playing."""
+        main = Main()
+        script = ["load image slalom.jpg as a", "play a loops", "play fps"]
+        with redirect_stderr(io.StringIO()) as errors:
+            with redirect_stdout(io.StringIO()) as output:
+                failed = main.run_script(script)
+        self.assertEqual(failed, 2)
+        self.assertEqual(errors.getvalue().count("Usage: play"), 2)
+        self.assertNotIn("\x1b[2J", output.getvalue())
+
+    def test_script_counts_printed_failures(self):
+        """Test that failures which are only printed count, and go to stderr."""
+        main = Main()
+        script = [
+            "load image nope.jpg as n",
+            "set n width 10",
+            "render n",
+            "render",
+            "load image slalom.jpg as s",
+        ]
+        with redirect_stderr(io.StringIO()) as errors:
+            with redirect_stdout(io.StringIO()) as output:
+                failed = main.run_script(script)
+        self.assertEqual(failed, 4)
+        self.assertEqual(output.getvalue(), "")
+        self.assertIn("Image file nope.jpg not found.", errors.getvalue())
+        self.assertIn("Image with alias 'n' does not exist.", errors.getvalue())
+        self.assertIn("No current image selected.", errors.getvalue())
+
+    def test_script_timing(self):
+        """Test that timing prints one line per command to stderr."""
+        main = Main()
+        with redirect_stderr(io.StringIO()) as timing:
+            with redirect_stdout(io.StringIO()):
+                main.run_script(["help", "help"], timing=True)
+        lines = timing.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].endswith("ms  help"))
+
+    def test_one_shot_render(self):
+        """Test that render FILE on the command line prints only the ASCII art."""
+        arguments = parse_arguments(["render", "--width", "30", "slalom.jpg"])
+        with redirect_stdout(io.StringIO()) as output:
+            self.assertEqual(run_once(arguments), 0)
+        expected = ASCIIImage("slalom.jpg", target_width=30).convert_to_ascii()
+        self.assertEqual(output.getvalue(), "\n".join(expected) + "\n")
+
+        with redirect_stdout(io.StringIO()):
+            self.assertEqual(run_once(parse_arguments(["render", "missing.jpg"])), 1)
+            self.assertEqual(run_once(parse_arguments(["help"])), 0)
+
+    def test_import_does_not_load_heavy_modules(self):
+        """Test that importing the studio leaves PIL and asyncio for the first use."""
+        code = (
+            "import sys, ascii_art_studio; "
+            "print([m for m in ('PIL', 'asyncio', 'concurrent.futures') "
+            "if m in sys.modules])"
+        )
+        output = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True
+        )
+        self.assertEqual(output.stdout.strip(), "[]")
+
 
 if __name__ == "__main__":
     unittest.main()